@@ -1,13 +1,20 @@
 import json
+import time
 
 from typing import Any
-from rich.console import Console
+from rich.console import Console, Group
+from rich.live import Live
 from rich.table import Table
 
 from vantage6.client import UserClient
 from vantage6.common import info, debug
+from vantage6.common.task_status import TaskStatus, has_task_finished
 
-IMAGE_NAME = "ghcr.io/vantage6/algorithm/diagnostic:v4"
+from cli.history import HistoryStore
+from v6_diagnostics.client import (
+    IMAGE_NAME, DiagnosticClient, OrganizationResult, fetch_all
+)
+from v6_diagnostics.encoding import SUMMARY, decode_results, is_summary
 
 
 class DiagnosticRunner:
@@ -17,40 +24,72 @@ class DiagnosticRunner:
         collaboration_id: int,
         organizations: int | str,
         online_only: bool = False,
+        timeout: float | None = None,
+        history: HistoryStore | None = None,
     ):
 
         self.client = client
         self.collaboration_id = collaboration_id
+        # organizations that have not finished after this many seconds are
+        # reported as timed out
+        self.timeout = timeout
+        # every displayed result is recorded in the history, if any
+        self.history = history
+        self.console = Console()
+        self.diagnostics = DiagnosticClient(client, collaboration_id)
 
         if isinstance(organizations, str):
-            # col = self.client.collaboration.get(self.collaboration_id)
-            # TODO get all organizations if multiple pages
-            orgs = self.client.organization.list(collaboration=self.collaboration_id)
-            self.organization_ids = [org["id"] for org in orgs["data"]]
+            orgs = fetch_all(
+                self.client.organization.list,
+                collaboration=self.collaboration_id
+            )
+            self.organization_ids = [org["id"] for org in orgs]
         elif isinstance(organizations, list | tuple):
             self.organization_ids = organizations
 
         if online_only:
-            nodes = self.client.node.list(
-                collaboration=self.collaboration_id, is_online=True
+            nodes = fetch_all(
+                self.client.node.list,
+                collaboration=self.collaboration_id,
+                is_online=True,
             )
             debug(nodes)
-            online_orgs = [node["organization"]["id"] for node in nodes["data"]]
-            self.organization_ids = list(
-                set(self.organization_ids).intersection(online_orgs)
-            )
+            online_orgs = {node["organization"]["id"] for node in nodes}
+            self.organization_ids = [
+                org_id for org_id in self.organization_ids
+                if org_id in online_orgs
+            ]
 
-        info(f"Running diagnostics to {len(self.organization_ids)} organization(s)")
+        info(
+            f"Running diagnostics to {len(self.organization_ids)} "
+            "organization(s)"
+        )
         info(f"  organizations: {self.organization_ids}")
         info(f"  collaboration: {self.collaboration_id}")
 
     def __call__(
         self, base: bool = True, vpn: bool = True, *args: Any, **kwds: Any
     ) -> Any:
-        return self.base_features()
+        return self.base_features(**kwds)
         # return self.base_features() | self.vpn_features()
 
-    def base_features(self) -> dict:
+    def base_features(self, proxy_benchmark: bool = False,
+                      subtask_benchmark: bool = False,
+                      payload_sweep: bool = False,
+                      compute_benchmark: bool = False,
+                      checks: list[str] | None = None,
+                      tags: list[str] | None = None) -> dict:
+        kwargs = {
+            "proxy_benchmark": proxy_benchmark,
+            "subtask_benchmark": subtask_benchmark,
+            "payload_sweep": payload_sweep,
+            "compute_benchmark": compute_benchmark,
+        }
+        # without a selection the algorithm runs its default checks
+        if checks:
+            kwargs["checks"] = list(checks)
+        if tags:
+            kwargs["tags"] = list(tags)
         task = self.client.task.create(
             collaboration=self.collaboration_id,
             name="test",
@@ -58,6 +97,7 @@ class DiagnosticRunner:
             image=IMAGE_NAME,
             input_={
                 "method": "base_features",
+                "kwargs": kwargs,
             },
             organizations=self.organization_ids,
             databases=[{"label": "default"}],
@@ -66,7 +106,8 @@ class DiagnosticRunner:
 
         return self._wait_and_display(task.get("id"))
 
-    def vpn_features(self) -> dict:
+    def vpn_features(self, mesh: bool = False, benchmark: bool = False) \
+            -> dict:
 
         self.client.node.list(collaboration=self.collaboration_id)
 
@@ -77,31 +118,150 @@ class DiagnosticRunner:
             image=IMAGE_NAME,
             input_={
                 "method": "vpn_features",
-                "kwargs": {"other_nodes": self.organization_ids},
+                "kwargs": {
+                    "other_nodes": self.organization_ids,
+                    "mesh": mesh,
+                    "benchmark": benchmark,
+                },
+            },
+            organizations=self.organization_ids,
+        )
+
+        return self._wait_and_display(task.get("id"))
+
+    def whitelisting_features(
+        self, allowed: list[str], disallowed: list[str] | None = None
+    ) -> dict:
+        task = self.client.task.create(
+            collaboration=self.collaboration_id,
+            name="test",
+            description="Whitelisting Diagnostic test",
+            image=IMAGE_NAME,
+            input_={
+                "method": "whitelisting_features",
+                "kwargs": {"allowed": allowed, "disallowed": disallowed},
+            },
+            organizations=self.organization_ids,
+        )
+
+        return self._wait_and_display(task.get("id"))
+
+    def ssh_tunnel_features(
+        self, tunnels: list[str | dict], benchmark: bool = False
+    ) -> dict:
+        task = self.client.task.create(
+            collaboration=self.collaboration_id,
+            name="test",
+            description="SSH Tunnel Diagnostic test",
+            image=IMAGE_NAME,
+            input_={
+                "method": "ssh_tunnel_features",
+                "kwargs": {"tunnels": tunnels, "benchmark": benchmark},
             },
             organizations=self.organization_ids,
         )
 
         return self._wait_and_display(task.get("id"))
 
-    def _wait_and_display(self, task_id: int) -> None:
-        # TODO should we have the option to combine these in one request? Seems
-        # like it would be more efficient
-        # TODO ensure that we get all pages of results
-        results = self.client.wait_for_results(task_id=task_id)["data"]
-        runs = self.client.run.from_task(task_id=task_id)["data"]
+    def _wait_and_display(self, task_id: int) -> list[dict]:
+        """
+        Display the results of each organization as soon as its run finishes.
+
+        The task is waited for with `DiagnosticClient.wait`, and a live view
+        shows which organizations are still pending, running or finished.
+        When the runner has a timeout, organizations that have not finished by
+        then are reported as timed out.
+
+        Parameters
+        ----------
+        task_id : int
+            ID of the diagnostic task.
+
+        Returns
+        -------
+        list[dict]
+            The results of the finished runs. Each contains the run id, the
+            organization id, the status and the (decoded) results.
+        """
+        start = time.monotonic()
+        results = []
         print("\n")
-        for res in results:
-            matched_run = [run for run in runs if run["id"] == res["run"]["id"]][0]
-            self.display_diagnostic_results(res, matched_run["organization"]["id"])
-            print()
+        with Live(
+            console=self.console, refresh_per_second=4, transient=True
+        ) as live:
+            report = self.diagnostics.wait(
+                task_id, self.timeout,
+                on_result=lambda organization: results.append(
+                    self._display_run(organization, task_id)
+                ),
+                on_status=lambda statuses: live.update(
+                    self._progress(statuses, start)
+                ),
+            )
+
+        if report.timed_out:
+            self.console.print(
+                f":hourglass: [yellow]Timed out after {self.timeout} seconds, "
+                f"no results from organization(s) {report.timed_out}[/yellow]"
+            )
         return results
 
+    def _display_run(self, organization: OrganizationResult, task_id: int) \
+            -> dict:
+        """Display the result of a finished run."""
+        org_id = organization.organization_id
+        result = {
+            "run": {"id": organization.run_id},
+            "organization_id": org_id,
+            "status": organization.status,
+            "result": [check.json for check in organization.checks],
+        }
+        if organization.status != TaskStatus.COMPLETED:
+            self.console.print(
+                f":x: [red]Diagnostics of organization {org_id} "
+                f"{organization.status}[/red]\n"
+            )
+            return result
+
+        self.display_diagnostic_results(result, org_id)
+        self.console.print()
+        if self.history is not None:
+            self.history.record(
+                self.collaboration_id, org_id, result["result"],
+                task_id=task_id
+            )
+        return result
+
+    @staticmethod
+    def _progress(statuses: dict[int, str], start: float) -> Group:
+        """Create the live view of the status of each organization."""
+        counts = {"pending": 0, "running": 0, "finished": 0}
+        t_ = Table(title="Diagnostics progress")
+        t_.add_column("organization")
+        t_.add_column("status")
+        for org_id, status in sorted(statuses.items()):
+            if has_task_finished(status):
+                counts["finished"] += 1
+                style = "green" if status == TaskStatus.COMPLETED else "red"
+            elif status == TaskStatus.ACTIVE:
+                counts["running"] += 1
+                style = "cyan"
+            else:
+                counts["pending"] += 1
+                style = "yellow"
+            t_.add_row(str(org_id), f"[{style}]{status}[/{style}]")
+
+        summary = ", ".join(f"{n} {state}" for state, n in counts.items())
+        elapsed = time.monotonic() - start
+        return Group(t_, f"{summary} ({elapsed:.0f} s elapsed)")
+
     def display_diagnostic_results(self, result: dict, org_id: int) -> None:
-        res = json.loads(result["result"])
+        res = decode_results(result["result"])
         t_ = Table(title=f"Basic Diagnostics Summary (organization {org_id})")
         t_.add_column("name")
         t_.add_column("success")
+        t_.add_column("duration", justify="right")
+        t_.add_column("phases")
         e_ = Table(title=f"Basic Diagnostics Errors (organization {org_id})")
         e_.add_column("name")
         e_.add_column("exception")
@@ -114,12 +274,78 @@ class DiagnosticRunner:
             else:
                 success = ":x: [red]failed[/red]"
                 e_.add_row(
-                    diag["name"], diag["exception"], diag["traceback"], diag["payload"]
+                    diag["name"], diag["exception"], _cell(diag["traceback"]),
+                    _cell(diag["payload"])
                 )
                 errors = True
-            t_.add_row(diag["name"], success)
+            duration = diag.get("duration")
+            spans = diag.get("spans") or []
+            phases = _cell(spans) if is_summary(spans) else ", ".join(
+                f"{s['name']} {s['duration']:.2f} s" for s in spans
+            )
+            t_.add_row(
+                diag["name"],
+                success,
+                f"{duration:.2f} s" if duration is not None else "",
+                phases,
+            )
 
-        console = Console()
-        console.print(t_)
+        self.console.print(t_)
         if errors:
-            console.print(e_)
+            self.console.print(e_)
+
+        for diag in res:
+            matrix = (diag.get("metrics") or {}).get("matrix")
+            if matrix:
+                self.display_matrix(matrix)
+
+    def display_matrix(self, matrix: dict) -> None:
+        """Display the N x N matrices of a VPN mesh test as heat-map tables."""
+        orgs = matrix["organizations"]
+        for key, title, higher_is_better in (
+            ("rtt", "VPN Mesh RTT (ms)", False),
+            ("throughput", "VPN Mesh Throughput (MB/s)", True),
+        ):
+            values = [v for row in matrix[key] for v in row if v is not None]
+            t_ = Table(title=f"{title}, from row to column")
+            t_.add_column("from \\ to")
+            for org_id in orgs:
+                t_.add_column(str(org_id), justify="right")
+
+            for i, org_id in enumerate(orgs):
+                cells = []
+                for j, value in enumerate(matrix[key][i]):
+                    if i == j:
+                        cells.append("[dim]-[/dim]")
+                    elif not matrix["reachable"][i][j]:
+                        cells.append(":x: [red]unreachable[/red]")
+                    else:
+                        cells.append(_heat(value, values, higher_is_better))
+                t_.add_row(str(org_id), *cells)
+            self.console.print(t_)
+
+
+def _cell(value: Any) -> str | None:
+    """Render a (structured) result field as text for a table cell."""
+    if value is None or isinstance(value, str):
+        return value
+    if is_summary(value):
+        return (
+            f"<{value[SUMMARY]} {value['size']} bytes, "
+            f"sha256 {value['sha256'][:12]}>"
+        )
+    return json.dumps(value, default=str)
+
+
+def _heat(value: float | None, values: list[float],
+          higher_is_better: bool) -> str:
+    """Color a matrix cell relative to the other values in the matrix."""
+    if value is None:
+        return "[dim]n/a[/dim]"
+    low, high = min(values), max(values)
+    fraction = (value - low) / (high - low) if high > low else 0.0
+    if higher_is_better:
+        fraction = 1 - fraction
+    color = "green" if fraction < 1 / 3 else "yellow" if fraction < 2 / 3 \
+        else "red"
+    return f"[black on {color}] {value:.1f} [/]"
@@ -0,0 +1,624 @@
+"""
+Run the diagnostics without a vantage6 network.
+
+The harness stands in for the node that runs the algorithm containers:
+
+    Fake proxy
+        An HTTP server that implements the endpoints of the local proxy that
+        the diagnostics use: the server version, the VPN addresses, the
+        organizations (without public keys, the harness does not encrypt),
+        the status of the blob store (disabled) and the tasks, task statuses,
+        runs and results of subtasks. The latency, errors and bandwidth
+        of its responses are configurable (see `Conditions`), so that the
+        diagnostics can be run on a degraded network.
+    Subtasks
+        Subtasks run in local processes, with the same entrypoint as the
+        algorithm image (`vantage6.algorithm.tools.wrap.wrap_algorithm`). Each
+        run gets its own input, output and token file and base32-encoded
+        environment variables, like the node provides them, and shares the
+        temporary folder with its parent. The echo servers of the VPN
+        diagnostics listen on a free port of the host, which is published as
+        the ``port8`` address of their run.
+    Parent container
+        The parent container is the current process. `Harness` creates its
+        files, sets its environment variables (decoded, as the wrapper leaves
+        them) and creates an `AlgorithmClient` that talks to the fake proxy,
+        which is passed to the diagnostics as ``mock_client``.
+
+Connections between the containers (e.g. the VPN echo) are plain connections
+on the loopback interface, they are not degraded.
+"""
+import base64
+import csv
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+
+from vantage6.algorithm.client import AlgorithmClient
+from vantage6.common.globals import STRING_ENCODING, ENV_VAR_EQUALS_REPLACEMENT
+from vantage6.common.task_status import TaskStatus, has_task_finished
+
+import v6_diagnostics
+
+from v6_diagnostics.encoding import decode_results
+
+
+PKG_NAME = "v6_diagnostics"
+ENTRYPOINT = (
+    "from vantage6.algorithm.tools.wrap import wrap_algorithm; "
+    "wrap_algorithm()"
+)
+SERVER_VERSION = "harness"
+# methods that run an echo server, they get the port of their run
+ECHO_METHODS = ("RPC_echo", "RPC_mesh")
+DATABASE_ROWS = 1000
+PROCESS_TIMEOUT = 5
+
+
+class Conditions:
+    """
+    Network conditions of the fake proxy.
+
+    Parameters
+    ----------
+    latency : float, optional
+        Seconds added to every response.
+    jitter : float, optional
+        Maximum number of seconds that is randomly added to the latency.
+    error_rate : float, optional
+        Fraction of the requests that is answered with HTTP 500.
+    bandwidth : float, optional
+        Bytes per second at which request and response bodies are
+        transferred, unlimited by default.
+    """
+
+    def __init__(self, latency: float = 0, jitter: float = 0,
+                 error_rate: float = 0, bandwidth: float | None = None) \
+            -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+
+    def delay(self, size: int) -> float:
+        """Seconds to delay a request with bodies of ``size`` bytes."""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        return delay
+
+    def fail(self) -> bool:
+        """Whether to answer a request with an error."""
+        return random.random() < self.error_rate
+
+    def __repr__(self):
+        return (f"Conditions(latency={self.latency}, jitter={self.jitter}, "
+                f"error_rate={self.error_rate}, bandwidth={self.bandwidth})")
+
+
+SCENARIOS = {
+    "local": Conditions(),
+    "slow": Conditions(latency=0.1, jitter=0.05),
+    "lossy": Conditions(latency=0.02, error_rate=0.05),
+    "narrow": Conditions(latency=0.02, bandwidth=1e6),
+}
+
+
+class FakeProxy:
+    """
+    Local proxy of a fake node, see the module docstring.
+
+    Parameters
+    ----------
+    root : Path
+        Folder for the files of the containers.
+    conditions : Conditions, optional
+        Network conditions of the responses.
+    collaboration_id : int, optional
+        Collaboration of the tasks.
+    """
+
+    def __init__(self, root: Path, conditions: Conditions | None = None,
+                 collaboration_id: int = 1) -> None:
+        self.root = Path(root)
+        self.conditions = conditions or Conditions()
+        self.collaboration_id = collaboration_id
+        self.requests = 0
+        self.injected_errors = 0
+        self.temporary_folder = self.root / "tmp"
+        self.temporary_folder.mkdir(parents=True, exist_ok=True)
+        self.database = _create_database(self.root / "data.csv")
+        self._lock = threading.Lock()
+        self._tasks: dict[int, dict] = {}
+        self._runs: dict[int, dict] = {}
+        self._processes: list[subprocess.Popen] = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self.server.daemon_threads = True
+
+    @property
+    def host(self) -> str:
+        return "http://127.0.0.1"
+
+    @property
+    def port(self) -> int:
+        return self.server.server_port
+
+    def start(self) -> None:
+        threading.Thread(
+            target=self.server.serve_forever, daemon=True, name="fake-proxy"
+        ).start()
+
+    def stop(self) -> None:
+        """Stop the server and the subtasks that are still running."""
+        self.server.shutdown()
+        self.server.server_close()
+        for process in self._processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait(PROCESS_TIMEOUT)
+
+    def create_task(self, body: dict, parent: dict | None = None,
+                    local: bool = False) -> dict:
+        """
+        Create a task, as posted by `AlgorithmClient.task.create`.
+
+        Parameters
+        ----------
+        body : dict
+            The task, with the input of each organization.
+        parent : dict, optional
+            Run of the container that creates the task.
+        local : bool, optional
+            Do not start processes for the runs, they are run by the caller
+            (used for the parent container).
+        """
+        with self._lock:
+            task = {
+                "id": len(self._tasks) + 1,
+                "name": body.get("name"),
+                "parent_id": parent["task"]["id"] if parent else None,
+                "runs": [],
+            }
+            self._tasks[task["id"]] = task
+            runs = []
+            for organization in body.get("organizations", []):
+                run = {
+                    "id": len(self._runs) + 1,
+                    "task": {"id": task["id"]},
+                    "organization": {"id": organization["id"]},
+                    "status": TaskStatus.PENDING.value,
+                    "assigned_at": _now(),
+                    "started_at": None,
+                    "finished_at": None,
+                    "result": None,
+                    "ports": {"port5": _free_port(), "port8": _free_port()},
+                }
+                self._runs[run["id"]] = run
+                task["runs"].append(run["id"])
+                runs.append((run, organization.get("input")))
+
+        for run, input_ in runs:
+            if local:
+                run["status"] = TaskStatus.ACTIVE.value
+                run["started_at"] = _now()
+            else:
+                threading.Thread(
+                    target=self._execute, args=(run, input_), daemon=True,
+                    name=f"run-{run['id']}"
+                ).start()
+        return self.task_json(task)
+
+    def container(self, run: dict, input_: bytes = b"") -> dict[str, str]:
+        """
+        Create the files of the container of a run.
+
+        Returns
+        -------
+        dict[str, str]
+            The environment variables of the container, not encoded.
+        """
+        folder = self.root / "runs" / str(run["id"])
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / "input").write_bytes(input_)
+        (folder / "output").write_bytes(b"")
+        (folder / "token").write_text(self.token(run))
+        return {
+            "HOST": self.host,
+            "PORT": str(self.port),
+            "API_PATH": "",
+            "INPUT_FILE": str(folder / "input"),
+            "OUTPUT_FILE": str(folder / "output"),
+            "TOKEN_FILE": str(folder / "token"),
+            "TEMPORARY_FOLDER": str(self.temporary_folder),
+            "USER_REQUESTED_DATABASE_LABELS": "default",
+            "DB_LABELS": "default",
+            "DEFAULT_DATABASE_URI": str(self.database),
+            "DEFAULT_DATABASE_TYPE": "csv",
+        }
+
+    def token(self, run: dict) -> str:
+        """Container token of a run, its signature is not checked."""
+        return jwt.encode({
+            "sub": {
+                "client_type": "container",
+                "node_id": run["organization"]["id"],
+                "organization_id": run["organization"]["id"],
+                "collaboration_id": self.collaboration_id,
+                "task_id": run["task"]["id"],
+                "image": PKG_NAME,
+                "databases": [{"label": "default"}],
+            },
+            "iat": int(time.time()),
+        }, "v6-diagnostics-harness-not-a-secret", algorithm="HS256")
+
+    def caller(self, authorization: str | None) -> dict | None:
+        """The run of the container that sent a request."""
+        if not authorization or not authorization.startswith("Bearer "):
+            return None
+        try:
+            identity = jwt.decode(
+                authorization[len("Bearer "):],
+                options={"verify_signature": False},
+            )["sub"]
+        except (jwt.PyJWTError, KeyError):
+            return None
+        task = self._tasks.get(identity.get("task_id"))
+        for run_id in (task or {}).get("runs", []):
+            run = self._runs[run_id]
+            if run["organization"]["id"] == identity.get("organization_id"):
+                return run
+        return None
+
+    def addresses(self, caller: dict | None, params: dict) -> list[dict]:
+        """VPN addresses of the active runs, filtered like the proxy."""
+        if caller is None:
+            return []
+        own_task = self._tasks[caller["task"]["id"]]
+        children = {
+            task["id"] for task in self._tasks.values()
+            if task["parent_id"] == own_task["id"]
+        }
+        if "only_children" in params:
+            tasks = children
+        elif "only_parent" in params:
+            tasks = {own_task["parent_id"]}
+        else:
+            # like the proxy, only the runs of the own task by default
+            tasks = {own_task["id"]}
+            if "include_children" in params:
+                tasks |= children
+            if "include_parent" in params:
+                tasks.add(own_task["parent_id"])
+
+        addresses = []
+        for run in list(self._runs.values()):
+            if run["task"]["id"] not in tasks or \
+                    run["status"] != TaskStatus.ACTIVE.value:
+                continue
+            for label, port in run["ports"].items():
+                if params.get("label", label) != label:
+                    continue
+                addresses.append({
+                    "ip": "127.0.0.1",
+                    "port": port,
+                    "label": label,
+                    "organization_id": run["organization"]["id"],
+                    "task_id": run["task"]["id"],
+                    "parent_id": self._tasks[run["task"]["id"]]["parent_id"],
+                })
+        return addresses
+
+    def task_json(self, task: dict) -> dict:
+        """The task as returned by the server, with its overall status."""
+        statuses = [self._runs[run_id]["status"] for run_id in task["runs"]]
+        if not all(has_task_finished(s) for s in statuses):
+            status = TaskStatus.ACTIVE.value if any(
+                s != TaskStatus.PENDING.value for s in statuses
+            ) else TaskStatus.PENDING.value
+        elif all(s == TaskStatus.COMPLETED.value for s in statuses):
+            status = TaskStatus.COMPLETED.value
+        else:
+            status = TaskStatus.FAILED.value
+        return {
+            "id": task["id"], "name": task["name"], "status": status,
+            "parent": {"id": task["parent_id"]} if task["parent_id"] else None,
+        }
+
+    def run_json(self, run: dict) -> dict:
+        return {k: v for k, v in run.items() if k not in ("result", "ports")}
+
+    def result_json(self, run: dict) -> dict:
+        return {"id": run["id"], "run": {"id": run["id"]},
+                "result": run["result"]}
+
+    def get_task(self, task_id: int) -> dict | None:
+        return self._tasks.get(task_id)
+
+    def get_run(self, run_id: int) -> dict | None:
+        return self._runs.get(run_id)
+
+    def runs_of(self, task_id: int) -> list[dict]:
+        task = self._tasks.get(task_id) or {"runs": []}
+        return [self._runs[run_id] for run_id in task["runs"]]
+
+    def _execute(self, run: dict, input_: str | None) -> None:
+        """Run a subtask in a local process, like the node runs a container."""
+        data = base64.b64decode(input_ or "")
+        try:
+            parsed = json.loads(data)
+            if parsed.get("method") in ECHO_METHODS:
+                parsed.setdefault("kwargs", {})["port"] = run["ports"]["port8"]
+                data = json.dumps(parsed).encode()
+        except (ValueError, AttributeError):
+            pass
+
+        env = self.container(run, data)
+        folder = Path(env["OUTPUT_FILE"]).parent
+        environment = {
+            **os.environ,
+            **{key: _encode(value) for key, value in env.items()},
+            "PKG_NAME": PKG_NAME,
+            "PYTHONPATH": os.pathsep.join(p for p in sys.path if p),
+        }
+        run["status"] = TaskStatus.ACTIVE.value
+        run["started_at"] = _now()
+        with open(folder / "log", "wb") as log:
+            process = subprocess.Popen(
+                [sys.executable, "-c", ENTRYPOINT], env=environment,
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+            self._processes.append(process)
+            returncode = process.wait()
+
+        output = Path(env["OUTPUT_FILE"]).read_bytes()
+        if returncode == 0 and output:
+            run["result"] = base64.b64encode(output).decode()
+            run["status"] = TaskStatus.COMPLETED.value
+        else:
+            run["status"] = TaskStatus.FAILED.value
+        run["finished_at"] = _now()
+
+
+def _handler(proxy: FakeProxy) -> type:
+    """Create the request handler of the fake proxy."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._handle(None)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            self._handle(self.rfile.read(length))
+
+        def _handle(self, body: bytes | None):
+            with proxy._lock:
+                proxy.requests += 1
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if proxy.conditions.fail():
+                with proxy._lock:
+                    proxy.injected_errors += 1
+                status, response = 500, {"msg": "Error injected by harness"}
+            else:
+                try:
+                    status, response = self._route(
+                        url.path.strip("/").split("/"), params, body
+                    )
+                except Exception as exc:
+                    status, response = 500, {"msg": repr(exc)}
+
+            content = json.dumps(response).encode()
+            time.sleep(proxy.conditions.delay(len(body or b"") + len(content)))
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _route(self, path: list[str], params: dict, body: bytes | None):
+            caller = proxy.caller(self.headers.get("Authorization"))
+            if path == ["version"]:
+                return 200, {"version": SERVER_VERSION}
+            if path == ["vpn", "algorithm", "addresses"]:
+                return 200, {"addresses": proxy.addresses(caller, params)}
+            if path == ["blobstream", "status"]:
+                return 200, {"blob_store_enabled": False}
+            if path[0] == "organization" and len(path) == 2:
+                return 200, {"id": int(path[1]), "public_key": ""}
+            if path == ["task"] and body is not None:
+                return 201, proxy.create_task(json.loads(body), caller)
+            # vantage6 >= 4.11 polls the status of a task
+            if path[0] == "task" and len(path) in (2, 3) and \
+                    path[2:] in ([], ["status"]):
+                task = proxy.get_task(int(path[1]))
+                if task is None:
+                    return 404, {"msg": f"Task {path[1]} not found"}
+                task = proxy.task_json(task)
+                if len(path) == 3:
+                    return 200, {"status": task["status"]}
+                return 200, task
+            if path[0] in ("run", "result"):
+                as_json = proxy.run_json if path[0] == "run" else \
+                    proxy.result_json
+                if len(path) == 2:
+                    run = proxy.get_run(int(path[1]))
+                    if run is None:
+                        return 404, {"msg": f"Run {path[1]} not found"}
+                    return 200, as_json(run)
+                runs = proxy.runs_of(int(params.get("task_id", 0)))
+                return 200, {"data": [as_json(run) for run in runs],
+                             "links": {}}
+            return 404, {"msg": f"Unknown endpoint /{'/'.join(path)}"}
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class Harness:
+    """
+    A fake node for the current process, see the module docstring.
+
+    Parameters
+    ----------
+    organizations : list[int], optional
+        Organizations of the collaboration, the parent container runs at the
+        first one.
+    conditions : Conditions, optional
+        Network conditions of the fake proxy.
+    root : str | Path, optional
+        Folder for the files of the containers, a temporary folder (that is
+        removed afterwards) by default.
+    """
+
+    def __init__(self, organizations: list[int] = (1, 2, 3),
+                 conditions: Conditions | None = None,
+                 root: str | Path | None = None) -> None:
+        self.organizations = list(organizations)
+        self.conditions = conditions or Conditions()
+        self._root = root
+        self._environ = None
+        self.proxy = None
+        self.client = None
+
+    def __enter__(self) -> "Harness":
+        self._temporary = None
+        if self._root is None:
+            self._temporary = tempfile.mkdtemp(prefix="v6-harness-")
+        self.proxy = FakeProxy(
+            Path(self._root or self._temporary), self.conditions
+        )
+        self.proxy.start()
+
+        task = self.proxy.create_task(
+            {"name": "harness",
+             "organizations": [{"id": self.organizations[0]}]},
+            local=True
+        )
+        run = self.proxy.runs_of(task["id"])[0]
+        env = self.proxy.container(run)
+        self._environ = dict(os.environ)
+        os.environ.update(env)
+        self.client = AlgorithmClient(
+            token=self.proxy.token(run), host=self.proxy.host,
+            port=self.proxy.port, path=""
+        )
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.proxy.stop()
+        os.environ.clear()
+        os.environ.update(self._environ)
+        if self._temporary is not None:
+            shutil.rmtree(self._temporary, ignore_errors=True)
+
+    def run(self, method: str, **kwargs) -> tuple[float, list[dict]]:
+        """
+        Run a method of `v6_diagnostics` as the parent container.
+
+        Returns
+        -------
+        tuple[float, list[dict]]
+            The wall-clock time in seconds and the (decoded) results.
+        """
+        func = getattr(v6_diagnostics, method)
+        if getattr(func, "wrapped_in_algorithm_client_decorator", False):
+            kwargs["mock_client"] = self.client
+        start = time.perf_counter()
+        results = func(**kwargs)
+        return time.perf_counter() - start, decode_results(results)
+
+
+def benchmark(
+    scenarios: dict[str, Conditions] | None = None,
+    methods: dict[str, dict] | None = None,
+    organizations: list[int] = (1, 2, 3),
+) -> list[dict]:
+    """
+    Measure the wall-clock time of the diagnostics under network conditions.
+
+    Every method runs on a new harness for every scenario.
+
+    Parameters
+    ----------
+    scenarios : dict[str, Conditions], optional
+        The network conditions by name, `SCENARIOS` by default.
+    methods : dict[str, dict], optional
+        Keyword arguments by method, by default ``base_features`` and
+        ``vpn_features`` with their default arguments.
+    organizations : list[int], optional
+        Organizations of the collaboration.
+
+    Returns
+    -------
+    list[dict]
+        For each scenario and method the wall-clock time, the number of
+        checks, the checks that failed and the number of requests to the
+        proxy (and how many of them got an injected error).
+    """
+    scenarios = SCENARIOS if scenarios is None else scenarios
+    methods = methods or {"base_features": {}, "vpn_features": {}}
+    rows = []
+    for scenario, conditions in scenarios.items():
+        for method, kwargs in methods.items():
+            kwargs = dict(kwargs)
+            if method == "vpn_features":
+                kwargs.setdefault("other_nodes", list(organizations))
+            with Harness(organizations, conditions) as harness:
+                seconds, results = harness.run(method, **kwargs)
+            rows.append({
+                "scenario": scenario,
+                "method": method,
+                "seconds": seconds,
+                "checks": len(results),
+                "failed": [r["name"] for r in results if not r["success"]],
+                "requests": harness.proxy.requests,
+                "injected_errors": harness.proxy.injected_errors,
+            })
+    return rows
+
+
+def _encode(value: str) -> str:
+    """Encode an environment variable like the node does."""
+    encoded = base64.b32encode(value.encode(STRING_ENCODING))
+    return encoded.decode(STRING_ENCODING).replace(
+        "=", ENV_VAR_EQUALS_REPLACEMENT
+    )
+
+
+def _create_database(path: Path) -> Path:
+    """Create a small CSV database."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "age", "weight"])
+        for i in range(DATABASE_ROWS):
+            writer.writerow([i, random.randint(18, 90),
+                             round(random.uniform(50, 120), 1)])
+    return path
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,296 @@
+"""
+Keep a local history of diagnostic results and detect performance regressions.
+
+Every diagnostic result that `cli.diagnostic_runner.DiagnosticRunner`
+displays is recorded in a SQLite database, together with the timing metrics
+it contains. A timing metric is any number in the metrics of a result whose
+name shows whether lower or higher values are better:
+
+    Lower is better
+        The duration of the check and of its phases (spans), and metrics
+        named after a latency, RTT, duration or time (e.g.
+        ``metrics.sequential.latency.p50``).
+    Higher is better
+        Metrics named after a throughput, IOPS, GFLOP/s or a rate
+        (``*_per_second``).
+
+Names are matched on whole words, separated by underscores: ``fsync_latency``
+is a latency, but ``timeout`` is not a time and ``connects`` (a count) is not
+a connect.
+
+Of summaries of a distribution (see `v6_diagnostics.util.summarize`) only the
+mean, median and 95th percentile are kept. Lists (e.g. the individual
+measurements of a benchmark) are skipped.
+
+`HistoryStore.compare` compares the latest value of each metric with a
+baseline, the median of the values of the preceding runs in which the check
+succeeded, and flags the metric as regressed when it is worse than the
+baseline by more than a threshold.
+"""
+import json
+import sqlite3
+import statistics
+import time
+
+from pathlib import Path
+
+
+DEFAULT_PATH = Path.home() / ".v6-diagnostics" / "history.sqlite"
+WINDOW = 10
+THRESHOLD = 0.2
+MIN_SAMPLES = 3
+MAX_DEPTH = 6
+LOWER_IS_BETTER = ("latency", "rtt", "duration", "time", "seconds",
+                   "connect", "queue_to_start", "start_to_finish")
+HIGHER_IS_BETTER = ("throughput", "iops", "per_second", "gflops")
+KEPT_SUMMARY_KEYS = {"mean", "p50", "p95"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    collaboration_id INTEGER,
+    organization_id INTEGER,
+    task_id INTEGER,
+    check_name TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    duration REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS results_lookup
+    ON results (collaboration_id, organization_id, check_name, timestamp);
+CREATE TABLE IF NOT EXISTS measurements (
+    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    higher_is_better INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_result ON measurements (result_id);
+"""
+
+
+class HistoryStore:
+    """
+    SQLite store of diagnostic results, see the module docstring.
+
+    Parameters
+    ----------
+    path : str | Path, optional
+        Path of the database, which is created if it does not exist.
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_PATH) -> None:
+        self.path = Path(path)
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def record(
+        self, collaboration_id: int | None, organization_id: int | None,
+        results: list[dict], task_id: int | None = None,
+        timestamp: float | None = None
+    ) -> int:
+        """
+        Record the diagnostic results of a single organization.
+
+        Parameters
+        ----------
+        collaboration_id : int | None
+            Collaboration the diagnostics ran in.
+        organization_id : int | None
+            Organization the diagnostics ran at.
+        results : list[dict]
+            The (decoded) results, see `v6_diagnostics.util.DiagnosticResult`.
+        task_id : int, optional
+            ID of the diagnostic task.
+        timestamp : float, optional
+            When the diagnostics ran, now by default.
+
+        Returns
+        -------
+        int
+            Number of timing metrics that were recorded.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        recorded = 0
+        with self.connection:
+            for result in results:
+                cursor = self.connection.execute(
+                    "INSERT INTO results (timestamp, collaboration_id, "
+                    "organization_id, task_id, check_name, success, duration, "
+                    "result) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (timestamp, collaboration_id, organization_id, task_id,
+                     result["name"], bool(result.get("success")),
+                     result.get("duration"), json.dumps(result, default=str))
+                )
+                measurements = [
+                    (cursor.lastrowid, metric, value, higher_is_better)
+                    for metric, value, higher_is_better
+                    in timing_metrics(result)
+                ]
+                self.connection.executemany(
+                    "INSERT INTO measurements VALUES (?, ?, ?, ?)",
+                    measurements
+                )
+                recorded += len(measurements)
+        return recorded
+
+    def compare(
+        self, collaboration_id: int | None = None,
+        organization_id: int | None = None, check: str | None = None,
+        window: int = WINDOW, threshold: float = THRESHOLD,
+        min_samples: int = MIN_SAMPLES
+    ) -> list[dict]:
+        """
+        Compare the latest value of each timing metric with its baseline.
+
+        Parameters
+        ----------
+        collaboration_id : int, optional
+            Only compare the results of this collaboration.
+        organization_id : int, optional
+            Only compare the results of this organization.
+        check : str, optional
+            Only compare the results of the check with this name.
+        window : int, optional
+            Number of preceding values the baseline is the median of.
+        threshold : float, optional
+            Fraction by which the latest value may be worse than the baseline.
+        min_samples : int, optional
+            Minimal number of preceding values to compare with.
+
+        Returns
+        -------
+        list[dict]
+            For each metric with enough preceding values: where it was
+            measured, the baseline, the latest value, the relative change
+            and whether it regressed.
+        """
+        filters, params = ["r.success = 1"], []
+        for column, value in (("collaboration_id", collaboration_id),
+                              ("organization_id", organization_id),
+                              ("check_name", check)):
+            if value is not None:
+                filters.append(f"r.{column} = ?")
+                params.append(value)
+        rows = self.connection.execute(
+            f"""
+            SELECT collaboration_id, organization_id, check_name, metric,
+                   value, higher_is_better
+            FROM (
+                SELECT r.collaboration_id, r.organization_id, r.check_name,
+                       m.metric, m.value, m.higher_is_better, r.timestamp,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY r.collaboration_id, r.organization_id,
+                                        r.check_name, m.metric
+                           ORDER BY r.timestamp DESC, r.id DESC
+                       ) AS age
+                FROM results r JOIN measurements m ON m.result_id = r.id
+                WHERE {" AND ".join(filters)}
+            )
+            WHERE age <= ?
+            ORDER BY collaboration_id, organization_id, check_name, metric,
+                     timestamp
+            """,
+            params + [window + 1]
+        ).fetchall()
+
+        series: dict[tuple, list] = {}
+        for collab, org, name, metric, value, higher_is_better in rows:
+            key = (collab, org, name, metric, bool(higher_is_better))
+            series.setdefault(key, []).append(value)
+
+        comparisons = []
+        for (collab, org, name, metric, higher_is_better), values in \
+                series.items():
+            *previous, latest = values
+            if len(previous) < max(min_samples, 1):
+                continue
+            baseline = statistics.median(previous)
+            change = (latest - baseline) / baseline if baseline else None
+            worse = change is not None and (
+                -change if higher_is_better else change
+            ) > threshold
+            comparisons.append({
+                "collaboration_id": collab,
+                "organization_id": org,
+                "check": name,
+                "metric": metric,
+                "higher_is_better": higher_is_better,
+                "baseline": baseline,
+                "latest": latest,
+                "change": change,
+                "samples": len(previous),
+                "regressed": worse,
+            })
+        return comparisons
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def timing_metrics(result: dict) -> list[tuple[str, float, bool]]:
+    """
+    Extract the timing metrics of a diagnostic result.
+
+    Returns
+    -------
+    list[tuple[str, float, bool]]
+        The name and value of each metric, and whether higher is better.
+    """
+    found = []
+    if _is_number(result.get("duration")):
+        found.append(("duration", float(result["duration"]), False))
+    spans = result.get("spans")
+    if isinstance(spans, list):
+        for span in spans:
+            if isinstance(span, dict) and _is_number(span.get("duration")):
+                found.append(
+                    (f"spans.{span.get('name')}", float(span["duration"]),
+                     False)
+                )
+    _walk(result.get("metrics"), "metrics", None, found, 0)
+    return found
+
+
+def _walk(value, path: str, higher_is_better: bool | None, found: list,
+          depth: int) -> None:
+    """Collect the numbers in nested dicts whose direction is known."""
+    if _is_number(value):
+        if higher_is_better is not None:
+            found.append((path, float(value), higher_is_better))
+        return
+    if not isinstance(value, dict) or depth > MAX_DEPTH:
+        return
+    # summaries may have extra fields, e.g. the jitter of the VPN RTT
+    is_summary = "p50" in value
+    for key, item in value.items():
+        if is_summary and key not in KEPT_SUMMARY_KEYS:
+            continue
+        _walk(item, f"{path}.{key}", _direction(str(key), higher_is_better),
+              found, depth + 1)
+
+
+def _direction(key: str, parent: bool | None) -> bool | None:
+    """Whether higher is better for a key, inherited from its parent."""
+    words = key.lower().split("_")
+    if any(_has_words(words, term) for term in HIGHER_IS_BETTER):
+        return True
+    if any(_has_words(words, term) for term in LOWER_IS_BETTER):
+        return False
+    return parent
+
+
+def _has_words(words: list[str], term: str) -> bool:
+    """Whether the words of ``term`` occur in ``words``, in a row."""
+    term_words = term.split("_")
+    return any(
+        words[i:i + len(term_words)] == term_words
+        for i in range(len(words) - len(term_words) + 1)
+    )
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,375 @@
+"""
+Continuously monitor a vantage6 network with the diagnostics.
+
+The monitor runs diagnostic jobs (e.g. the base features every 15 minutes and
+the VPN features every hour) and keeps the last measurements of each node in
+memory. They are exposed in the Prometheus text format on a local HTTP
+endpoint, so that performance degradation of a node can be alerted on.
+
+Scheduling
+    Each job runs every ``interval`` seconds, randomly shifted by up to
+    ``jitter`` times the interval so that monitors of multiple networks (and
+    the jobs of one monitor) do not hit the server at the same moment. A job
+    that is still running when it is due again is skipped, and at most
+    ``max_overlap`` jobs run at the same time.
+Metrics
+    For every series the last ``window`` measurements are kept. Ratios (e.g.
+    the success of a check) are exported as their mean over the window, and
+    durations and latencies as quantiles over the window.
+"""
+import random
+import threading
+import time
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vantage6.common import info, error
+
+from v6_diagnostics.client import DiagnosticClient, DiagnosticReport
+from v6_diagnostics.util import percentile
+
+
+WINDOW = 20
+JITTER = 0.1
+MAX_OVERLAP = 1
+METRICS_PORT = 9464
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "v6_diagnostics"
+# name of each series, how it is exported and its help text
+SERIES = {
+    "run_success_ratio": (
+        "ratio", "Fraction of diagnostic runs that completed successfully"
+    ),
+    "check_success_ratio": ("ratio", "Fraction of checks that succeeded"),
+    "check_duration_seconds": ("summary", "Duration of the checks"),
+    "proxy_latency_seconds": (
+        "summary", "Latency of a request to the local proxy"
+    ),
+    "vpn_rtt_milliseconds": (
+        "summary", "Median round-trip time of the VPN link to a peer"
+    ),
+    "vpn_time_to_ready_seconds": (
+        "summary", "Time until the algorithm container of a peer was reachable"
+    ),
+    "job_duration_seconds": ("summary", "Duration of the diagnostic tasks"),
+}
+COUNTERS = {
+    "timeouts_total": "Number of runs that did not finish in time",
+    "job_runs_total": "Number of diagnostic tasks that were started",
+    "job_skipped_total": "Number of times a job was skipped as it was "
+                         "still running",
+    "job_errors_total": "Number of diagnostic tasks that could not be run",
+}
+
+
+class Job:
+    """
+    A diagnostic task that is run periodically.
+
+    Parameters
+    ----------
+    name : str
+        Name of the job, used as label of its metrics.
+    method : str
+        Method of `v6_diagnostics.client.DiagnosticClient` to run, e.g.
+        ``base_features``.
+    interval : float
+        Average number of seconds between the starts of the job.
+    kwargs : dict, optional
+        Keyword arguments of the method.
+    timeout : float, optional
+        Seconds after which nodes that have not finished are reported as
+        timed out.
+    jitter : float, optional
+        Maximum shift of the interval, as fraction of the interval.
+    """
+
+    def __init__(self, name: str, method: str, interval: float,
+                 kwargs: dict | None = None, timeout: float | None = None,
+                 jitter: float = JITTER) -> None:
+        self.name = name
+        self.method = method
+        self.interval = interval
+        self.kwargs = kwargs or {}
+        self.timeout = timeout
+        self.jitter = jitter
+        self.running = False
+
+    def next_delay(self) -> float:
+        """Seconds until the next run of the job."""
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def __repr__(self):
+        return f"Job({self.name}, every {self.interval} s)"
+
+
+class RollingMetrics:
+    """
+    Keep the last measurements of each series, see the module docstring.
+
+    Parameters
+    ----------
+    window : int, optional
+        Number of measurements that are kept per series.
+    """
+
+    def __init__(self, window: int = WINDOW) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, tuple], deque] = {}
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._last_run: dict[str, float] = {}
+
+    def observe(self, name: str, labels: dict, value: float | None) -> None:
+        """Add a measurement to a series."""
+        if value is None:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._series:
+                self._series[key] = deque(maxlen=self.window)
+            self._series[key].append(float(value))
+
+    def increment(self, name: str, labels: dict, amount: float = 1) -> None:
+        """Increment a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record_report(self, job: str, report: DiagnosticReport) -> None:
+        """Add the measurements of a finished diagnostic task."""
+        self.observe("job_duration_seconds", {"job": job}, report.duration)
+        with self._lock:
+            self._last_run[job] = time.time()
+
+        for organization in report.organizations:
+            org = str(organization.organization_id)
+            self.observe(
+                "run_success_ratio", {"job": job, "organization": org},
+                organization.success
+            )
+            for check in organization.checks:
+                labels = {"organization": org, "check": check.name}
+                self.observe("check_success_ratio", labels, check.success)
+                self.observe("check_duration_seconds", labels, check.duration)
+                self._record_check(org, check)
+
+        for org_id in report.timed_out:
+            labels = {"job": job, "organization": str(org_id)}
+            self.observe("run_success_ratio", labels, False)
+            self.increment("timeouts_total", labels)
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text format."""
+        with self._lock:
+            series = {
+                key: list(values) for key, values in self._series.items()
+            }
+            counters = dict(self._counters)
+            last_run = dict(self._last_run)
+
+        lines = []
+        for name, (kind, help_) in SERIES.items():
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {help_}")
+            if kind == "ratio":
+                lines.append(f"# TYPE {metric} gauge")
+                for key in keys:
+                    values = series[key]
+                    lines.append(_sample(
+                        metric, key[1], sum(values) / len(values)
+                    ))
+                continue
+
+            lines.append(f"# TYPE {metric} summary")
+            for key in keys:
+                values = series[key]
+                for q in QUANTILES:
+                    lines.append(_sample(
+                        metric, key[1] + (("quantile", str(q)),),
+                        percentile(values, q * 100)
+                    ))
+                lines.append(_sample(f"{metric}_sum", key[1], sum(values)))
+                lines.append(_sample(f"{metric}_count", key[1], len(values)))
+
+        for name, help_ in COUNTERS.items():
+            keys = sorted(key for key in counters if key[0] == name)
+            if not keys:
+                continue
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {help_}")
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(
+                _sample(metric, key[1], counters[key]) for key in keys
+            )
+
+        if last_run:
+            metric = f"{PREFIX}_job_last_run_timestamp_seconds"
+            lines.append(f"# HELP {metric} When the job last finished")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(
+                _sample(metric, (("job", job),), timestamp)
+                for job, timestamp in sorted(last_run.items())
+            )
+        return "\n".join(lines) + "\n"
+
+    def _record_check(self, org: str, check) -> None:
+        """Extract the latencies of the proxy and VPN checks."""
+        if check.name == "LOCAL_PROXY":
+            for span in check.spans:
+                if span.get("name") == "response":
+                    self.observe(
+                        "proxy_latency_seconds", {"organization": org},
+                        span.get("duration")
+                    )
+        elif check.name == "VPN connection":
+            metrics = check.metrics if isinstance(check.metrics, dict) else {}
+            for peer, seconds in (metrics.get("time_to_ready") or {}).items():
+                self.observe(
+                    "vpn_time_to_ready_seconds",
+                    {"organization": org, "peer": str(peer)}, seconds
+                )
+            for peer, benchmark in (metrics.get("benchmark") or {}).items():
+                rtt = (benchmark or {}).get("rtt") or {}
+                self.observe(
+                    "vpn_rtt_milliseconds",
+                    {"organization": org, "peer": str(peer)}, rtt.get("p50")
+                )
+
+
+class Monitor:
+    """
+    Run diagnostic jobs on a schedule and collect their metrics.
+
+    Parameters
+    ----------
+    client : DiagnosticClient
+        The client to run the diagnostics with.
+    jobs : list[Job]
+        The jobs to run.
+    organizations : list[int], optional
+        Organizations to run the diagnostics at, all by default.
+    online_only : bool, optional
+        Only run the diagnostics at organizations whose node is online, also
+        when ``organizations`` are given. This is checked before every run,
+        and a run is skipped when none of the organizations is online.
+    max_overlap : int, optional
+        Maximum number of jobs that run at the same time.
+    window : int, optional
+        Number of measurements that are kept per series.
+    """
+
+    def __init__(self, client: DiagnosticClient, jobs: list[Job],
+                 organizations: list[int] | None = None,
+                 online_only: bool = False, max_overlap: int = MAX_OVERLAP,
+                 window: int = WINDOW) -> None:
+        self.client = client
+        self.jobs = jobs
+        self.organizations = organizations
+        self.online_only = online_only
+        self.metrics = RollingMetrics(window)
+        self._slots = threading.Semaphore(max(max_overlap, 1))
+
+    def run(self, stop: threading.Event | None = None) -> None:
+        """Run the jobs until ``stop`` is set."""
+        stop = stop or threading.Event()
+        # the first runs are spread over the first interval of each job
+        due = {
+            job.name: time.monotonic() + random.uniform(0, job.jitter) *
+            job.interval
+            for job in self.jobs
+        }
+        while not stop.is_set():
+            now = time.monotonic()
+            for job in self.jobs:
+                if due[job.name] > now:
+                    continue
+                due[job.name] = now + job.next_delay()
+                if job.running:
+                    info(f"Skipping {job}, it is still running")
+                    self.metrics.increment(
+                        "job_skipped_total", {"job": job.name}
+                    )
+                    continue
+                job.running = True
+                threading.Thread(
+                    target=self._run_job, args=(job,), daemon=True,
+                    name=f"monitor-{job.name}"
+                ).start()
+            stop.wait(max(min(due.values()) - time.monotonic(), 0))
+
+    def serve(self, host: str = "127.0.0.1", port: int = METRICS_PORT) \
+            -> ThreadingHTTPServer:
+        """Serve the metrics on ``/metrics`` from a background thread."""
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=server.serve_forever, daemon=True, name="monitor-metrics"
+        ).start()
+        info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+        return server
+
+    def _run_job(self, job: Job) -> None:
+        """Run a job once, waiting for a free slot first."""
+        try:
+            with self._slots:
+                organizations = self._organizations()
+                if not organizations:
+                    info(f"Skipped {job}: no organization is online")
+                    return
+                self.metrics.increment("job_runs_total", {"job": job.name})
+                report = getattr(self.client, job.method)(
+                    organizations, timeout=job.timeout, **job.kwargs
+                )
+                self.metrics.record_report(job.name, report)
+                info(f"Finished {job}: {report}")
+        except Exception as exc:
+            error(f"{job} failed: {exc!r}")
+            self.metrics.increment("job_errors_total", {"job": job.name})
+        finally:
+            job.running = False
+
+    def _organizations(self) -> list[int]:
+        """The organizations to run at, see ``online_only``."""
+        if self.organizations and not self.online_only:
+            return list(self.organizations)
+        available = self.client.organizations(self.online_only)
+        if not self.organizations:
+            return available
+        return [org_id for org_id in self.organizations if org_id in available]
+
+
+def _sample(metric: str, labels: tuple, value: float | None) -> str:
+    """Format a single sample of the Prometheus text format."""
+    label_text = ",".join(
+        f'{name}="{_escape(str(label))}"' for name, label in labels
+    )
+    if label_text:
+        metric = f"{metric}{{{label_text}}}"
+    return f"{metric} {'NaN' if value is None else float(value)!r}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -1,5 +1,12 @@
 import click
 import sys
+import time
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
 
 from vantage6.client import UserClient
 from vantage6.algorithm.tools.util import error
@@ -10,7 +17,17 @@ from vantage6.cli.dev import (
 from vantage6.cli.server import get_server_context
 from vantage6.cli.utils import prompt_config_name, check_config_name_allowed
 
+from rich.console import Console
+from rich.table import Table
+
 from cli.diagnostic_runner import DiagnosticRunner
+from cli.harness import benchmark, SCENARIOS
+from cli.history import (
+    HistoryStore, DEFAULT_PATH, WINDOW as HISTORY_WINDOW, THRESHOLD,
+    MIN_SAMPLES
+)
+from cli.monitor import Monitor, Job, JITTER, MAX_OVERLAP, METRICS_PORT, WINDOW
+from v6_diagnostics.client import DiagnosticClient, fetch_all
 
 @click.group(name="test")
 def cli_test() -> None:
@@ -37,10 +54,41 @@ def cli_test() -> None:
               help="Run the diagnostic test on all nodes in the collaboration")
 @click.option("--online-only", is_flag=True,
               help="Run the diagnostic test on only nodes that are online")
+@click.option("--timeout", type=float, default=None,
+              help="Seconds after which organizations that have not finished "
+              "are reported as timed out")
+@click.option("--proxy-benchmark", is_flag=True,
+              help="Also benchmark the latency and throughput of the local "
+              "proxy of each node")
+@click.option("--subtask-benchmark", is_flag=True,
+              help="Also benchmark the round-trip time of subtasks on each "
+              "node")
+@click.option("--payload-sweep", is_flag=True,
+              help="Also measure the throughput of subtask inputs and results "
+              "of increasing size on each node")
+@click.option("--compute-benchmark", is_flag=True,
+              help="Also benchmark the CPU and memory available to the "
+              "algorithm on each node")
+@click.option("--check", "checks", type=str, default=[], multiple=True,
+              help="Name(s) of the check(s) to run, by default all checks "
+              "except the benchmarks")
+@click.option("--tag", "tags", type=str, default=[], multiple=True,
+              help="Run the checks with this tag, e.g. 'cheap' for a quick "
+              "health ping")
+@click.option("--history", type=click.Path(dir_okay=False),
+              default=str(DEFAULT_PATH), show_default=True,
+              help="SQLite database to record the results in")
+@click.option("--no-history", is_flag=True,
+              help="Do not record the results")
 def feature_tester(
     host: str, port: int, api_path: str, username: str, password: str,
     collaboration: int, organization: list[int | str], all_nodes: bool,
-    online_only: bool
+    online_only: bool, timeout: float | None = None,
+    proxy_benchmark: bool = False, subtask_benchmark: bool = False,
+    payload_sweep: bool = False, compute_benchmark: bool = False,
+    checks: list[str] = (),
+    tags: list[str] = (), history: str = str(DEFAULT_PATH),
+    no_history: bool = False
 ) -> list[dict]:
     """
     Run diagnostic checks on an existing vantage6 network.
@@ -59,12 +107,161 @@ def feature_tester(
                         log_level='critical')
     client.authenticate(username=username, password=password)
     client.setup_encryption(None)
+    store = None if no_history else HistoryStore(history)
     diagnose = DiagnosticRunner(client, collaboration, organization,
-                                online_only)
-    res = diagnose(base=False)
+                                online_only, timeout, store)
+    res = diagnose(base=False, proxy_benchmark=proxy_benchmark,
+                   subtask_benchmark=subtask_benchmark,
+                   payload_sweep=payload_sweep,
+                   compute_benchmark=compute_benchmark, checks=checks,
+                   tags=tags)
+    if store is not None:
+        store.close()
     return res
 
 
+@cli_test.command(name="compare")
+@click.option("--history", type=click.Path(dir_okay=False, exists=True),
+              default=str(DEFAULT_PATH), show_default=True,
+              help="SQLite database the results are recorded in")
+@click.option("--collaboration", type=int, default=None,
+              help="Only compare the results of this collaboration")
+@click.option("-o", "--organization", type=int, default=None,
+              help="Only compare the results of this organization")
+@click.option("--check", type=str, default=None,
+              help="Only compare the results of the check with this name")
+@click.option("--window", type=int, default=HISTORY_WINDOW, show_default=True,
+              help="Number of preceding runs the baseline is the median of")
+@click.option("--threshold", type=float, default=THRESHOLD, show_default=True,
+              help="Fraction by which a metric may be worse than its baseline")
+@click.option("--min-samples", type=int, default=MIN_SAMPLES,
+              show_default=True,
+              help="Minimal number of preceding runs to compare with")
+@click.option("--all", "show_all", is_flag=True,
+              help="Show all compared metrics, not only the regressed ones")
+def compare(
+    history: str, collaboration: int | None, organization: int | None,
+    check: str | None, window: int, threshold: float, min_samples: int,
+    show_all: bool
+) -> None:
+    """
+    Compare the latest diagnostic results with their history.
+
+    Exits with status 1 when the latency or throughput of a check regressed
+    by more than the threshold compared to the median of the preceding runs.
+    """
+    store = HistoryStore(history)
+    comparisons = store.compare(collaboration, organization, check, window,
+                                threshold, min_samples)
+    store.close()
+    regressions = [c for c in comparisons if c["regressed"]]
+
+    t_ = Table(title="Performance compared to the preceding runs")
+    for column in ("collaboration", "organization", "check", "metric"):
+        t_.add_column(column)
+    for column in ("baseline", "latest", "change"):
+        t_.add_column(column, justify="right")
+    t_.add_column("samples", justify="right")
+    for c in comparisons if show_all else regressions:
+        change = "" if c["change"] is None else f"{c['change']:+.0%}"
+        style = "red" if c["regressed"] else "green"
+        t_.add_row(
+            str(c["collaboration_id"]), str(c["organization_id"]), c["check"],
+            c["metric"], f"{c['baseline']:.4g}", f"{c['latest']:.4g}",
+            f"[{style}]{change}[/{style}]", str(c["samples"])
+        )
+
+    console = Console()
+    if t_.row_count:
+        console.print(t_)
+    console.print(
+        f"{len(regressions)} of {len(comparisons)} metric(s) regressed by "
+        f"more than {threshold:.0%}"
+    )
+    if regressions:
+        sys.exit(1)
+
+
+@cli_test.command(name="monitor")
+@click.option("--host", type=str, default="http://localhost",
+              help="URL of the server")
+@click.option("--port", type=int, default=5000, help="Port of the server")
+@click.option("--api-path", type=str, default="/api",
+              help="API path of the server")
+@click.option("--username", type=str, default="root",
+              help="Username of vantage6 user account to create the tasks "
+                   "with")
+@click.option("--password", type=str, default="root",
+              help="Password of vantage6 user account to create the tasks "
+                   "with")
+@click.option("--collaboration", type=int, default=1,
+              help="ID of the collaboration to create the tasks in")
+@click.option("-o", "--organization", type=int, default=[], multiple=True,
+              help="ID(s) of the organization(s) to monitor, all by default")
+@click.option("--online-only", is_flag=True,
+              help="Only create tasks for nodes that are online")
+@click.option("--base-interval", type=float, default=900,
+              help="Seconds between runs of the base feature diagnostics, 0 "
+              "to disable them")
+@click.option("--vpn-interval", type=float, default=3600,
+              help="Seconds between runs of the VPN diagnostics, 0 to disable "
+              "them")
+@click.option("--vpn-benchmark", is_flag=True,
+              help="Measure the round-trip time of the VPN links")
+@click.option("--timeout", type=float, default=600,
+              help="Seconds after which organizations that have not finished "
+              "are reported as timed out")
+@click.option("--jitter", type=float, default=JITTER,
+              help="Maximum random shift of the intervals, as fraction of the "
+              "interval")
+@click.option("--max-overlap", type=int, default=MAX_OVERLAP,
+              help="Maximum number of diagnostic tasks that run at the same "
+              "time")
+@click.option("--window", type=int, default=WINDOW,
+              help="Number of measurements kept per metric")
+@click.option("--metrics-host", type=str, default="127.0.0.1",
+              help="Address to serve the metrics on")
+@click.option("--metrics-port", type=int, default=METRICS_PORT,
+              help="Port to serve the metrics on")
+def monitor(
+    host: str, port: int, api_path: str, username: str, password: str,
+    collaboration: int, organization: list[int], online_only: bool,
+    base_interval: float, vpn_interval: float, vpn_benchmark: bool,
+    timeout: float, jitter: float, max_overlap: int, window: int,
+    metrics_host: str, metrics_port: int
+) -> None:
+    """
+    Run the diagnostics periodically and export their metrics.
+
+    The metrics of the last runs are served in the Prometheus text format on
+    http://<metrics-host>:<metrics-port>/metrics, until interrupted.
+    """
+    jobs = []
+    if base_interval:
+        jobs.append(Job("base_features", "base_features", base_interval,
+                        timeout=timeout, jitter=jitter))
+    if vpn_interval:
+        jobs.append(Job("vpn_features", "vpn_features", vpn_interval,
+                        kwargs={"benchmark": vpn_benchmark}, timeout=timeout,
+                        jitter=jitter))
+    if not jobs:
+        error("Nothing to monitor, both intervals are 0.")
+        sys.exit(1)
+
+    client = DiagnosticClient.connect(
+        host, port, username, password, collaboration, api_path=api_path
+    )
+    daemon = Monitor(client, jobs, list(organization) or None, online_only,
+                     max_overlap, window)
+    server = daemon.serve(metrics_host, metrics_port)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
 @cli_test.command(name="run-integration-test")
 @click.option('-n', '--name', default=None, type=str,
               help="Name for your development setup")
@@ -73,9 +270,11 @@ def feature_tester(
               'the default http://host.docker.internal should not be changed.')
 @click.option('-i', '--image', type=str, default=None,
               help='Server Docker image to use')
+@click.option('--num-nodes', type=int, default=3,
+              help='Number of nodes in the development network')
 @click.pass_context
 def run_integration_test(click_ctx: click.Context, name: str, server_url: str,
-                         image: str) -> list[dict]:
+                         image: str, num_nodes: int = 3) -> list[dict]:
     """
     Create development network and run diagnostic checks on it.
 
@@ -91,7 +290,8 @@ def run_integration_test(click_ctx: click.Context, name: str, server_url: str,
     # create server & node configurations and create test resources (
     # collaborations, organizations, etc)
     click_ctx.invoke(
-        create_demo_network, name=name, num_nodes=3, server_url=server_url,
+        create_demo_network, name=name, num_nodes=num_nodes,
+        server_url=server_url,
         server_port=5000, image=image
     )
 
@@ -115,3 +315,222 @@ def run_integration_test(click_ctx: click.Context, name: str, server_url: str,
     click_ctx.invoke(remove_demo_network, name=name, system_folders=True)
 
     return diagnose_results
+
+
+# phases of the scale test, in the order in which they run
+SCALE_PHASES = ("create", "server_start", "node_start", "nodes_online",
+                "diagnostics", "teardown")
+
+
+@cli_test.command(name="run-scale-test")
+@click.option('-n', '--name', default="scale", type=str,
+              help="Prefix of the names of the development setups")
+@click.option('-N', '--num-nodes', 'node_counts', type=int, multiple=True,
+              default=[3, 10, 25], show_default=True,
+              help="Number(s) of nodes to test with")
+@click.option('--server-url', type=str, default='http://host.docker.internal',
+              help='Server URL to point to. If you are using Docker Desktop, '
+              'the default http://host.docker.internal should not be changed.')
+@click.option('-i', '--image', type=str, default=None,
+              help='Server and node Docker image to use')
+@click.option('--start-workers', type=int, default=8,
+              help='Maximum number of nodes that are started at the same time')
+@click.option('--online-timeout', type=float, default=600,
+              help='Seconds to wait for the server and all nodes to come '
+              'online')
+@click.option("--timeout", type=float, default=None,
+              help="Seconds after which organizations that have not finished "
+              "the diagnostics are reported as timed out")
+@click.pass_context
+def run_scale_test(
+    click_ctx: click.Context, name: str, node_counts: list[int],
+    server_url: str, image: str | None, start_workers: int,
+    online_timeout: float, timeout: float | None
+) -> dict[int, dict]:
+    """
+    Measure how the phases of an integration test scale with the node count.
+
+    For each number of nodes a development network is created, started,
+    diagnosed and removed again. The duration of each phase is reported in a
+    table with a column per number of nodes.
+    """
+    report = {}
+    for num_nodes in node_counts:
+        network = f"{name}_{num_nodes}"
+        check_config_name_allowed(network)
+        report[num_nodes] = _scale_run(
+            click_ctx, network, num_nodes, server_url, image, start_workers,
+            online_timeout, timeout
+        )
+
+    t_ = Table(title="Duration of each phase (s) by number of nodes")
+    t_.add_column("phase")
+    for num_nodes in node_counts:
+        t_.add_column(f"N={num_nodes}", justify="right")
+    for phase in SCALE_PHASES + ("total",):
+        t_.add_row(phase, *(
+            _phase_cell(report[num_nodes], phase) for num_nodes in node_counts
+        ))
+    t_.add_row("diagnostics succeeded", *(
+        f"{report[n]['succeeded']}/{n}" for n in node_counts
+    ))
+    Console().print(t_)
+    return report
+
+
+def _scale_run(
+    click_ctx: click.Context, network: str, num_nodes: int, server_url: str,
+    image: str | None, start_workers: int, online_timeout: float,
+    timeout: float | None
+) -> dict:
+    """Run the phases of the scale test for a single number of nodes."""
+    run = {"phases": {}, "errors": {}, "succeeded": 0}
+    host, port = "http://localhost", 5000
+    start = time.monotonic()
+    try:
+        with _phase(run, "create"):
+            click_ctx.invoke(
+                create_demo_network, name=network, num_nodes=num_nodes,
+                server_url=server_url, server_port=port, image=image
+            )
+        with _phase(run, "server_start"):
+            _v6("server", "start", "--name", network, "--system",
+                *(["--image", image] if image else []))
+            _wait_for_server(f"{host}:{port}/api/version", online_timeout)
+        with _phase(run, "node_start"):
+            with ThreadPoolExecutor(max(start_workers, 1)) as pool:
+                list(pool.map(
+                    lambda i: _v6("node", "start", "--name",
+                                  f"{network}_node_{i}",
+                                  *(["--image", image] if image else [])),
+                    range(1, num_nodes + 1)
+                ))
+        with _phase(run, "nodes_online"):
+            _wait_for_nodes(host, port, num_nodes, online_timeout)
+        with _phase(run, "diagnostics"):
+            results = click_ctx.invoke(
+                feature_tester, host=host, port=port, api_path='/api',
+                username='org_1-admin', password='password', collaboration=1,
+                organization=[], all_nodes=True, online_only=False,
+                timeout=timeout, no_history=True
+            )
+            run["succeeded"] = sum(
+                result["status"] == "completed" for result in results
+            )
+    except (Exception, SystemExit) as exc:
+        error(f"Scale test with {num_nodes} nodes failed: {exc!r}")
+
+    # the vantage6 commands exit when there is nothing to stop or remove
+    if "create" not in run["errors"]:
+        try:
+            with _phase(run, "teardown"):
+                click_ctx.invoke(stop_demo_network, name=network,
+                                 system_folders=True)
+                click_ctx.invoke(remove_demo_network, name=network,
+                                 system_folders=True)
+        except (Exception, SystemExit) as exc:
+            error(f"Could not remove the network {network}: {exc!r}")
+    run["phases"]["total"] = time.monotonic() - start
+    return run
+
+
+@contextmanager
+def _phase(run: dict, phase: str):
+    """Time a phase of the scale test, recording its error, if any."""
+    start = time.monotonic()
+    try:
+        yield
+    except (Exception, SystemExit) as exc:
+        run["errors"][phase] = repr(exc)
+        raise
+    finally:
+        run["phases"][phase] = time.monotonic() - start
+
+
+def _phase_cell(run: dict, phase: str) -> str:
+    if phase in run["errors"]:
+        return "[red]failed[/red]"
+    seconds = run["phases"].get(phase)
+    return "" if seconds is None else f"{seconds:.1f}"
+
+
+def _v6(*args: str) -> None:
+    """Run a `v6` command, raising if it fails."""
+    subprocess.run(["v6", *args], check=True)
+
+
+def _wait_for_server(url: str, timeout: float) -> None:
+    """Wait until the server API responds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if requests.get(url, timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Server not up after {timeout} seconds")
+        time.sleep(1)
+
+
+def _wait_for_nodes(host: str, port: int, num_nodes: int, timeout: float) \
+        -> None:
+    """Wait until all nodes of the development network are online."""
+    client = UserClient(host=host, port=port, path='/api',
+                        log_level='critical')
+    client.authenticate(username='org_1-admin', password='password')
+    deadline = time.monotonic() + timeout
+    while True:
+        online = fetch_all(client.node.list, is_online=True)
+        if len(online) >= num_nodes:
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"{len(online)} of {num_nodes} nodes online after {timeout} "
+                "seconds"
+            )
+        time.sleep(2)
+
+
+@cli_test.command(name="benchmark-harness")
+@click.option("-s", "--scenario", "scenarios", multiple=True,
+              type=click.Choice(list(SCENARIOS)), default=list(SCENARIOS),
+              show_default=True,
+              help="Network conditions of the fake proxy")
+@click.option("-m", "--method", "methods", multiple=True,
+              type=click.Choice(["base_features", "vpn_features"]),
+              default=["base_features", "vpn_features"], show_default=True,
+              help="Diagnostics to run")
+@click.option("--num-organizations", type=int, default=3, show_default=True,
+              help="Number of organizations in the fake collaboration")
+def benchmark_harness(
+    scenarios: list[str], methods: list[str], num_organizations: int
+) -> list[dict]:
+    """
+    Time the diagnostics offline, on a fake node with a degraded network.
+
+    The diagnostics run in this process against a fake local proxy, and
+    their subtasks in local processes, see `cli.harness`. No server, node or
+    Docker is needed.
+    """
+    rows = benchmark(
+        {scenario: SCENARIOS[scenario] for scenario in scenarios},
+        {method: {} for method in methods},
+        list(range(1, num_organizations + 1)),
+    )
+
+    t_ = Table(title="Wall-clock time of the diagnostics on the harness")
+    for column in ("scenario", "method"):
+        t_.add_column(column)
+    for column in ("seconds", "passed", "requests", "errors"):
+        t_.add_column(column, justify="right")
+    t_.add_column("failed")
+    for row in rows:
+        t_.add_row(
+            row["scenario"], row["method"], f"{row['seconds']:.2f}",
+            f"{row['checks'] - len(row['failed'])}/{row['checks']}",
+            str(row["requests"]), str(row["injected_errors"]),
+            ", ".join(row["failed"])
+        )
+    Console().print(t_)
+    return rows
@@ -18,13 +18,14 @@ setup(
     long_description_content_type='text/markdown',
     url='https://github.com/vantage6/v6-diagnostics',
     packages=find_packages(),
-    python_requires='>=3.6',
+    python_requires='>=3.10',
     install_requires=[
         'vantage6-client',
         'vantage6-algorithm-tools',
         'requests',
         'pyjwt',
         'rich',
+        'numpy',
         'click'
     ],
     entry_points={
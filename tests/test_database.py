@@ -0,0 +1,52 @@
+"""
+Read database files, see `v6_diagnostics.base_features.diagnose_database`.
+"""
+import hashlib
+import time
+
+from v6_diagnostics.base_features import _parquet_metadata, _read_file
+
+
+def test_read_csv(tmp_path):
+    path = tmp_path / "data.csv"
+    content = b"a,b\n1,2\n3,4\n"
+    path.write_bytes(content)
+
+    metrics = _read_file(str(path), "csv", None)
+
+    assert metrics["complete"] and not metrics["truncated"]
+    assert metrics["sha256"] == hashlib.sha256(content).hexdigest()
+    assert metrics["csv"]["rows"] == 2
+    assert metrics["csv"]["columns"] == ["a", "b"]
+
+
+def test_read_limit(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"a,b\n" + b"1,2\n" * 1000)
+
+    metrics = _read_file(str(path), "csv", 100)
+
+    assert metrics["bytes_read"] == 100
+    assert not metrics["complete"] and not metrics["truncated"]
+    assert metrics["sha256"] is None
+
+
+def test_read_deadline(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"a,b\n" + b"1,2\n" * 100000)
+
+    # only the first chunk is read after the deadline has passed
+    metrics = _read_file(str(path), "csv", None, time.perf_counter())
+
+    assert metrics["truncated"] and not metrics["complete"]
+    assert 0 < metrics["bytes_read"] < path.stat().st_size
+    assert metrics["throughput"]
+
+
+def test_parquet_short_file(tmp_path):
+    path = tmp_path / "data.parquet"
+    path.write_bytes(b"PA")
+
+    metadata = _parquet_metadata(str(path))
+
+    assert metadata["valid"] is False
@@ -0,0 +1,54 @@
+"""
+Run the diagnostics through the offline harness, see `cli.harness`.
+"""
+import socket
+
+import pytest
+
+from cli.harness import Harness, SCENARIOS
+
+
+@pytest.fixture
+def harness():
+    with Harness(conditions=SCENARIOS["local"]) as harness:
+        yield harness
+
+
+def closed_port() -> int:
+    """A port on the loopback interface that nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def failed(results: list[dict]) -> list[str]:
+    return [result["name"] for result in results if not result["success"]]
+
+
+def test_base_features(harness):
+    # the harness does not isolate the process from the internet, so the
+    # isolation check probes a target that is known to be unreachable
+    _, results = harness.run(
+        "base_features",
+        isolation_options={"targets": [f"tcp:127.0.0.1:{closed_port()}"]},
+    )
+    assert results
+    assert not failed(results)
+
+
+def test_subtask_checks(harness):
+    _, results = harness.run(
+        "base_features", checks=["TEMPORARY_VOLUME_SUBTASK"]
+    )
+    assert [result["name"] for result in results] == \
+        ["TEMPORARY_VOLUME", "TEMPORARY_VOLUME_SUBTASK"]
+    assert not failed(results)
+
+
+def test_vpn_features(harness):
+    _, results = harness.run(
+        "vpn_features", other_nodes=harness.organizations, mesh=True
+    )
+    assert [result["name"] for result in results] == \
+        ["VPN connection", "VPN mesh"]
+    assert not failed(results)
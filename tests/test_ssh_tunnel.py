@@ -0,0 +1,137 @@
+"""
+Diagnose local stand-ins for SSH tunnels, see `v6_diagnostics.ssh_tunnel`.
+"""
+import asyncio
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from v6_diagnostics import vpn, vpn_benchmark
+from v6_diagnostics.ssh_tunnel import check_tunnel, diagnose_ssh_tunnel
+
+
+BANNER = b"SSH-2.0-stand-in\r\n"
+
+
+class BannerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.sendall(BANNER)
+
+
+class CloseHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        pass
+
+
+def serve(handler):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def banner_server():
+    server = serve(BannerHandler)
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def closing_server():
+    server = serve(CloseHandler)
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def quiet_server():
+    """Accepts connections, but never answers."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(16)
+        yield sock.getsockname()[1]
+
+
+@pytest.fixture
+def echo_server():
+    """The echo server of the VPN diagnostics, which the benchmark needs."""
+    port = closed_port()
+    thread = threading.Thread(
+        target=asyncio.run, args=(vpn._serve_echo(60, port=port),),
+        daemon=True,
+    )
+    thread.start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield port
+    asyncio.run(vpn_benchmark.stop_server("127.0.0.1", port))
+    thread.join(10)
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_banner(banner_server):
+    metrics = check_tunnel("127.0.0.1", banner_server, connects=3)
+
+    assert metrics["states"] == {"banner": 3}
+    assert metrics["banner"] == BANNER.decode()
+    assert metrics["first_connect"] is not None
+    assert metrics["reconnect"]
+
+
+def test_quiet(quiet_server):
+    result = diagnose_ssh_tunnel(
+        f"127.0.0.1:{quiet_server}", connects=2, response_wait=0.1
+    )
+    assert result.success
+    assert result.metrics["states"] == {"quiet": 2}
+    assert result.metrics["banner"] is None
+
+
+def test_closed(closing_server):
+    result = diagnose_ssh_tunnel(
+        {"host": "127.0.0.1", "port": closing_server}, connects=2
+    )
+    assert not result.success
+    assert result.metrics["states"] == {"closed": 2}
+
+
+def test_failed_connect():
+    result = diagnose_ssh_tunnel(
+        f"127.0.0.1:{closed_port()}", connects=2, timeout=1
+    )
+    assert not result.success
+    assert result.metrics["states"] == {"failed": 2}
+    assert result.metrics["first_connect"] is None
+    assert sum(result.metrics["errors"].values()) == 2
+
+
+def test_benchmark(echo_server):
+    result = diagnose_ssh_tunnel(
+        f"127.0.0.1:{echo_server}", benchmark=True, connects=2,
+        response_wait=0.1,
+        benchmark_options={
+            "rounds": 5, "payload_sizes": [1024, 64 * 1024], "streams": 2
+        },
+    )
+    benchmark = result.metrics["benchmark"]
+
+    assert result.success
+    assert "stand-in" in benchmark["service"]
+    assert [t["size"] for t in benchmark["transfers"]] == [1024, 64 * 1024]
+    assert benchmark["streams"]["streams"] == 2
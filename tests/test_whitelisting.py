@@ -0,0 +1,104 @@
+"""
+Probe local stand-ins for whitelisted and blocked targets, see
+`v6_diagnostics.whitelisting`.
+"""
+import socket
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from v6_diagnostics.whitelisting import (
+    diagnose_whitelisting, normalize, probe_whitelist
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def silent_server():
+    """Accepts connections, but never answers."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(16)
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    for name in ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def by_target(metrics: dict) -> dict[str, dict]:
+    return {probe["target"]: probe for probe in metrics["probes"]}
+
+
+def test_normalize():
+    assert normalize("example.com") == "https://example.com"
+    assert normalize("example.com:5432") == "tcp:example.com:5432"
+    assert normalize("dns:example.com") == "dns:example.com"
+
+
+def test_allowed_and_disallowed(http_server):
+    blocked = f"127.0.0.1:{closed_port()}"
+    metrics = probe_whitelist([http_server], [blocked], timeout=2)
+    probes = by_target(metrics)
+
+    assert probes[http_server]["status"] == "reachable"
+    assert probes[http_server]["detail"] == 200
+    assert probes[f"tcp:{blocked}"]["status"] == "rejected"
+    assert all(probe["as_expected"] for probe in probes.values())
+
+
+def test_unexpected(http_server):
+    result = diagnose_whitelisting([], disallowed=[http_server], timeout=2)
+    assert not result.success
+    assert result.payload["unexpected"] == [http_server]
+
+
+def test_dns_is_information_only():
+    metrics = probe_whitelist([], ["dns:localhost"], timeout=2)
+    assert metrics["probes"][0]["as_expected"] is None
+
+
+def test_not_probed(silent_server):
+    # a single worker that hangs on the first target never gets to the others
+    targets = [f"{silent_server}/{i}" for i in range(3)]
+    result = diagnose_whitelisting(
+        [], disallowed=targets, max_workers=1, timeout=2, budget=0.5
+    )
+    statuses = [probe["status"] for probe in result.metrics["probes"]]
+
+    assert statuses == ["dropped", "not_probed", "not_probed"]
+    assert not result.success
+    assert result.payload["not_probed"] == targets[1:]
+
+
+def test_default_budget_probes_every_target(http_server):
+    targets = [f"{http_server}/{i}" for i in range(4)]
+    metrics = probe_whitelist(targets, [], max_workers=1, timeout=2)
+    assert all(probe["as_expected"] for probe in metrics["probes"])
@@ -1,71 +1,390 @@
-from vantage6.algorithm.client import AlgorithmClient
-from vantage6.algorithm.tools.decorators import algorithm_client
+import time
 
-from v6_diagnostics.util import header, DiagnosticResult
-from v6_diagnostics.base_features import (  # noqa: F401
+# when the first line of the package ran, see `v6_diagnostics.startup`
+STARTED = time.time()
+
+import importlib  # noqa: E402
+
+from typing import TYPE_CHECKING  # noqa: E402
+
+from v6_diagnostics.util import (  # noqa: F401, E402
+    header, set_profiling, algorithm_client, DiagnosticResult, PROFILE_TOP
+)
+from v6_diagnostics.scheduler import (  # noqa: E402
+    Check, run_checks, DEFAULT_TIMEOUT, MAX_WORKERS
+)
+from v6_diagnostics.encoding import (  # noqa: E402
+    encode_results, RESULT_BUDGET, TASK_BUDGET
+)
+from v6_diagnostics.registry import (  # noqa: F401, E402
+    register_check,
+    register_child,
+    registered_checks,
+    child_task,
+    select,
+    build_checks,
+)
+from v6_diagnostics.base_features import (  # noqa: F401, E402
     diagnose_environment,
     diagnose_input_file,
     diagnose_output_file,
     diagnose_token_file,
     diagnose_temporary_volume,
     diagnose_temporary_volume_file_exists,
+    diagnose_temporary_volume_benchmark,
+    diagnose_temporary_volume_subtask,
     diagnose_local_proxy,
+    diagnose_local_proxy_benchmark,
     diagnose_local_proxy_subtask,
-    # child task runs this, so we need to keep the import here
-    diagnose_local_proxy_subtask_stop,
+    diagnose_subtask_benchmark,
+    diagnose_payload_sweep,
     diagnose_isolation,
     diagnose_external_port,
-    diagnose_database
+    diagnose_compute_limits,
+    diagnose_compute_benchmark,
+    diagnose_startup,
+    diagnose_database,
+    DATABASE_READ_LIMIT,
+    DATABASE_READ_SECONDS,
+    PAYLOAD_SWEEP_TIMEOUT,
 )
-
-from v6_diagnostics.vpn import (  # noqa: F401
-    diagnose_vpn_connection,
-    RPC_echo,
-    RPC_wait
+from v6_diagnostics.whitelisting import (  # noqa: F401, E402
+    diagnose_whitelisting,
+    MAX_WORKERS as WHITELIST_MAX_WORKERS,
+    SAMPLE as WHITELIST_SAMPLE,
 )
 
+if TYPE_CHECKING:
+    from vantage6.algorithm.client import AlgorithmClient
+
+
+SUBTASK_TIMEOUT = 300
+# Imported on first use, by the module that defines them. Most containers only
+# run one method, so e.g. a subtask that stops right away or an echo server
+# should not pay for the imports of the other diagnostics.
+_LAZY = {
+    "diagnose_ssh_tunnel": "v6_diagnostics.ssh_tunnel",
+    "tunnel_name": "v6_diagnostics.ssh_tunnel",
+    "diagnose_vpn_connection": "v6_diagnostics.vpn",
+    "diagnose_vpn_mesh": "v6_diagnostics.vpn",
+    "RPC_echo": "v6_diagnostics.vpn",
+    "RPC_mesh": "v6_diagnostics.vpn",
+    "RPC_wait": "v6_diagnostics.vpn",
+}
+
+
+def __getattr__(name: str):
+    """
+    Import the names in `_LAZY` on first use, and resolve the child tasks of
+    the checks, see `register_child`.
+    """
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    try:
+        return child_task(name)
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY))
+
 
 @algorithm_client
-def base_features(client: AlgorithmClient) -> list[DiagnosticResult]:
+def base_features(
+    client: "AlgorithmClient",
+    checks: list[str] | None = None,
+    tags: list[str] | None = None,
+    exclude_tags: list[str] | None = None,
+    safe_only: bool = False,
+    check_options: dict[str, dict] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    subtask_timeout: float = SUBTASK_TIMEOUT,
+    max_workers: int = MAX_WORKERS,
+    profile: bool = False,
+    profile_top: int = PROFILE_TOP,
+    database_read_limit: int | None = DATABASE_READ_LIMIT,
+    database_read_seconds: float | None = DATABASE_READ_SECONDS,
+    temporary_volume_options: dict | None = None,
+    isolation_options: dict | None = None,
+    proxy_benchmark: bool = False,
+    proxy_benchmark_options: dict | None = None,
+    subtask_benchmark: bool = False,
+    subtask_benchmark_options: dict | None = None,
+    payload_sweep: bool = False,
+    payload_sweep_options: dict | None = None,
+    compute_benchmark: bool = False,
+    compute_benchmark_options: dict | None = None,
+    result_budget: int | None = RESULT_BUDGET,
+    task_budget: int | None = TASK_BUDGET,
+    compress: bool = False,
+) -> list[dict] | dict:
     """
-    Run all tests for the base features of vantage6.
+    Run the tests for the base features of vantage6.
+
+    The checks to run are selected from `v6_diagnostics.registry`, by
+    default all checks except the expensive benchmarks.
+    Independent checks run concurrently, see `v6_diagnostics.scheduler`.
 
     Parameters
     ----------
     client : AlgorithmClient
         The client to use for the diagnostics.
+    checks : list[str], optional
+        Names of the checks to run.
+    tags : list[str], optional
+        Run the checks with any of these tags, e.g. ``["cheap"]`` for a quick
+        health ping. Without checks and tags the ``default`` checks run.
+    exclude_tags : list[str], optional
+        Do not run the checks with any of these tags, e.g. ``["subtask"]``.
+    safe_only : bool, optional
+        Only run the checks that are safe to run on every node.
+    check_options : dict[str, dict], optional
+        Keyword arguments of checks by name, e.g. for third-party checks.
+        These take precedence over the options below.
+    timeout : float, optional
+        Maximum number of seconds a single check is allowed to take.
+    subtask_timeout : float, optional
+        Maximum number of seconds the subtask round-trip is allowed to take.
+    max_workers : int, optional
+        Maximum number of checks that run at the same time.
+    profile : bool, optional
+        Attach a cProfile summary and the tracemalloc peak to each result. The
+        checks run one at a time when profiling, so that they do not disturb
+        each other's measurements.
+    profile_top : int, optional
+        Number of functions in the cProfile summary.
+    database_read_limit : int | None, optional
+        Maximum number of bytes read from each file-based database, None to
+        read (and hash) the whole file.
+    database_read_seconds : float | None, optional
+        Maximum number of seconds spent reading all file-based databases,
+        None for no limit. Reads that are stopped are reported as
+        ``truncated``.
+    temporary_volume_options : dict, optional
+        Options for the temporary volume benchmark, see
+        `v6_diagnostics.volume_benchmark.benchmark_volume`. When
+        ``TEMPORARY_VOLUME_BENCHMARK`` is selected, the child container of
+        ``TEMPORARY_VOLUME_SUBTASK`` runs the benchmark as well.
+    isolation_options : dict, optional
+        Targets, timeout and time budget of the isolation probe, see
+        `v6_diagnostics.base_features.diagnose_isolation`.
+    proxy_benchmark : bool, optional
+        Also benchmark the local proxy, same as adding
+        ``LOCAL_PROXY_BENCHMARK`` to the checks. Like all expensive checks,
+        this runs after the other checks so that the load does not disturb
+        them.
+    proxy_benchmark_options : dict, optional
+        Options for the proxy benchmark, see
+        `v6_diagnostics.proxy_benchmark.benchmark_proxy`.
+    subtask_benchmark : bool, optional
+        Also benchmark the round-trip of subtasks (``SUBTASK_BENCHMARK``).
+    subtask_benchmark_options : dict, optional
+        Options for the subtask benchmark, see
+        `v6_diagnostics.subtask_benchmark.benchmark_subtasks`.
+    payload_sweep : bool, optional
+        Also sweep the size of subtask inputs and results
+        (``PAYLOAD_SWEEP``). The sweep may take up to an hour on slow links.
+    payload_sweep_options : dict, optional
+        Options for the payload sweep, see
+        `v6_diagnostics.payload_benchmark.sweep_payloads`.
+    compute_benchmark : bool, optional
+        Also benchmark the CPU and memory of the container
+        (``COMPUTE_BENCHMARK``).
+    compute_benchmark_options : dict, optional
+        Options for the compute benchmark, see
+        `v6_diagnostics.compute_benchmark.benchmark_compute`.
+    result_budget : int | None, optional
+        Maximum size in bytes of the JSON of a single result, None for no
+        maximum.
+    task_budget : int | None, optional
+        Maximum size in bytes of the JSON of all results, None for no maximum.
+    compress : bool, optional
+        Compress the results.
 
     Returns
     -------
-    list[DiagnosticResult]
-        The results of the diagnostics.
+    list[dict] | dict
+        The JSON representations of the results of the diagnostics, encoded
+        with `v6_diagnostics.encoding.encode_results`.
     """
     header('Running base feature diagnostics')
-    results = [
-        diagnose_environment().json,
-        diagnose_input_file().json,
-        diagnose_output_file().json,
-        diagnose_token_file().json,
-        diagnose_temporary_volume().json,
-        diagnose_temporary_volume_file_exists().json,
-        diagnose_local_proxy().json,
-        diagnose_local_proxy_subtask(client).json,
-        diagnose_isolation().json,
-        diagnose_external_port().json,
+    if profile:
+        set_profiling(True, profile_top)
+        max_workers = 1
+
+    requested = [
+        name for name, flag in (
+            ("LOCAL_PROXY_BENCHMARK", proxy_benchmark),
+            ("SUBTASK_BENCHMARK", subtask_benchmark),
+            ("PAYLOAD_SWEEP", payload_sweep),
+            ("COMPUTE_BENCHMARK", compute_benchmark),
+        ) if flag
     ]
-    results.extend(
-        [diagnosis.json for diagnosis in diagnose_database()]
+    if checks is None and tags is None:
+        tags = ["default"]
+    specs = select(
+        list(checks or []) + requested, tags, exclude_tags, safe_only
     )
 
-    return results
+    options = {
+        "TEMPORARY_VOLUME_BENCHMARK": temporary_volume_options,
+        "TEMPORARY_VOLUME_SUBTASK": {
+            **(temporary_volume_options or {}),
+            "benchmark": any(
+                spec.name == "TEMPORARY_VOLUME_BENCHMARK" for spec in specs
+            ),
+        },
+        "ISOLATION": isolation_options,
+        "DATABASE": {
+            "max_bytes": database_read_limit,
+            "max_seconds": database_read_seconds,
+        },
+        "LOCAL_PROXY_BENCHMARK": proxy_benchmark_options,
+        "SUBTASK_BENCHMARK": subtask_benchmark_options,
+        "PAYLOAD_SWEEP": payload_sweep_options,
+        "COMPUTE_BENCHMARK": compute_benchmark_options,
+    }
+    for name, opts in (check_options or {}).items():
+        options[name] = {**(options.get(name) or {}), **opts}
+    checks = build_checks(
+        specs, client, options,
+        {"check": timeout, "subtask": subtask_timeout}
+    )
+
+    return encode_results(
+        [diagnosis.json for diagnosis in run_checks(checks, max_workers)],
+        result_budget, task_budget, compress
+    )
 
 
 @algorithm_client
-def vpn_features(client: AlgorithmClient, other_nodes) \
-        -> list[DiagnosticResult]:
-    """Run all diagnostics."""
+def vpn_features(client: "AlgorithmClient", other_nodes, mesh: bool = False,
+                 mesh_options: dict | None = None,
+                 result_budget: int | None = RESULT_BUDGET,
+                 task_budget: int | None = TASK_BUDGET,
+                 compress: bool = False, **kwargs) -> list[dict] | dict:
+    """
+    Run all diagnostics.
+
+    Pass ``benchmark=True`` to also measure the latency and throughput of the
+    VPN links. Other keyword arguments are passed to
+    `v6_diagnostics.vpn_benchmark.benchmark_address`.
+
+    Pass ``mesh=True`` to also test the links between every pair of nodes,
+    ``mesh_options`` are passed to `v6_diagnostics.vpn.RPC_mesh`.
+
+    The results are encoded like those of `base_features`.
+    """
+    from v6_diagnostics.vpn import diagnose_vpn_connection, diagnose_vpn_mesh
+
     header('Running VPN feature diagnostics')
     results = [
-        diagnose_vpn_connection(client, other_nodes).json
+        diagnose_vpn_connection(client, other_nodes, **kwargs).json
+    ]
+    if mesh:
+        results.append(
+            diagnose_vpn_mesh(client, other_nodes, **(mesh_options or {})).json
+        )
+    return encode_results(results, result_budget, task_budget, compress)
+
+
+def whitelisting_features(
+    allowed: list[str],
+    disallowed: list[str] | None = None,
+    sample: int | None = WHITELIST_SAMPLE,
+    max_workers: int = WHITELIST_MAX_WORKERS,
+    result_budget: int | None = RESULT_BUDGET,
+    task_budget: int | None = TASK_BUDGET,
+    compress: bool = False,
+    **kwargs
+) -> list[dict] | dict:
+    """
+    Run the diagnostics of the whitelisting of the node.
+
+    Parameters
+    ----------
+    allowed : list[str]
+        Targets that are whitelisted, see `v6_diagnostics.whitelisting`.
+    disallowed : list[str], optional
+        Targets that are not whitelisted, by default
+        `v6_diagnostics.whitelisting.DISALLOWED`.
+    sample : int | None, optional
+        Number of disallowed targets to probe, None to probe all of them.
+    max_workers : int, optional
+        Maximum number of probes that run at the same time.
+
+    Other keyword arguments (``timeout`` and ``budget``) are passed to
+    `v6_diagnostics.whitelisting.probe_whitelist`. The results are encoded
+    like those of `base_features`.
+    """
+    header('Running whitelisting diagnostics')
+    results = [
+        diagnose_whitelisting(
+            allowed, disallowed=disallowed, sample=sample,
+            max_workers=max_workers, **kwargs
+        ).json
+    ]
+    return encode_results(results, result_budget, task_budget, compress)
+
+
+def ssh_tunnel_features(
+    tunnels: list[str | dict],
+    benchmark: bool = False,
+    benchmark_options: dict | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    max_workers: int = MAX_WORKERS,
+    result_budget: int | None = RESULT_BUDGET,
+    task_budget: int | None = TASK_BUDGET,
+    compress: bool = False,
+    **kwargs
+) -> list[dict] | dict:
+    """
+    Run the diagnostics of the SSH tunnels of the node.
+
+    The tunnels are diagnosed concurrently, see `v6_diagnostics.ssh_tunnel`.
+
+    Parameters
+    ----------
+    tunnels : list[str | dict]
+        Hostname and bind port of each tunnel, as ``host:port`` or as dict
+        with a ``host`` and ``port``.
+    benchmark : bool, optional
+        Also measure the throughput of the tunnels. This needs an echo server
+        of this algorithm behind the tunnel.
+    benchmark_options : dict, optional
+        Options for `v6_diagnostics.vpn_benchmark.benchmark_address`.
+    timeout : float, optional
+        Maximum number of seconds the diagnostic of a single tunnel may take.
+    max_workers : int, optional
+        Maximum number of tunnels that are diagnosed at the same time.
+
+    Other keyword arguments (``connects``, ``response_wait``) are passed to
+    `v6_diagnostics.ssh_tunnel.check_tunnel`. The results are encoded like
+    those of `base_features`.
+    """
+    from v6_diagnostics.ssh_tunnel import diagnose_ssh_tunnel, tunnel_name
+
+    header('Running SSH tunnel diagnostics')
+    checks = [
+        Check(
+            tunnel_name(tunnel),
+            diagnose_ssh_tunnel,
+            args=(tunnel, benchmark, benchmark_options),
+            kwargs=kwargs,
+            timeout=timeout,
+        )
+        for tunnel in tunnels
     ]
-    return results
+    return encode_results(
+        [diagnosis.json for diagnosis in run_checks(checks, max_workers)],
+        result_budget, task_budget, compress
+    )
+
+
+# when the import of the package finished
+IMPORTED = time.time()
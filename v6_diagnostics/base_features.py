@@ -19,6 +19,16 @@ does not use any wrapper functions. The following features are tested:
         Creates a file in the temporary directory. The temporary directory is
         a directory that is shared between all containers that share the same
         run id. This checks that the temporary directory is writable.
+    Temporary volume benchmark
+        Measures the sequential and random read/write throughput, the fsync
+        latency and the small-file create rate of the temporary volume, see
+        `v6_diagnostics.volume_benchmark`.
+    Temporary volume sharing
+        Creates a subtask that reads a file written by the parent container,
+        writes a file back and benchmarks the temporary volume from its side.
+        The parent then checks that it can read the file of the child. This
+        is only run when requested (tag ``subtask``), as it costs another
+        subtask round-trip.
     Local proxy
         Sends a request to the local proxy. The local proxy is used to reach
         the central server from the algorithm container. This is needed as
@@ -26,12 +36,34 @@ does not use any wrapper functions. The following features are tested:
         (=subtasks). The local proxy also handles encryption/decryption of the
         input and results as the algorithm container is not allowed to know
         the private key.
+    Local proxy benchmark
+        Sends many requests to the local proxy, one after another and
+        concurrently over a pooled session, and reports the latency
+        percentiles, requests per second and error rate, see
+        `v6_diagnostics.proxy_benchmark`. This is only run when requested.
     Subtask creation
         Creates a subtask (using the local proxy) and waits for the result.
+    Subtask benchmark
+        Creates many subtasks, one after another or in a burst, and reports
+        the distribution of the latency of each phase of their round-trip,
+        see `v6_diagnostics.subtask_benchmark`. This is only run when
+        requested.
+    Payload sweep
+        Sends subtask inputs and returns results of increasing size through
+        the local proxy, which encrypts them, and reports the latency and
+        throughput per size and the size at which the transfer fails, see
+        `v6_diagnostics.payload_benchmark`. This is only run when requested.
     Isolation test
         Checks if the algorithm container is isolated such that it can not
-        reach the internet. It tests this by trying to reach google.nl, so make
-        sure this is not a whitelisted domain when testing.
+        reach the internet. It probes a set of targets concurrently: TCP
+        connections to IP addresses (skipping DNS) and HTTP(S) requests to
+        google.nl and 1.1.1.1, so make sure these are not whitelisted when
+        testing. A refusal by the whitelisting proxy counts as isolated. DNS
+        lookups are reported as information only, as Docker's DNS server
+        resolves external names on internal networks too. The local proxy is
+        probed as a control to tell a firewall that drops packets apart from a
+        slow network, and the check finishes within a fixed time budget, see
+        `v6_diagnostics.network`.
     External port test
         Check that the algorithm can find its own ports. Algorithms can
         request a dedicated port for communication with other algorithm
@@ -43,26 +75,83 @@ does not use any wrapper functions. The following features are tested:
         ```
         It however does not check that the application is actually listening
         on the port.
+    Compute resources
+        Reports the nominal CPU count of the host next to the CPU quota and
+        memory limit of the container (cgroup), and how often the container
+        was throttled. When requested, also benchmarks the single-core and
+        all-core throughput, the memory bandwidth and the largest allocation
+        that succeeds, see `v6_diagnostics.compute_benchmark`.
+    Startup
+        Reports the time from the start of the container to the first line of
+        this package and how long the package took to import, and for the
+        child tasks (and the base features) which modules their containers
+        import and how long each import takes, see `v6_diagnostics.startup`.
+        This is only run when requested (tag ``profiling``), and after the
+        other checks, so that it does not measure their load.
     Database readable
-        Check if the file-based database is readable.
+        Check if the file-based database is readable. The file is streamed
+        in large chunks to measure the time to first byte and the read
+        throughput, and to compute its SHA-256 hash. For CSV files the rows
+        are counted and the delimiter and columns are sniffed, for Parquet
+        files the footer is checked (and the schema read if pyarrow is
+        available). Reading stops after a number of bytes or seconds, and a
+        read that was stopped by the time limit is reported as ``truncated``
+        with the throughput up to that point.
+
+The checks are registered in `v6_diagnostics.registry`, so that a task can
+select which of them to run.
 """
-
-# TODO: check that the temporary volume is readable and writable by the
-#       child algorithm container.
-# TODO: child container should trigger different function
 import os
-import requests
-import jwt
+import csv
+import time
+import hashlib
 
+from collections import Counter
 from pathlib import Path
-
-from requests.exceptions import ConnectionError
-from vantage6.algorithm.client import AlgorithmClient
-
-from v6_diagnostics.util import DiagnosticResult, header
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+from v6_diagnostics.util import DiagnosticResult, header, timed, span
+from v6_diagnostics.registry import register_check, register_child
+from v6_diagnostics.volume_benchmark import benchmark_volume
+from v6_diagnostics.network import (
+    probe_all, TARGETS, TIMEOUT as PROBE_TIMEOUT, BUDGET as PROBE_BUDGET
+)
+from v6_diagnostics.subtask_benchmark import benchmark_subtasks
+from v6_diagnostics.payload_benchmark import random_payload, sweep_payloads
+from v6_diagnostics.compute_benchmark import (
+    benchmark_compute, cpu_limits, memory_limits, cpu_throttling
+)
+from v6_diagnostics.startup import (
+    cold_start, import_times, METHODS as STARTUP_METHODS, TOP as STARTUP_TOP
+)
 from vantage6.algorithm.tools.util import get_env_var
 
-
+# The child tasks import this module, so requests, jwt and the algorithm
+# client are only imported by the checks that use them, to keep the start of
+# the child containers fast.
+if TYPE_CHECKING:
+    from vantage6.algorithm.client import AlgorithmClient
+
+
+# databases are read up to this many bytes, and for at most this many seconds
+# in total, so that the check finishes well within its timeout on datasets of
+# many GB and on slow (network) storage
+DATABASE_READ_LIMIT = 64 * 1024 ** 2
+DATABASE_READ_SECONDS = 20
+CHUNK_SIZE = 8 * 1024 ** 2
+SNIFF_SIZE = 64 * 1024
+PARQUET_MAGIC = b"PAR1"
+SHARED_FILE_SIZE = 64 * 1024
+PARENT_FILE = "parent.bin"
+CHILD_FILE = "child.txt"
+PAYLOAD_SWEEP_TIMEOUT = 3600
+# seconds to wait for the local proxy to accept a connection or respond
+PROXY_TIMEOUT = 10
+
+
+@register_check("ENVIRONMENT", "environment")
+@timed
 def diagnose_environment() -> DiagnosticResult:
     """Diagnose the environment of the algorithm container."""
     header("Diagnose the environment of the algorithm container")
@@ -71,6 +160,8 @@ def diagnose_environment() -> DiagnosticResult:
     return diagnostic
 
 
+@register_check("INPUT_FILE", "files")
+@timed
 def diagnose_input_file() -> DiagnosticResult:
     """Diagnose the input file."""
     header("Diagnose the input file")
@@ -85,6 +176,8 @@ def diagnose_input_file() -> DiagnosticResult:
     return diagnostic
 
 
+@register_check("OUTPUT_FILE", "files")
+@timed
 def diagnose_output_file() -> DiagnosticResult:
     """Diagnose the output file."""
     header("Diagnose the output file")
@@ -104,6 +197,8 @@ def diagnose_output_file() -> DiagnosticResult:
     return diagnostic
 
 
+@register_check("TOKEN_FILE", "files")
+@timed
 def diagnose_token_file() -> DiagnosticResult:
     """Diagnose the token file."""
     header("Diagnose the token file")
@@ -118,6 +213,8 @@ def diagnose_token_file() -> DiagnosticResult:
     return diagnostic
 
 
+@register_check("TEMPORARY_VOLUME", "storage")
+@timed
 def diagnose_temporary_volume() -> DiagnosticResult:
     """Diagnose the temporary volume."""
     header("Diagnose writing to temporary volume")
@@ -133,13 +230,20 @@ def diagnose_temporary_volume() -> DiagnosticResult:
     return diagnostic
 
 
+@register_check(
+    "TEMPORARY_VOLUME_FILE_EXISTS", "storage",
+    depends_on=["TEMPORARY_VOLUME"]
+)
+@timed
 def diagnose_temporary_volume_file_exists() -> DiagnosticResult:
     """Diagnose the temporary volume."""
     header("Diagnose that the temporary file is created")
     try:
         temp_file = Path(get_env_var("TEMPORARY_FOLDER")) / "test.txt"
         file_exists = Path(temp_file).exists()
-        diagnostic = DiagnosticResult("TEMPORARY_VOLUME_FILE_EXISTS", file_exists)
+        diagnostic = DiagnosticResult(
+            "TEMPORARY_VOLUME_FILE_EXISTS", file_exists
+        )
     except Exception as exc:
         diagnostic = DiagnosticResult(
             "TEMPORARY_VOLUME_FILE_EXISTS", False, exception=exc
@@ -149,14 +253,146 @@ def diagnose_temporary_volume_file_exists() -> DiagnosticResult:
     return diagnostic
 
 
+@register_check(
+    "TEMPORARY_VOLUME_BENCHMARK", "storage", cost="expensive",
+    default=False, tags=["benchmark"]
+)
+@timed
+def diagnose_temporary_volume_benchmark(**benchmark_options) \
+        -> DiagnosticResult:
+    """Benchmark the I/O performance of the temporary volume."""
+    header("Benchmark the temporary volume")
+    try:
+        metrics = benchmark_volume(
+            get_env_var("TEMPORARY_FOLDER"), **benchmark_options
+        )
+        diagnostic = DiagnosticResult(
+            "TEMPORARY_VOLUME_BENCHMARK", True, metrics=metrics
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult(
+            "TEMPORARY_VOLUME_BENCHMARK", False, exception=exc
+        )
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_check(
+    "TEMPORARY_VOLUME_SUBTASK", "storage", cost="moderate",
+    default=False, depends_on=["TEMPORARY_VOLUME"], tags=["subtask"],
+    needs_client=True, timeout="subtask"
+)
+@timed
+def diagnose_temporary_volume_subtask(
+    client: "AlgorithmClient", benchmark: bool = False, **benchmark_options
+) -> DiagnosticResult:
+    """
+    Diagnose sharing the temporary volume with a child container.
+
+    A small file is handed off in both directions. With ``benchmark`` the
+    child also benchmarks the volume, see
+    `v6_diagnostics.volume_benchmark.benchmark_volume`.
+    """
+    header("Diagnose sharing the temporary volume with a subtask")
+    try:
+        folder = Path(get_env_var("TEMPORARY_FOLDER"))
+        content = os.urandom(SHARED_FILE_SIZE)
+        (folder / PARENT_FILE).write_bytes(content)
+        expected = hashlib.sha256(content).hexdigest()
+        (folder / CHILD_FILE).unlink(missing_ok=True)
+
+        input_ = {
+            "method": "diagnose_temporary_volume_subtask_check",
+            "kwargs": {
+                "expected_sha256": expected,
+                "benchmark": benchmark,
+                **benchmark_options,
+            },
+        }
+        with span("create"):
+            task = client.task.create(
+                name="feature-tester-temporary-volume",
+                description="This task is from the feature tester",
+                organizations=[client.organization_id],
+                input_=input_,
+            )
+
+        with span("wait"):
+            results = client.wait_for_results(task.get("id"))
+
+        child = results[0] if results else {}
+        child_file = folder / CHILD_FILE
+        # the child writes the hash it read, so the parent can verify that it
+        # sees the file of the child
+        parent_read = (
+            child_file.exists() and child_file.read_text() == expected
+        )
+        metrics = {"child": child, "parent_read_child_file": parent_read}
+        diagnostic = DiagnosticResult(
+            "TEMPORARY_VOLUME_SUBTASK",
+            bool(child.get("read_parent_file")
+                 and child.get("wrote_child_file") and parent_read),
+            payload=child.get("error"),
+            metrics=metrics,
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult(
+            "TEMPORARY_VOLUME_SUBTASK", False, exception=exc
+        )
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_child
+def diagnose_temporary_volume_subtask_check(
+    *_args, expected_sha256: str, benchmark: bool = False,
+    **benchmark_options
+) -> dict:
+    """Subtask that shares the temporary volume with its parent."""
+    folder = Path(get_env_var("TEMPORARY_FOLDER"))
+    result = {"read_parent_file": False, "wrote_child_file": False}
+    try:
+        content = (folder / PARENT_FILE).read_bytes()
+        result["read_parent_file"] = (
+            hashlib.sha256(content).hexdigest() == expected_sha256
+        )
+        (folder / CHILD_FILE).write_text(expected_sha256)
+        result["wrote_child_file"] = True
+        if benchmark:
+            result["benchmark"] = benchmark_volume(folder, **benchmark_options)
+    except Exception as exc:
+        result["error"] = repr(exc)
+    return result
+
+
+@register_check("LOCAL_PROXY", "proxy")
+@timed
 def diagnose_local_proxy() -> DiagnosticResult:
     """Diagnose the local proxy."""
     header("Diagnose the local proxy")
     try:
-        host = get_env_var("HOST")
-        port = get_env_var("PORT")
-        response = requests.get(f"{host}:{port}/version")
-        diagnostic = DiagnosticResult("LOCAL_PROXY", response.status_code == 200)
+        import http.client
+
+        host = urlparse(get_env_var("HOST"))
+        port = int(get_env_var("PORT"))
+        connection_class = http.client.HTTPSConnection \
+            if host.scheme == "https" else http.client.HTTPConnection
+        # both phases use the same connection
+        connection = connection_class(
+            host.hostname, port, timeout=PROXY_TIMEOUT
+        )
+        try:
+            with span("connect"):
+                connection.connect()
+            with span("response"):
+                connection.request("GET", f"{host.path.rstrip('/')}/version")
+                response = connection.getresponse()
+                response.read()
+        finally:
+            connection.close()
+        diagnostic = DiagnosticResult("LOCAL_PROXY", response.status == 200)
     except Exception as exc:
         diagnostic = DiagnosticResult("LOCAL_PROXY", False, exception=exc)
 
@@ -164,26 +400,73 @@ def diagnose_local_proxy() -> DiagnosticResult:
     return diagnostic
 
 
-def diagnose_local_proxy_subtask(client: AlgorithmClient) -> DiagnosticResult:
+@register_check(
+    "LOCAL_PROXY_BENCHMARK", "proxy", cost="expensive", safe=False,
+    default=False, tags=["benchmark"], timeout="subtask"
+)
+@timed
+def diagnose_local_proxy_benchmark(**benchmark_options) -> DiagnosticResult:
+    """Benchmark the local proxy."""
+    header("Benchmark the local proxy")
+    try:
+        from v6_diagnostics.proxy_benchmark import benchmark_proxy
+
+        with open(get_env_var("TOKEN_FILE"), "r") as f:
+            token = f.read()
+
+        metrics = benchmark_proxy(
+            f"{get_env_var('HOST')}:{get_env_var('PORT')}", token,
+            **benchmark_options
+        )
+        success = all(
+            phase["error_rate"] == 0
+            for endpoint in metrics.values() for phase in endpoint.values()
+        )
+        diagnostic = DiagnosticResult(
+            "LOCAL_PROXY_BENCHMARK", success, metrics=metrics
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult(
+            "LOCAL_PROXY_BENCHMARK", False, exception=exc
+        )
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_check(
+    "CREATE_SUBTASK", "subtask", cost="moderate", needs_client=True,
+    timeout="subtask"
+)
+@timed
+def diagnose_local_proxy_subtask(client: "AlgorithmClient") \
+        -> DiagnosticResult:
     """Diagnose the local proxy."""
     header("Diagnose the local proxy subtask")
     try:
+        import jwt
 
         with open(get_env_var("TOKEN_FILE"), "r") as f:
             token = f.read()
 
-        identity = jwt.decode(token, options={"verify_signature": False})["sub"]
+        identity = jwt.decode(
+            token, options={"verify_signature": False}
+        )["sub"]
 
-        input_ = {"master": True, "method": "diagnose_local_proxy_subtask_stop"}
+        input_ = {
+            "master": True, "method": "diagnose_local_proxy_subtask_stop"
+        }
 
-        task = client.task.create(
-            name="feature-tester-subtask",
-            description="This task is from the feature tester",
-            organizations=[identity.get("organization_id")],
-            input_=input_,
-        )
+        with span("create"):
+            task = client.task.create(
+                name="feature-tester-subtask",
+                description="This task is from the feature tester",
+                organizations=[identity.get("organization_id")],
+                input_=input_,
+            )
 
-        result = client.wait_for_results(task.get("id"))
+        with span("wait"):
+            result = client.wait_for_results(task.get("id"))
 
         diagnostic = DiagnosticResult("CREATE_SUBTASK", result)
     except Exception as exc:
@@ -193,36 +476,123 @@ def diagnose_local_proxy_subtask(client: AlgorithmClient) -> DiagnosticResult:
     return diagnostic
 
 
+@register_check(
+    "SUBTASK_BENCHMARK", "subtask", cost="expensive", safe=False,
+    default=False, tags=["benchmark"], needs_client=True, timeout="subtask"
+)
+@timed
+def diagnose_subtask_benchmark(
+    client: "AlgorithmClient", **benchmark_options
+) -> DiagnosticResult:
+    """Benchmark the round-trip of subtasks."""
+    header("Benchmark the subtask round-trip")
+    try:
+        metrics = benchmark_subtasks(client, **benchmark_options)
+        diagnostic = DiagnosticResult(
+            "SUBTASK_BENCHMARK", metrics["failed"] == 0, metrics=metrics
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult(
+            "SUBTASK_BENCHMARK", False, exception=exc
+        )
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_child
 def diagnose_local_proxy_subtask_stop(*_args, **_kwargs) -> bool:
     """Subtask stop"""
     return True
 
 
-def diagnose_isolation() -> DiagnosticResult:
+@register_check(
+    "PAYLOAD_SWEEP", "subtask", cost="expensive", safe=False,
+    default=False, tags=["benchmark"], needs_client=True,
+    timeout=PAYLOAD_SWEEP_TIMEOUT
+)
+@timed
+def diagnose_payload_sweep(
+    client: "AlgorithmClient", **sweep_options
+) -> DiagnosticResult:
+    """Sweep the size of subtask inputs and results."""
+    header("Sweep the payload size of subtasks")
+    try:
+        metrics = sweep_payloads(client, **sweep_options)
+        success = all(
+            metrics[direction]["failed_at"] is None
+            for direction in ("input", "result")
+        )
+        diagnostic = DiagnosticResult(
+            "PAYLOAD_SWEEP", success, metrics=metrics
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult("PAYLOAD_SWEEP", False, exception=exc)
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_child
+def diagnose_payload_subtask(*_args, payload: str = "", size: int = 0) \
+        -> dict:
+    """Subtask that receives ``payload`` and returns ``size`` bytes."""
+    return {
+        "received": len(payload),
+        "size": size,
+        "payload": random_payload(size),
+    }
+
+
+@register_check("ISOLATION", "network", cost="moderate")
+@timed
+def diagnose_isolation(
+    targets: list[str] | None = None, timeout: float = PROBE_TIMEOUT,
+    budget: float = PROBE_BUDGET
+) -> DiagnosticResult:
+    """Diagnose that the algorithm container cannot reach the internet."""
     header("Diagnose the isolation of the algorithm container")
     try:
-        requests.get("https://google.nl")
-    except ConnectionError:
-        diagnostic = DiagnosticResult("ISOLATION", True)
-        print(diagnostic)
-        return diagnostic
+        host = get_env_var("HOST")
+        port = get_env_var("PORT")
+        control = f"tcp:{urlparse(host).hostname}:{port}" \
+            if host and port else None
+
+        probes = probe_all(targets or TARGETS, timeout, budget, control)
+        reachable = [
+            p["target"] for p in probes
+            if p["verdict"] == "open" and not p.get("control")
+        ]
+        metrics = {
+            "probes": probes,
+            "resolved": [
+                p["target"] for p in probes if p["verdict"] == "resolved"
+            ],
+            "verdicts": dict(Counter(
+                p["verdict"] for p in probes if not p.get("control")
+            )),
+        }
+        diagnostic = DiagnosticResult(
+            "ISOLATION", not reachable, payload=reachable or None,
+            metrics=metrics
+        )
     except Exception as exc:
         # We could end up here by some other error. This does not necessary
         # mean that the algorithm is not isolated.
         diagnostic = DiagnosticResult("ISOLATION", False, exception=exc)
-        print(diagnostic)
-        return diagnostic
 
-    # If we get here, we have a connection to the internet
-    diagnostic = DiagnosticResult("ISOLATION", False)
     print(diagnostic)
     return diagnostic
 
 
+@register_check("EXTERNAL_PORT_TEST", "network")
+@timed
 def diagnose_external_port() -> DiagnosticResult:
     """Diagnose the external port."""
     header("Diagnose the external port")
     try:
+        import requests
+
         with open(get_env_var("TOKEN_FILE"), "r") as f:
             token = f.read()
 
@@ -231,11 +601,12 @@ def diagnose_external_port() -> DiagnosticResult:
 
         # port should be published as we are running this code.. So no
         # need for polling
-        response = requests.get(
-            f"{host}:{port}/vpn/algorithm/addresses",
-            headers={"Authorization": "Bearer " + token},
-            params={"include_parent": True, "include_children": True},
-        )
+        with span("response"):
+            response = requests.get(
+                f"{host}:{port}/vpn/algorithm/addresses",
+                headers={"Authorization": "Bearer " + token},
+                params={"include_parent": True, "include_children": True},
+            )
 
         # we also assume that only a single task has been posted as we
         # are not testing the connectivity between nodes yet
@@ -254,16 +625,109 @@ def diagnose_external_port() -> DiagnosticResult:
             "EXTERNAL_PORT_TEST", all([p5, p8, pU]), payload=result
         )
     except Exception as exc:
-        diagnostic = DiagnosticResult("EXTERNAL_PORT_TEST", False, exception=exc)
+        diagnostic = DiagnosticResult(
+            "EXTERNAL_PORT_TEST", False, exception=exc
+        )
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_check("COMPUTE_LIMITS", "compute")
+@timed
+def diagnose_compute_limits() -> DiagnosticResult:
+    """Report the CPU and memory limits of the container."""
+    header("Diagnose the compute limits")
+    try:
+        metrics = {
+            "cpus": cpu_limits(),
+            "memory": memory_limits(),
+            "throttling": cpu_throttling(),
+        }
+        diagnostic = DiagnosticResult("COMPUTE_LIMITS", True, metrics=metrics)
+    except Exception as exc:
+        diagnostic = DiagnosticResult("COMPUTE_LIMITS", False, exception=exc)
 
     print(diagnostic)
     return diagnostic
 
 
-def diagnose_database() -> list[DiagnosticResult]:
-    """Diagnose the file-based database."""
+@register_check(
+    "COMPUTE_BENCHMARK", "compute", cost="expensive", safe=False,
+    default=False, tags=["benchmark"], timeout="subtask"
+)
+@timed
+def diagnose_compute_benchmark(**benchmark_options) -> DiagnosticResult:
+    """Benchmark the CPU and memory of the container."""
+    header("Benchmark the compute resources")
+    try:
+        metrics = benchmark_compute(**benchmark_options)
+        success = not metrics["single_core"]["errors"] and \
+            not metrics["all_core"]["errors"]
+        diagnostic = DiagnosticResult(
+            "COMPUTE_BENCHMARK", success, metrics=metrics
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult(
+            "COMPUTE_BENCHMARK", False, exception=exc
+        )
+
+    print(diagnostic)
+    return diagnostic
+
+
+# expensive, so that its interpreters run alone after the other checks
+@register_check(
+    "STARTUP", "environment", cost="expensive", default=False,
+    tags=["profiling"]
+)
+@timed
+def diagnose_startup(
+    methods: list[str] = STARTUP_METHODS, top: int = STARTUP_TOP
+) -> DiagnosticResult:
+    """Measure the cold start of this container and of the child tasks."""
+    header("Diagnose the startup time")
+    try:
+        # the package records when its import started and finished
+        import v6_diagnostics
+
+        metrics = {
+            "cold_start": cold_start(
+                v6_diagnostics.STARTED, v6_diagnostics.IMPORTED
+            ),
+            "imports": {
+                method: import_times(method, top) for method in methods
+            },
+        }
+        success = all(
+            times["success"] for times in metrics["imports"].values()
+        )
+        diagnostic = DiagnosticResult("STARTUP", success, metrics=metrics)
+    except Exception as exc:
+        diagnostic = DiagnosticResult("STARTUP", False, exception=exc)
+
+    print(diagnostic)
+    return diagnostic
+
+
+@register_check("DATABASE", "database", cost="moderate")
+@timed
+def diagnose_database(
+    max_bytes: int | None = DATABASE_READ_LIMIT,
+    max_seconds: float | None = DATABASE_READ_SECONDS
+) -> list[DiagnosticResult]:
+    """
+    Diagnose the file-based database.
+
+    Reads at most ``max_bytes`` of each file (all of it if None), and stops
+    reading when all files together took ``max_seconds`` (None for no limit).
+    The hash and row count are only reported when the whole file has been
+    read.
+    """
     header("Diagnose the file-based database")
     diagnostics = []
+    deadline = None if max_seconds is None \
+        else time.perf_counter() + max_seconds
     try:
         db_labels = get_env_var("DB_LABELS").split(",")
         for label in db_labels:
@@ -275,7 +739,10 @@ def diagnose_database() -> list[DiagnosticResult]:
                 # perform checks on them
                 continue
             elif Path(db_uri).exists():
-                diagnostic = DiagnosticResult(f"DATABASE {label.upper()}", True)
+                diagnostic = _diagnose_database_file(
+                    f"DATABASE {label.upper()}", db_uri, db_type, max_bytes,
+                    deadline
+                )
             else:
                 diagnostic = DiagnosticResult(
                     f"DATABASE {label.upper()}",
@@ -290,3 +757,149 @@ def diagnose_database() -> list[DiagnosticResult]:
     for diagnostic in diagnostics:
         print(diagnostic)
     return diagnostics
+
+
+def _diagnose_database_file(
+    name: str, path: str, db_type: str, max_bytes: int | None,
+    deadline: float | None = None
+) -> DiagnosticResult:
+    """Benchmark reading a database file and check its contents."""
+    try:
+        with span(f"read {name}"):
+            metrics = _read_file(path, db_type, max_bytes, deadline)
+        success = metrics.get("valid", True)
+        return DiagnosticResult(name, success, metrics=metrics)
+    except Exception as exc:
+        return DiagnosticResult(name, False, exception=exc)
+
+
+def _read_file(path: str, db_type: str, max_bytes: int | None,
+               deadline: float | None = None) -> dict:
+    """
+    Stream a file in large chunks into a reused buffer, measuring the time to
+    first byte and the read throughput while hashing the contents. CSV rows
+    are counted as lines, so quoted fields with line breaks are overcounted.
+    Reading stops at ``deadline`` (a `time.perf_counter` value), in which case
+    the metrics are ``truncated``.
+    """
+    is_csv = db_type == "csv" or path.lower().endswith(".csv")
+    is_parquet = db_type == "parquet" or path.lower().endswith(".parquet")
+
+    size = os.path.getsize(path)
+    limit = size if max_bytes is None else min(size, max_bytes)
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    sha256 = hashlib.sha256()
+    newlines = 0
+    last_byte = None
+    bytes_read = 0
+    read_seconds = 0.0
+    sample = b""
+    truncated = False
+
+    start = time.perf_counter()
+    with open(path, "rb", buffering=0) as f:
+        # read a small first chunk, so that the time to first byte is not
+        # dominated by the size of the chunk
+        ttfb = None
+        while bytes_read < limit:
+            # at least the first chunk is read, for the time to first byte
+            if ttfb is not None and deadline is not None \
+                    and time.perf_counter() >= deadline:
+                truncated = True
+                break
+            size_wanted = SNIFF_SIZE if ttfb is None else CHUNK_SIZE
+            size_wanted = min(size_wanted, limit - bytes_read)
+            read_start = time.perf_counter()
+            n = f.readinto(view[:size_wanted])
+            read_seconds += time.perf_counter() - read_start
+            if not n:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+                sample = bytes(view[:n])
+
+            sha256.update(view[:n])
+            if is_csv:
+                newlines += buffer.count(b"\n", 0, n)
+            last_byte = buffer[n - 1]
+            bytes_read += n
+    elapsed = time.perf_counter() - start
+
+    complete = bytes_read == size
+    metrics = {
+        "size": size,
+        "bytes_read": bytes_read,
+        "complete": complete,
+        "truncated": truncated,
+        "time_to_first_byte": ttfb,
+        "seconds": elapsed,
+        # throughput of the reads alone and of the whole pass (incl. hashing)
+        "read_throughput": bytes_read / read_seconds / 1e6
+        if read_seconds else None,
+        "throughput": bytes_read / elapsed / 1e6 if elapsed else None,
+        "sha256": sha256.hexdigest() if complete else None,
+    }
+    if is_csv:
+        metrics["csv"] = _sniff_csv(sample)
+        if complete:
+            lines = newlines + (last_byte not in (None, ord("\n")))
+            metrics["csv"]["rows"] = max(lines - 1, 0)
+    if is_parquet:
+        metrics["parquet"] = _parquet_metadata(path)
+        metrics["valid"] = metrics["parquet"]["valid"]
+    return metrics
+
+
+def _sniff_csv(sample: bytes) -> dict:
+    """Determine the delimiter and columns from the start of a CSV file."""
+    text = sample.decode("utf-8", errors="replace")
+    # the sample may end in the middle of a line
+    lines = text.splitlines()[:-1] or text.splitlines()
+    text = "\n".join(lines)
+    try:
+        dialect = csv.Sniffer().sniff(text)
+        delimiter = dialect.delimiter
+    except csv.Error:
+        delimiter = ","
+    try:
+        has_header = csv.Sniffer().has_header(text)
+    except csv.Error:
+        has_header = None
+    columns = next(csv.reader(lines[:1], delimiter=delimiter), [])
+    return {
+        "delimiter": delimiter, "has_header": has_header, "columns": columns
+    }
+
+
+def _parquet_metadata(path: str) -> dict:
+    """Check the Parquet magic bytes and, if pyarrow is installed, read the
+    schema and row count from the footer. Errors are reported under
+    ``error``, so that the other metrics of the database are kept."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(len(PARQUET_MAGIC))
+            # files shorter than the magic bytes cannot seek back from the end
+            f.seek(max(f.seek(0, os.SEEK_END) - len(PARQUET_MAGIC), 0))
+            tail = f.read(len(PARQUET_MAGIC))
+    except OSError as exc:
+        return {"valid": False, "error": repr(exc)}
+    metadata = {"valid": head == tail == PARQUET_MAGIC}
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return metadata
+
+    try:
+        parquet_file = pq.ParquetFile(path)
+        metadata["rows"] = parquet_file.metadata.num_rows
+        metadata["row_groups"] = parquet_file.metadata.num_row_groups
+        metadata["columns"] = [
+            f"{field.name}: {field.type}"
+            for field in parquet_file.schema_arrow
+        ]
+    except Exception as exc:
+        metadata["valid"] = False
+        metadata["error"] = repr(exc)
+    return metadata
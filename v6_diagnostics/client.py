@@ -0,0 +1,592 @@
+"""
+Programmatic client for running diagnostics on a vantage6 network.
+
+This is the library counterpart of the ``vtest`` command: it creates
+diagnostic tasks, waits for their runs and returns the results as objects,
+without printing anything. Use it to embed diagnostics in other services, for
+example in monitoring. For example:
+
+```python
+client = DiagnosticClient.connect(
+    "http://localhost", 5000, "root", "root", collaboration_id=1
+)
+report = client.base_features()
+for organization in report.organizations:
+    print(organization.organization_id, organization.success)
+```
+
+`DiagnosticClient` sends all requests over a pooled HTTP session, and can run
+many diagnostic tasks at the same time with `DiagnosticClient.run_many`.
+`AsyncDiagnosticClient` offers the same methods as coroutines.
+"""
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from vantage6.client import UserClient
+from vantage6.common.task_status import TaskStatus, has_task_finished
+
+from v6_diagnostics.encoding import decode_results
+
+
+IMAGE_NAME = "ghcr.io/vantage6/algorithm/diagnostic:v4"
+POLL_INTERVAL = 2
+PER_PAGE = 100
+MAX_FETCH_WORKERS = 8
+POOL_SIZE = 16
+REQUEST_TIMEOUT = 60
+MAX_TASKS = 8
+
+
+class PooledUserClient(UserClient):
+    """
+    User client that reuses connections to the server.
+
+    The regular client opens a new connection for every request, which adds
+    the TCP (and TLS) handshake to each of them when polling many runs.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Maximum number of connections that are kept open, this should be at
+        least the number of threads that use the client.
+    request_timeout : float, optional
+        Seconds to wait for the server to respond to a request.
+
+    Other arguments are passed to `vantage6.client.UserClient`.
+    """
+
+    def __init__(self, *args, pool_size: int = POOL_SIZE,
+                 request_timeout: float = REQUEST_TIMEOUT, **kwargs) -> None:
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.request_timeout = request_timeout
+        super().__init__(*args, **kwargs)
+
+    def request(
+        self, endpoint: str, json: dict = None, method: str = "get",
+        params: dict = None, headers: dict = None, first_try: bool = True,
+        retry: bool = True, attempts_on_timeout: int = None,
+        is_for_algorithm_store: bool = False
+    ) -> dict:
+        """Send a request to the server over the pooled session."""
+        if is_for_algorithm_store:
+            return super().request(
+                endpoint, json, method, params, headers, first_try, retry,
+                attempts_on_timeout, is_for_algorithm_store
+            )
+
+        url = self.generate_path_to(endpoint, False)
+        headers = self.headers if headers is None else headers | self.headers
+        response = self.session.request(
+            method.upper(), url, json=json, headers=headers, params=params,
+            timeout=self.request_timeout
+        )
+        if response.status_code == 401 and retry and first_try:
+            self.refresh_token()
+            return self.request(
+                endpoint, json, method, params, headers, first_try=False,
+                retry=retry, attempts_on_timeout=attempts_on_timeout
+            )
+        return response.json()
+
+
+class CheckResult:
+    """Result of a single diagnostic check of one organization."""
+
+    __slots__ = (
+        "name", "success", "payload", "exception", "traceback", "metrics",
+        "duration", "spans",
+    )
+
+    def __init__(
+        self, name: str, success: bool, payload: Any = None,
+        exception: str | None = None, traceback: str | None = None,
+        metrics: dict | None = None, duration: float | None = None,
+        spans: list[dict] | None = None
+    ) -> None:
+        self.name = name
+        self.success = success
+        self.payload = payload
+        self.exception = exception
+        self.traceback = traceback
+        self.metrics = metrics or {}
+        self.duration = duration
+        self.spans = spans or []
+
+    @classmethod
+    def from_json(cls, data: dict) -> "CheckResult":
+        """
+        Create the result from `v6_diagnostics.util.DiagnosticResult.json`.
+        """
+        return cls(
+            data["name"], data["success"], data.get("payload"),
+            data.get("exception"), data.get("traceback"), data.get("metrics"),
+            data.get("duration"), data.get("spans"),
+        )
+
+    @property
+    def json(self) -> dict:
+        """The result as in `v6_diagnostics.util.DiagnosticResult.json`."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"CheckResult({self.name}: {self.success})"
+
+
+class OrganizationResult:
+    """Results of the run of a diagnostic task at one organization."""
+
+    __slots__ = ("organization_id", "run_id", "status", "checks")
+
+    def __init__(self, organization_id: int, run_id: int | None, status: str,
+                 checks: list[CheckResult] | None = None) -> None:
+        self.organization_id = organization_id
+        self.run_id = run_id
+        self.status = status
+        self.checks = checks or []
+
+    @classmethod
+    def from_run(cls, run: dict, result: str | None) -> "OrganizationResult":
+        """Create the result from a run and its decrypted result."""
+        checks = [
+            CheckResult.from_json(check) for check in decode_results(result)
+        ] if result else []
+        return cls(run["organization"]["id"], run["id"], run["status"], checks)
+
+    @property
+    def success(self) -> bool:
+        """Whether the run completed and all its checks succeeded."""
+        return self.status == TaskStatus.COMPLETED and all(
+            check.success for check in self.checks
+        )
+
+    def __getitem__(self, name: str) -> CheckResult:
+        for check in self.checks:
+            if check.name == name:
+                return check
+        raise KeyError(name)
+
+    def __repr__(self):
+        return (
+            f"OrganizationResult({self.organization_id}: {self.status}, "
+            f"{len(self.checks)} checks)"
+        )
+
+
+class DiagnosticReport:
+    """Results of a diagnostic task at all organizations."""
+
+    __slots__ = ("task_id", "method", "organizations", "timed_out", "duration")
+
+    def __init__(self, task_id: int, method: str,
+                 organizations: list[OrganizationResult],
+                 timed_out: list[int], duration: float) -> None:
+        self.task_id = task_id
+        self.method = method
+        self.organizations = organizations
+        # organizations that did not finish before the timeout
+        self.timed_out = timed_out
+        self.duration = duration
+
+    @property
+    def success(self) -> bool:
+        """Whether all organizations finished and all checks succeeded."""
+        return not self.timed_out and all(
+            organization.success for organization in self.organizations
+        )
+
+    @property
+    def failed(self) -> list[CheckResult]:
+        """The checks that failed, at any organization."""
+        return [
+            check for organization in self.organizations
+            for check in organization.checks if not check.success
+        ]
+
+    def __repr__(self):
+        return (
+            f"DiagnosticReport(task {self.task_id}, {self.method}: "
+            f"{'success' if self.success else 'failed'})"
+        )
+
+
+class DiagnosticClient:
+    """
+    Run diagnostic tasks and collect their results.
+
+    Parameters
+    ----------
+    client : UserClient
+        An authenticated client, preferably a `PooledUserClient`. Use
+        `DiagnosticClient.connect` to create one.
+    collaboration_id : int
+        Collaboration to run the diagnostics in.
+    image : str, optional
+        Docker image of the diagnostics algorithm.
+    poll_interval : float, optional
+        Seconds between checking the runs of a task.
+    """
+
+    def __init__(self, client: UserClient, collaboration_id: int,
+                 image: str = IMAGE_NAME,
+                 poll_interval: float = POLL_INTERVAL) -> None:
+        self.client = client
+        self.collaboration_id = collaboration_id
+        self.image = image
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def connect(
+        cls, host: str, port: int, username: str, password: str,
+        collaboration_id: int, api_path: str = "/api",
+        private_key: str | None = None, pool_size: int = POOL_SIZE, **kwargs
+    ) -> "DiagnosticClient":
+        """
+        Authenticate at the server and create a client.
+
+        Parameters
+        ----------
+        host : str
+            URL of the server.
+        port : int
+            Port of the server.
+        username : str
+            Username of the account to create the tasks with.
+        password : str
+            Password of the account.
+        collaboration_id : int
+            Collaboration to run the diagnostics in.
+        api_path : str, optional
+            API path of the server.
+        private_key : str, optional
+            Path to the private key, for encrypted collaborations.
+        pool_size : int, optional
+            Maximum number of connections to the server that are kept open.
+
+        Other keyword arguments are passed to `DiagnosticClient`.
+        """
+        client = PooledUserClient(
+            host=host, port=port, path=api_path, log_level="critical",
+            pool_size=pool_size
+        )
+        client.authenticate(username=username, password=password)
+        client.setup_encryption(private_key)
+        return cls(client, collaboration_id, **kwargs)
+
+    def organizations(self, online_only: bool = False) -> list[int]:
+        """IDs of the organizations in the collaboration."""
+        ids = [
+            org["id"] for org in fetch_all(
+                self.client.organization.list,
+                collaboration=self.collaboration_id
+            )
+        ]
+        if not online_only:
+            return ids
+        online = {
+            node["organization"]["id"] for node in fetch_all(
+                self.client.node.list, collaboration=self.collaboration_id,
+                is_online=True
+            )
+        }
+        return [org_id for org_id in ids if org_id in online]
+
+    def submit(
+        self, method: str, organizations: list[int] | None = None,
+        kwargs: dict | None = None, databases: list[dict] | None = None,
+        description: str = "Diagnostic test"
+    ) -> int:
+        """
+        Create a diagnostic task without waiting for it.
+
+        Parameters
+        ----------
+        method : str
+            Entry point of the algorithm, e.g. ``base_features``.
+        organizations : list[int], optional
+            Organizations to run the task at, all by default.
+        kwargs : dict, optional
+            Keyword arguments of the entry point.
+        databases : list[dict], optional
+            Databases of the task.
+        description : str, optional
+            Description of the task.
+
+        Returns
+        -------
+        int
+            The ID of the task.
+        """
+        input_ = {"method": method}
+        if kwargs:
+            input_["kwargs"] = kwargs
+        task = self.client.task.create(
+            collaboration=self.collaboration_id,
+            organizations=organizations or self.organizations(),
+            name="test",
+            description=description,
+            image=self.image,
+            input_=input_,
+            databases=databases,
+        )
+        if "id" not in task:
+            raise RuntimeError(f"Could not create the task: {task}")
+        return task["id"]
+
+    def wait(
+        self, task_id: int, timeout: float | None = None,
+        on_result: Callable[[OrganizationResult], None] | None = None,
+        method: str = "",
+        on_status: Callable[[dict[int, str]], None] | None = None
+    ) -> DiagnosticReport:
+        """
+        Wait for the runs of a task and collect their results.
+
+        Only the runs that are still open are polled, and finished runs are
+        fetched concurrently.
+
+        Parameters
+        ----------
+        task_id : int
+            ID of the task.
+        timeout : float, optional
+            Seconds after which organizations that have not finished are
+            reported as timed out.
+        on_result : Callable[[OrganizationResult], None], optional
+            Called with the results of each organization as soon as its run
+            has finished.
+        method : str, optional
+            Entry point of the task, for the report.
+        on_status : Callable[[dict[int, str]], None], optional
+            Called after every poll with the status of the run of each
+            organization, e.g. to show the progress.
+
+        Returns
+        -------
+        DiagnosticReport
+            The results of the organizations that finished.
+        """
+        start = time.monotonic()
+        runs = index_by(fetch_all(self.client.run.list, task=task_id), "id")
+        statuses = {
+            run["organization"]["id"]: run["status"] for run in runs.values()
+        }
+        open_ids = {
+            run_id for run_id, run in runs.items()
+            if not has_task_finished(run["status"])
+        }
+        newly_finished = list(runs.keys() - open_ids)
+        results = []
+        with ThreadPoolExecutor(MAX_FETCH_WORKERS) as pool:
+            while True:
+                for result in pool.map(self._fetch, newly_finished):
+                    results.append(result)
+                    statuses[result.organization_id] = result.status
+                    if on_result:
+                        on_result(result)
+                if on_status:
+                    on_status(dict(statuses))
+
+                if not open_ids:
+                    break
+                if timeout and time.monotonic() - start >= timeout:
+                    break
+                time.sleep(self.poll_interval)
+
+                still_open = index_by(fetch_all(
+                    self.client.run.list, task=task_id, state="open"
+                ), "id")
+                for run in still_open.values():
+                    statuses[run["organization"]["id"]] = run["status"]
+                newly_finished = list(open_ids - still_open.keys())
+                open_ids &= still_open.keys()
+
+        timed_out = sorted(
+            runs[run_id]["organization"]["id"] for run_id in open_ids
+        )
+        return DiagnosticReport(
+            task_id, method, results, timed_out, time.monotonic() - start
+        )
+
+    def run(
+        self, method: str, organizations: list[int] | None = None,
+        kwargs: dict | None = None, databases: list[dict] | None = None,
+        timeout: float | None = None,
+        on_result: Callable[[OrganizationResult], None] | None = None
+    ) -> DiagnosticReport:
+        """Create a diagnostic task and wait for it, see `submit`."""
+        task_id = self.submit(method, organizations, kwargs, databases)
+        return self.wait(task_id, timeout, on_result, method)
+
+    def base_features(
+        self, organizations: list[int] | None = None,
+        timeout: float | None = None, **kwargs
+    ) -> DiagnosticReport:
+        """
+        Run the base feature diagnostics, see `v6_diagnostics.base_features`.
+        """
+        return self.run(
+            "base_features", organizations, kwargs,
+            databases=[{"label": "default"}], timeout=timeout
+        )
+
+    def vpn_features(
+        self, organizations: list[int] | None = None,
+        timeout: float | None = None, **kwargs
+    ) -> DiagnosticReport:
+        """Run the VPN diagnostics, see `v6_diagnostics.vpn_features`."""
+        organizations = organizations or self.organizations()
+        kwargs.setdefault("other_nodes", organizations)
+        return self.run("vpn_features", organizations, kwargs, timeout=timeout)
+
+    def run_many(self, tasks: list[dict], max_tasks: int = MAX_TASKS) \
+            -> list[DiagnosticReport]:
+        """
+        Run multiple diagnostic tasks at the same time.
+
+        Parameters
+        ----------
+        tasks : list[dict]
+            Keyword arguments of `run` for each task.
+        max_tasks : int, optional
+            Maximum number of tasks that run at the same time.
+
+        Returns
+        -------
+        list[DiagnosticReport]
+            The reports, in the order of ``tasks``.
+        """
+        with ThreadPoolExecutor(max(max_tasks, 1)) as pool:
+            return list(pool.map(lambda task: self.run(**task), tasks))
+
+    def _fetch(self, run_id: int) -> OrganizationResult:
+        """Fetch a finished run and, if it completed, its result."""
+        run = self.client.run.get(run_id)
+        result = self.client.result.get(run_id) \
+            if run["status"] == TaskStatus.COMPLETED else None
+        return OrganizationResult.from_run(run, result)
+
+
+class AsyncDiagnosticClient:
+    """
+    Asyncio interface of `DiagnosticClient`.
+
+    The requests run in threads, so that waiting for diagnostics does not
+    block the event loop.
+
+    Parameters
+    ----------
+    client : DiagnosticClient
+        The client to run the diagnostics with.
+    max_tasks : int, optional
+        Maximum number of tasks that run at the same time.
+    """
+
+    def __init__(self, client: DiagnosticClient,
+                 max_tasks: int = MAX_TASKS) -> None:
+        self.client = client
+        self._semaphore = asyncio.Semaphore(max(max_tasks, 1))
+
+    async def submit(self, *args, **kwargs) -> int:
+        """See `DiagnosticClient.submit`."""
+        return await asyncio.to_thread(self.client.submit, *args, **kwargs)
+
+    async def wait(self, *args, **kwargs) -> DiagnosticReport:
+        """See `DiagnosticClient.wait`."""
+        return await asyncio.to_thread(self.client.wait, *args, **kwargs)
+
+    async def run(self, *args, **kwargs) -> DiagnosticReport:
+        """See `DiagnosticClient.run`."""
+        async with self._semaphore:
+            return await asyncio.to_thread(self.client.run, *args, **kwargs)
+
+    async def base_features(self, *args, **kwargs) -> DiagnosticReport:
+        """See `DiagnosticClient.base_features`."""
+        async with self._semaphore:
+            return await asyncio.to_thread(
+                self.client.base_features, *args, **kwargs
+            )
+
+    async def vpn_features(self, *args, **kwargs) -> DiagnosticReport:
+        """See `DiagnosticClient.vpn_features`."""
+        async with self._semaphore:
+            return await asyncio.to_thread(
+                self.client.vpn_features, *args, **kwargs
+            )
+
+    async def run_many(self, tasks: list[dict]) -> list[DiagnosticReport]:
+        """Run multiple diagnostic tasks at the same time, see `run`."""
+        return await asyncio.gather(*[self.run(**task) for task in tasks])
+
+
+def fetch_all(list_method: Callable, per_page: int = PER_PAGE, **kwargs) \
+        -> list[dict]:
+    """
+    Fetch all pages of a paginated list endpoint of the client.
+
+    The first page tells how many pages there are, the remaining pages are
+    then fetched concurrently. If the number of pages is unknown, the pages
+    are followed one by one.
+
+    Parameters
+    ----------
+    list_method : Callable
+        List method of the client, e.g. ``client.run.list``. It should accept
+        ``page`` and ``per_page`` and return a dict with ``data`` and
+        ``links``.
+    per_page : int, optional
+        Number of items per page.
+    **kwargs
+        Filters that are passed to ``list_method``.
+
+    Returns
+    -------
+    list[dict]
+        The items on all pages.
+    """
+    first = list_method(page=1, per_page=per_page, **kwargs)
+    data = list(first["data"])
+    links = first.get("links") or {}
+
+    last = _page_number(links.get("last"))
+    if last is not None:
+        with ThreadPoolExecutor(MAX_FETCH_WORKERS) as pool:
+            pages = pool.map(
+                lambda page: list_method(
+                    page=page, per_page=per_page, **kwargs
+                ),
+                range(2, last + 1)
+            )
+            for response in pages:
+                data.extend(response["data"])
+        return data
+
+    page = 1
+    while links.get("next"):
+        page += 1
+        response = list_method(page=page, per_page=per_page, **kwargs)
+        data.extend(response["data"])
+        links = response.get("links") or {}
+    return data
+
+
+def index_by(items: list[dict], key: str) -> dict[Any, dict]:
+    """Index a list of resources by one of their keys."""
+    return {item[key]: item for item in items}
+
+
+def _page_number(link: str | None) -> int | None:
+    """Get the page number from a pagination link."""
+    if not link:
+        return None
+    pages = parse_qs(urlparse(link).query).get("page")
+    return int(pages[0]) if pages else None
@@ -0,0 +1,370 @@
+"""
+Measure the compute resources that the algorithm container actually gets.
+
+The node (or the orchestrator it runs on) may limit the container to a
+fraction of the host, which is invisible in ``os.cpu_count()``. The following
+is reported:
+
+    CPU limits
+        The nominal CPU count of the host, the CPUs the process may run on
+        (affinity) and the CPU quota of the cgroup (v2 ``cpu.max`` or v1
+        ``cpu.cfs_quota_us``). The effective number of CPUs is the smallest of
+        these.
+    Memory limits
+        The memory of the host (``/proc/meminfo``) and the memory limit and
+        usage of the cgroup.
+    Compute throughput
+        Matrix multiplications with NumPy, in one worker process
+        (single-core) and in one worker process per effective CPU at the same
+        time (all-core). BLAS is limited to one thread per worker, so that the
+        scaling over the workers shows how many cores are really available.
+        Reported in GFLOP/s, together with the time the cgroup was throttled
+        during the all-core run.
+    Memory bandwidth
+        Copying and reading an array that is much larger than the CPU caches,
+        in MB/s (10^6 bytes per second).
+    Largest allocation
+        The largest block of memory that can be allocated and touched, found
+        by bisection up to a maximum. Every attempt runs in a separate
+        process, which volunteers to be killed first when it runs out of
+        memory, so that the container itself survives.
+"""
+import math
+import os
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+from v6_diagnostics.util import summarize
+
+
+CGROUP = Path("/sys/fs/cgroup")
+DURATION = 3
+MATRIX_SIZE = 256
+BANDWIDTH_SIZE = 256 * 1024 ** 2
+BANDWIDTH_REPEATS = 5
+MAX_ALLOCATION = 8 * 1024 ** 3
+ALLOCATION_STEP = 64 * 1024 ** 2
+ALLOCATION_ATTEMPTS = 10
+# seconds the workers get to start before they are measured together
+WORKER_STARTUP = 2
+# cgroup v1 reports "no limit" as a huge number instead of "max"
+UNLIMITED = 2 ** 62
+SINGLE_THREADED = {
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+
+# multiplies matrices until the deadline, after waiting for the other workers
+WORKER = """
+import sys
+import time
+import numpy as np
+size, duration = int(sys.argv[1]), float(sys.argv[2])
+start_at = float(sys.argv[3])
+rng = np.random.default_rng()
+a, b = rng.random((size, size)), rng.random((size, size))
+a @ b
+time.sleep(max(start_at - time.time(), 0))
+count = 0
+start = time.perf_counter()
+while time.perf_counter() - start < duration:
+    a @ b
+    count += 1
+print(count, time.perf_counter() - start)
+"""
+# allocates and touches a block of memory
+ALLOCATE = """
+import sys
+try:
+    with open("/proc/self/oom_score_adj", "w") as f:
+        f.write("1000")
+except OSError:
+    pass
+import numpy as np
+block = np.empty(int(sys.argv[1]), dtype=np.uint8)
+block[::4096] = 1
+"""
+
+
+def benchmark_compute(
+    duration: float = DURATION,
+    matrix_size: int = MATRIX_SIZE,
+    workers: int | None = None,
+    bandwidth_size: int = BANDWIDTH_SIZE,
+    bandwidth_repeats: int = BANDWIDTH_REPEATS,
+    max_allocation: int | None = MAX_ALLOCATION,
+) -> dict:
+    """
+    Measure the compute resources of the container.
+
+    Parameters
+    ----------
+    duration : float, optional
+        Seconds each throughput run takes.
+    matrix_size : int, optional
+        Number of rows and columns of the multiplied matrices.
+    workers : int, optional
+        Number of workers of the all-core run, by default the effective
+        number of CPUs (rounded up).
+    bandwidth_size : int, optional
+        Size in bytes of the array of the memory bandwidth test.
+    bandwidth_repeats : int, optional
+        Number of times the array is copied and read.
+    max_allocation : int | None, optional
+        Largest allocation in bytes to try, None to skip the allocation test.
+        The memory limit and the available memory of the host are never
+        exceeded.
+
+    Returns
+    -------
+    dict
+        The results per test, see the module docstring.
+    """
+    cpus = cpu_limits()
+    memory = memory_limits()
+    workers = workers or max(math.ceil(cpus["effective"]), 1)
+
+    single = compute_throughput(1, duration, matrix_size)
+    throttled = cpu_throttling()
+    parallel = compute_throughput(workers, duration, matrix_size)
+    parallel["throttling"] = _throttling_delta(throttled, cpu_throttling())
+    if single["gflops"] and parallel["gflops"]:
+        parallel["speedup"] = parallel["gflops"] / single["gflops"]
+        parallel["efficiency"] = parallel["speedup"] / workers
+
+    metrics = {
+        "cpus": cpus,
+        "memory": memory,
+        "single_core": single,
+        "all_core": parallel,
+        "memory_bandwidth": memory_bandwidth(
+            bandwidth_size, bandwidth_repeats
+        ),
+    }
+    if max_allocation:
+        limits = [max_allocation, memory["limit"], memory["host_available"]]
+        metrics["largest_allocation"] = largest_allocation(
+            min(limit for limit in limits if limit)
+        )
+    return metrics
+
+
+def cpu_limits() -> dict:
+    """The nominal, allowed and effective number of CPUs."""
+    nominal = os.cpu_count()
+    affinity = len(os.sched_getaffinity(0)) \
+        if hasattr(os, "sched_getaffinity") else nominal
+    quota = _cpu_quota()
+    effective = min(
+        value for value in (nominal, affinity, quota) if value is not None
+    )
+    return {
+        "nominal": nominal,
+        "affinity": affinity,
+        "quota": quota,
+        "effective": effective,
+    }
+
+
+def memory_limits() -> dict:
+    """The memory of the host and the memory limit and usage of the cgroup."""
+    meminfo = _read_meminfo()
+    limit = _read_int(CGROUP / "memory.max") or \
+        _read_int(CGROUP / "memory" / "memory.limit_in_bytes")
+    if limit is not None and limit >= UNLIMITED:
+        limit = None
+    return {
+        "host_total": meminfo.get("MemTotal"),
+        "host_available": meminfo.get("MemAvailable"),
+        "limit": limit,
+        "usage": _read_int(CGROUP / "memory.current") or
+        _read_int(CGROUP / "memory" / "memory.usage_in_bytes"),
+    }
+
+
+def cpu_throttling() -> dict | None:
+    """How often and how long the cgroup was throttled, in seconds."""
+    stat = _read_stat(CGROUP / "cpu.stat")
+    if "throttled_usec" in stat:
+        return {"periods": stat.get("nr_throttled"),
+                "seconds": stat["throttled_usec"] / 1e6}
+    stat = _read_stat(CGROUP / "cpu" / "cpu.stat")
+    if "throttled_time" in stat:
+        return {"periods": stat.get("nr_throttled"),
+                "seconds": stat["throttled_time"] / 1e9}
+    return None
+
+
+def compute_throughput(workers: int, duration: float, size: int) -> dict:
+    """
+    Multiply matrices in ``workers`` processes at the same time.
+
+    Returns
+    -------
+    dict
+        The total GFLOP/s and the GFLOP/s of each worker. Workers that fail
+        or do not finish in time are reported in ``errors``.
+    """
+    start_at = time.time() + WORKER_STARTUP
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, str(size), str(duration),
+             str(start_at)],
+            env={**os.environ, **SINGLE_THREADED},
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+        for _ in range(workers)
+    ]
+    flop = 2 * size ** 3
+    timeout = WORKER_STARTUP + duration * 10 + 60
+    # all workers share the deadline, so that they are not waited for in turn
+    deadline = time.monotonic() + timeout
+    per_worker, errors = [], []
+    for process in processes:
+        try:
+            stdout, stderr = process.communicate(
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            errors.append([f"Worker did not finish within {timeout} seconds"])
+            continue
+        if process.returncode != 0:
+            errors.append(stderr.strip().splitlines()[-1:] or
+                          [f"exit code {process.returncode}"])
+            continue
+        count, seconds = stdout.split()
+        per_worker.append(int(count) * flop / float(seconds) / 1e9)
+    return {
+        "workers": workers,
+        "gflops": sum(per_worker) if per_worker else None,
+        "per_worker": summarize(per_worker),
+        "errors": [line for lines in errors for line in lines],
+    }
+
+
+def memory_bandwidth(size: int, repeats: int) -> dict:
+    """Copy and read an array of ``size`` bytes ``repeats`` times."""
+    import numpy as np
+
+    source = np.ones(size // 8)
+    target = np.empty_like(source)
+    # the first copy commits the pages of the target
+    np.copyto(target, source)
+    copy, read = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        np.copyto(target, source)
+        # a copy reads and writes every byte
+        copy.append(2 * source.nbytes / (time.perf_counter() - start) / 1e6)
+        start = time.perf_counter()
+        source.sum()
+        read.append(source.nbytes / (time.perf_counter() - start) / 1e6)
+    return {
+        "size": source.nbytes,
+        "copy_throughput": summarize(copy),
+        "read_throughput": summarize(read),
+    }
+
+
+def largest_allocation(maximum: int, step: int = ALLOCATION_STEP,
+                       attempts: int = ALLOCATION_ATTEMPTS) -> dict:
+    """
+    Find the largest allocation up to ``maximum`` bytes by bisection.
+
+    Returns
+    -------
+    dict
+        The largest size that succeeded (0 if none did), the maximum that was
+        tried, whether the maximum itself succeeded and every attempt.
+    """
+    tried = []
+    low, high = 0, maximum
+    size = maximum
+    while len(tried) < attempts:
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-c", ALLOCATE, str(size)],
+            capture_output=True,
+        )
+        success = process.returncode == 0
+        tried.append({"bytes": size, "success": success,
+                      "seconds": time.perf_counter() - start,
+                      "exit_code": process.returncode})
+        if success:
+            low = size
+        else:
+            high = size
+        if success and size == maximum or high - low <= step:
+            break
+        size = (low + high) // 2 // step * step or step
+    return {
+        "bytes": low,
+        "maximum": maximum,
+        "reached_maximum": low == maximum,
+        "attempts": tried,
+    }
+
+
+def _cpu_quota() -> float | None:
+    """The CPU quota of the cgroup as number of CPUs, None if unlimited."""
+    try:
+        quota, period = (CGROUP / "cpu.max").read_text().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    quota = _read_int(CGROUP / "cpu" / "cpu.cfs_quota_us")
+    period = _read_int(CGROUP / "cpu" / "cpu.cfs_period_us")
+    if quota is None or quota < 0 or not period:
+        return None
+    return quota / period
+
+
+def _throttling_delta(before: dict | None, after: dict | None) -> dict | None:
+    if before is None or after is None:
+        return None
+    return {key: after[key] - before[key] for key in before
+            if after.get(key) is not None and before[key] is not None}
+
+
+def _read_int(path: Path) -> int | None:
+    try:
+        value = path.read_text().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def _read_stat(path: Path) -> dict[str, int]:
+    """Read a file with a name and a number on each line."""
+    try:
+        lines = path.read_text().splitlines()
+    except OSError:
+        return {}
+    stat = {}
+    for line in lines:
+        name, _, value = line.partition(" ")
+        if value.strip().isdigit():
+            stat[name] = int(value)
+    return stat
+
+
+def _read_meminfo() -> dict[str, int]:
+    """Read ``/proc/meminfo``, in bytes."""
+    try:
+        lines = Path("/proc/meminfo").read_text().splitlines()
+    except OSError:
+        return {}
+    meminfo = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        fields = value.split()
+        if fields and fields[0].isdigit():
+            scale = 1024 if fields[1:] == ["kB"] else 1
+            meminfo[name] = int(fields[0]) * scale
+    return meminfo
@@ -0,0 +1,186 @@
+"""
+Compact encoding of diagnostic results.
+
+Results are encrypted and uploaded for every organization, and decrypted and
+parsed by the client, so their size matters on big collaborations. Results are
+therefore encoded as follows:
+
+    Structured payloads
+        Payloads are converted to JSON values (dicts, lists, strings and
+        numbers) instead of their ``str`` representation, so that the client
+        can use them without parsing Python reprs.
+    Blob summaries
+        Strings and bytes longer than ``blob_limit`` are replaced by a summary
+        with their size and SHA-256 hash. Bytes that are not valid UTF-8 are
+        always summarized.
+    Byte budgets
+        A result that is larger than ``result_budget`` bytes has its least
+        important fields (see ``EXPENDABLE``) replaced by a truncation marker
+        until it fits. When all results together are larger than
+        ``task_budget`` bytes, the largest results are truncated further.
+    Compression
+        Optionally the results are compressed with zlib, which is worthwhile
+        for large metrics (e.g. VPN mesh matrices).
+
+Summaries and truncation markers are dicts with a ``__summary__`` key that
+tells which of the two it is. Use `decode_results` to read the results back.
+"""
+import json
+import zlib
+import base64
+import hashlib
+
+from typing import Any, Mapping
+
+
+BLOB_LIMIT = 4 * 1024
+RESULT_BUDGET = 64 * 1024
+TASK_BUDGET = 1024 ** 2
+# fields of a result that may be truncated, least important first
+EXPENDABLE = ("profile", "payload", "spans", "traceback", "metrics")
+SUMMARY = "__summary__"
+MARKER_SIZE = 128
+COMPRESSED = "zlib+base64"
+
+
+def encode_value(value: Any, blob_limit: int = BLOB_LIMIT) -> Any:
+    """
+    Convert a value to a compact JSON value.
+
+    Parameters
+    ----------
+    value : Any
+        The value to convert. Mappings and sequences are converted
+        recursively, other unknown types are converted with ``str``.
+    blob_limit : int, optional
+        Strings and bytes longer than this many bytes are summarized.
+
+    Returns
+    -------
+    Any
+        A value that can be serialized with `json.dumps`.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            value = bytes(value).decode()
+        except UnicodeDecodeError:
+            return summary("blob", bytes(value))
+    if isinstance(value, str):
+        data = value.encode()
+        return value if len(data) <= blob_limit else summary("blob", data)
+    if isinstance(value, Mapping):
+        return {
+            str(key): encode_value(item, blob_limit)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [encode_value(item, blob_limit) for item in value]
+    return encode_value(str(value), blob_limit)
+
+
+def summary(kind: str, data: bytes) -> dict:
+    """Summarize data by its size and hash."""
+    return {
+        SUMMARY: kind,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def encode_results(
+    results: list[dict],
+    result_budget: int | None = RESULT_BUDGET,
+    task_budget: int | None = TASK_BUDGET,
+    compress: bool = False,
+) -> list[dict] | dict:
+    """
+    Fit the JSON representations of results in the byte budgets.
+
+    Parameters
+    ----------
+    results : list[dict]
+        The results, see `v6_diagnostics.util.DiagnosticResult.json`.
+    result_budget : int | None, optional
+        Maximum size in bytes of a single result, None for no maximum.
+    task_budget : int | None, optional
+        Maximum size in bytes of all results together, None for no maximum.
+        Fields are only truncated, so results may still exceed the budget
+        when their names and timings alone are larger than it.
+    compress : bool, optional
+        Compress the results, see `decode_results`.
+
+    Returns
+    -------
+    list[dict] | dict
+        The results, or a dict with the compressed results.
+    """
+    sizes = [_size(result) for result in results]
+    if result_budget is not None:
+        for i, result in enumerate(results):
+            sizes[i] = _truncate(result, sizes[i], result_budget)
+
+    if task_budget is not None and sum(sizes) > task_budget:
+        # truncate the largest results first, they free up the most space
+        for i in sorted(range(len(results)), key=lambda i: -sizes[i]):
+            excess = sum(sizes) - task_budget
+            if excess <= 0:
+                break
+            sizes[i] = _truncate(results[i], sizes[i], sizes[i] - excess)
+
+    if not compress:
+        return results
+    data = zlib.compress(json.dumps(results, separators=(",", ":")).encode())
+    return {"encoding": COMPRESSED, "data": base64.b64encode(data).decode()}
+
+
+def decode_results(data: str | list | dict) -> list[dict]:
+    """
+    Read results that were encoded with `encode_results`.
+
+    Parameters
+    ----------
+    data : str | list | dict
+        The results as JSON string, or already parsed.
+
+    Returns
+    -------
+    list[dict]
+        The results.
+    """
+    if isinstance(data, (str, bytes)):
+        data = json.loads(data)
+    if isinstance(data, dict) and data.get("encoding") == COMPRESSED:
+        data = json.loads(zlib.decompress(base64.b64decode(data["data"])))
+    return data
+
+
+def is_summary(value: Any) -> bool:
+    """Whether a value is a blob summary or truncation marker."""
+    return isinstance(value, dict) and SUMMARY in value
+
+
+def _truncate(result: dict, size: int, budget: int) -> int:
+    """Truncate expendable fields until the result fits, return its size."""
+    for field in EXPENDABLE:
+        if size <= budget:
+            break
+        value = result.get(field)
+        if value is None or is_summary(value):
+            continue
+        data = _dumps(value)
+        # a marker would not make small fields any smaller
+        if len(data) <= MARKER_SIZE:
+            continue
+        result[field] = summary("truncated", data)
+        size = _size(result)
+    return size
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+
+def _size(value: Any) -> int:
+    return len(_dumps(value))
@@ -0,0 +1,313 @@
+"""
+Probe network targets concurrently within a fixed time budget.
+
+A firewall either rejects a connection (the peer answers with a reset or an
+ICMP error, so the probe fails fast) or drops it (nothing comes back, so the
+probe only fails when it times out). A drop cannot be told apart from a slow
+network by looking at the probe alone. Therefore a control target that is
+known to be reachable (normally the local proxy) is probed as well: when the
+control answers quickly, a timeout means the packets were dropped by policy.
+
+Targets are strings of one of the following forms:
+
+    ``dns:<host>``
+        Resolve ``host``. This is for information only: Docker's embedded DNS
+        server resolves external names even on internal networks, so a name
+        that resolves does not mean that the host can be reached.
+    ``tcp:<host>:<port>``
+        Open a TCP connection. Use an IP address to skip DNS.
+    ``http://...`` or ``https://...``
+        Send a GET request. Any HTTP response counts as reachable, except a
+        refusal by the proxy that is configured for the URL (``HTTP_PROXY``
+        or ``HTTPS_PROXY``, e.g. the squid proxy of a node with whitelisting):
+        a 403, 407 or 5xx response from the proxy, or a failed tunnel.
+
+Each probe results in one of the following statuses:
+
+    reachable
+        The target answered, even if only with a TLS error.
+    rejected
+        The connection was refused (also by a proxy), the network or host is
+        unreachable, or the name could not be resolved.
+    dropped
+        No answer within the timeout.
+    error
+        Any other failure.
+
+and, using the control, in one of the following verdicts:
+
+    open
+        The target is reachable.
+    resolved
+        The name of a ``dns:`` target was resolved, see above.
+    blocked
+        The target was rejected, or it was dropped while the control answered
+        quickly.
+    slow
+        The target was dropped, but the control was slow or unreachable too,
+        so the network may just be slow.
+    unknown
+        The probe failed for another reason.
+
+Latencies are in milliseconds.
+"""
+import errno
+import queue
+import socket
+import ssl
+import threading
+import time
+
+from urllib.parse import urlparse
+
+
+TIMEOUT = 3
+BUDGET = 5
+# answers slower than this (in ms) are considered slow
+SLOW = 1000
+TARGETS = [
+    "dns:google.nl",
+    "dns:example.com",
+    "tcp:1.1.1.1:80",
+    "tcp:1.1.1.1:443",
+    "tcp:8.8.8.8:53",
+    "tcp:8.8.8.8:443",
+    "http://google.nl",
+    "https://google.nl",
+    "https://1.1.1.1",
+]
+# responses with which a proxy refuses a request
+PROXY_REFUSALS = {403, 407}
+REJECTED_ERRNOS = {
+    errno.ECONNREFUSED, errno.ECONNRESET, errno.ENETUNREACH,
+    errno.EHOSTUNREACH, errno.EACCES, errno.EPERM,
+}
+
+
+def probe(target: str, timeout: float = TIMEOUT) -> dict:
+    """
+    Probe a single target.
+
+    Parameters
+    ----------
+    target : str
+        The target, see the module docstring.
+    timeout : float, optional
+        Seconds to wait for the target to answer.
+
+    Returns
+    -------
+    dict
+        The target, its status, the latency and the error, if any.
+
+    Raises
+    ------
+    ValueError
+        If the target is not understood.
+    """
+    check = _parse(target)
+    start = time.perf_counter()
+    try:
+        detail = check(timeout)
+        status, error = "reachable", None
+    except Exception as exc:
+        detail = None
+        status, error = classify(exc), repr(exc)
+    return {
+        "target": target,
+        "status": status,
+        "latency": (time.perf_counter() - start) * 1000,
+        "detail": detail,
+        "error": error,
+    }
+
+
+def probe_all(
+    targets: list[str],
+    timeout: float = TIMEOUT,
+    budget: float = BUDGET,
+    control: str | None = None,
+    slow: float = SLOW,
+) -> list[dict]:
+    """
+    Probe targets concurrently and give a verdict for each of them.
+
+    Every probe runs on its own daemon thread, so probes that hang (e.g. in
+    the resolver, which has no timeout) do not keep the container alive.
+    Probes that have not finished when the budget is spent are reported as
+    dropped.
+
+    Parameters
+    ----------
+    targets : list[str]
+        The targets, see the module docstring.
+    timeout : float, optional
+        Seconds to wait for each target to answer.
+    budget : float, optional
+        Seconds after which all probes are given up on.
+    control : str, optional
+        Target that should be reachable, used to tell a firewall that drops
+        packets apart from a slow network.
+    slow : float, optional
+        Latency in ms above which the control is considered slow.
+
+    Returns
+    -------
+    list[dict]
+        The results of `probe` for each target, with a ``verdict``. The
+        result of the control, if any, comes first.
+    """
+    targets = list(targets)
+    if control is not None:
+        targets.insert(0, control)
+    for target in targets:
+        _parse(target)
+
+    finished = queue.Queue()
+    for i, target in enumerate(targets):
+        threading.Thread(
+            target=lambda i=i, target=target: finished.put(
+                (i, probe(target, timeout))
+            ),
+            daemon=True, name=f"probe-{target}",
+        ).start()
+
+    results: list[dict | None] = [None] * len(targets)
+    deadline = time.monotonic() + budget
+    for _ in targets:
+        try:
+            i, result = finished.get(
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+        except queue.Empty:
+            break
+        results[i] = result
+
+    for i, target in enumerate(targets):
+        if results[i] is None:
+            results[i] = {
+                "target": target, "status": "dropped", "latency": None,
+                "detail": None, "error": f"No answer within {budget} seconds",
+            }
+
+    control_fast = None
+    if control is not None:
+        results[0]["control"] = True
+        control_fast = (
+            results[0]["status"] == "reachable"
+            and results[0]["latency"] <= slow
+        )
+    for result in results:
+        result["verdict"] = verdict(
+            result["status"], control_fast, result["target"]
+        )
+    return results
+
+
+def verdict(status: str, control_fast: bool | None,
+            target: str | None = None) -> str:
+    """Interpret the status of a probe, see the module docstring."""
+    if status == "reachable":
+        return "resolved" if target and target.startswith("dns:") else "open"
+    if status == "rejected" or (status == "dropped" and control_fast):
+        return "blocked"
+    if status == "dropped":
+        return "slow"
+    return "unknown"
+
+
+def classify(exc: BaseException) -> str:
+    """Derive the status of a probe from the exception it raised."""
+    import requests
+
+    chain = list(_chain(exc))
+    if any(isinstance(e, (ProxyRefused, requests.exceptions.ProxyError))
+           for e in chain):
+        return "rejected"
+    if any(isinstance(e, (TimeoutError, socket.timeout, requests.Timeout))
+           for e in chain):
+        return "dropped"
+    # the TCP connection was made, so the network path is open
+    if any(isinstance(e, ssl.SSLError) for e in chain):
+        return "reachable"
+    for e in chain:
+        # a resolver that hangs is caught by the budget of `probe_all`
+        if isinstance(e, socket.gaierror) or (
+            isinstance(e, OSError) and e.errno in REJECTED_ERRNOS
+        ):
+            return "rejected"
+    return "error"
+
+
+def resolve(host: str) -> list[str]:
+    """Resolve a host to its (unique) addresses."""
+    infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    return sorted({info[4][0] for info in infos})
+
+
+def connect(host: str, port: int, timeout: float = TIMEOUT) -> str:
+    """Open (and close) a TCP connection, return the address of the peer."""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        return sock.getpeername()[0]
+
+
+class ProxyRefused(Exception):
+    """The proxy that is configured for a URL refused the request."""
+
+
+def get(url: str, timeout: float = TIMEOUT) -> int:
+    """
+    Send a GET request, return the status code.
+
+    Raises
+    ------
+    ProxyRefused
+        If the request went through a proxy and the response is a refusal,
+        see `PROXY_REFUSALS`.
+    """
+    # imported here, so that the package imports fast in child tasks
+    import requests
+
+    response = requests.get(
+        url, timeout=timeout, allow_redirects=False, stream=True
+    )
+    response.close()
+    proxy = requests.utils.get_environ_proxies(url).get(urlparse(url).scheme)
+    if proxy and (response.status_code in PROXY_REFUSALS
+                  or response.status_code >= 500):
+        raise ProxyRefused(
+            f"Proxy {proxy} answered with {response.status_code}"
+        )
+    return response.status_code
+
+
+def _parse(target: str):
+    """Return a function that probes the target, given the timeout."""
+    if target.startswith(("http://", "https://")):
+        return lambda timeout: get(target, timeout)
+    kind, _, rest = target.partition(":")
+    if kind == "dns" and rest:
+        return lambda timeout: resolve(rest)
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        if host and port.isdigit():
+            return lambda timeout: connect(
+                host.strip("[]"), int(port), timeout
+            )
+    raise ValueError(f"Unknown probe target: {target}")
+
+
+def _chain(exc: BaseException):
+    """Walk an exception and the exceptions it wraps."""
+    seen = set()
+    todo = [exc]
+    while todo:
+        e = todo.pop()
+        if id(e) in seen:
+            continue
+        seen.add(id(e))
+        yield e
+        wrapped = [e.__cause__, e.__context__, getattr(e, "reason", None)]
+        todo.extend(
+            w for w in wrapped + list(e.args) if isinstance(w, BaseException)
+        )
@@ -0,0 +1,151 @@
+"""
+Measure how the size of subtask inputs and results affects their round-trip.
+
+The input of a task is encrypted by the local proxy of the node that creates
+it and decrypted by the node that runs it; the result goes the same way back.
+The cost of this (and of the JSON and base64 encoding around it) grows with
+the size of the payload. This sweeps over payload sizes in both directions:
+
+    input
+        The subtask receives ``size`` bytes and returns a short result.
+    result
+        The subtask receives a short input and returns ``size`` bytes.
+
+For each size the latency of each phase of the subtask (see
+`v6_diagnostics.subtask_benchmark`) and the throughput of the round-trip are
+reported. A direction stops at the first size that fails, which is reported as
+its ceiling. When the throughput stops increasing with the size, the transfer
+is bound by bandwidth or by the CPU that encrypts it. The CPU time of this
+container shows how much of that is spent on encoding before the payload
+reaches the proxy.
+
+Sizes are in bytes and throughput in MB/s (10^6 bytes per second).
+"""
+import base64
+import os
+import time
+
+from typing import TYPE_CHECKING
+
+from v6_diagnostics.subtask_benchmark import POLL_INTERVAL, run_subtask
+
+if TYPE_CHECKING:
+    from vantage6.algorithm.client import AlgorithmClient
+
+
+MIN_SIZE = 1_000
+MAX_SIZE = 100_000_000
+FACTOR = 10
+TIMEOUT = 600
+DIRECTIONS = ("input", "result")
+
+
+def sweep_payloads(
+    client: "AlgorithmClient",
+    min_size: int = MIN_SIZE,
+    max_size: int = MAX_SIZE,
+    factor: float = FACTOR,
+    organization_id: int | None = None,
+    poll_interval: float = POLL_INTERVAL,
+    timeout: float = TIMEOUT,
+) -> dict:
+    """
+    Send subtask inputs and return results of increasing size.
+
+    Parameters
+    ----------
+    client : AlgorithmClient
+        The client to create the subtasks with.
+    min_size : int, optional
+        Smallest payload size.
+    max_size : int, optional
+        Largest payload size.
+    factor : float, optional
+        Factor between consecutive sizes.
+    organization_id : int, optional
+        Organization that runs the subtasks, this organization by default.
+    poll_interval : float, optional
+        Seconds between checking whether a subtask has finished.
+    timeout : float, optional
+        Seconds after which a single subtask is given up on.
+
+    Returns
+    -------
+    dict
+        Per direction the measurements per size and the size at which the
+        transfer failed, if it did.
+    """
+    organization_id = organization_id or client.organization_id
+    sizes = payload_sizes(min_size, max_size, factor)
+    metrics = {"sizes": sizes, "organization_id": organization_id}
+    for direction in DIRECTIONS:
+        transfers = []
+        failed_at = None
+        for size in sizes:
+            transfer = _transfer(
+                client, organization_id, direction, size, poll_interval,
+                timeout
+            )
+            transfers.append(transfer)
+            if "error" in transfer:
+                failed_at = size
+                break
+        metrics[direction] = {"transfers": transfers, "failed_at": failed_at}
+    return metrics
+
+
+def payload_sizes(min_size: int, max_size: int, factor: float) -> list[int]:
+    """Sizes from ``min_size`` up to and including ``max_size``."""
+    if min_size < 1 or factor <= 1:
+        raise ValueError("Sizes need min_size >= 1 and factor > 1")
+    sizes = []
+    size = min_size
+    while size < max_size:
+        sizes.append(int(size))
+        size *= factor
+    sizes.append(max_size)
+    return sizes
+
+
+def random_payload(size: int) -> str:
+    """Random text of ``size`` bytes, which does not compress."""
+    return base64.b64encode(os.urandom(size * 3 // 4 + 3)).decode()[:size]
+
+
+def _transfer(client: "AlgorithmClient", organization_id: int, direction: str,
+              size: int, poll_interval: float, timeout: float) -> dict:
+    """Run a single subtask that moves ``size`` bytes in ``direction``."""
+    if direction == "input":
+        kwargs = {"payload": random_payload(size), "size": 0}
+    else:
+        kwargs = {"payload": "", "size": size}
+    input_ = {"method": "diagnose_payload_subtask", "kwargs": kwargs}
+
+    cpu = time.process_time()
+    measurement, results = run_subtask(
+        client, organization_id, input_, poll_interval,
+        time.monotonic() + timeout
+    )
+    measurement["cpu_seconds"] = time.process_time() - cpu
+    measurement["size"] = size
+
+    if "error" in measurement:
+        return measurement
+    result = results[0] if results else None
+    if not _is_expected(result, len(kwargs["payload"]), kwargs["size"]):
+        measurement["error"] = "Subtask did not return the expected payload"
+    else:
+        seconds = measurement["round_trip"]
+        measurement["throughput"] = (
+            size / seconds / 1e6 if seconds > 0 else None
+        )
+    return measurement
+
+
+def _is_expected(result, received: int, size: int) -> bool:
+    """Check that the subtask received and returned the right amounts."""
+    return (
+        isinstance(result, dict)
+        and result.get("received") == received
+        and len(result.get("payload", "")) == size
+    )
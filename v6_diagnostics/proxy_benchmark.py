@@ -0,0 +1,168 @@
+"""
+Benchmark the local proxy of the node.
+
+Every request that an algorithm makes to the server (creating subtasks,
+fetching results, looking up VPN addresses) goes through the local proxy, so
+its latency and saturation point bound the performance of algorithms that use
+many subtasks. Each endpoint is benchmarked in two phases:
+
+    Sequential
+        ``sequential`` requests one after another over a single keep-alive
+        connection. This measures the latency of an otherwise idle proxy.
+    Concurrent
+        ``concurrent`` requests spread over ``workers`` threads that share a
+        connection pool. Comparing the requests per second with the
+        sequential phase shows how far the proxy scales.
+
+Latencies are reported in milliseconds, both as percentiles and as a histogram
+with the number of requests per bucket.
+"""
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from v6_diagnostics.util import summarize
+
+
+SEQUENTIAL = 50
+CONCURRENT = 200
+WORKERS = 16
+TIMEOUT = 30
+# upper bounds (in ms) of the histogram buckets, the last bucket is unbounded
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+# name, path, query parameters and whether the endpoint needs the token
+ENDPOINTS = [
+    ("version", "/version", None, False),
+    (
+        "vpn_addresses",
+        "/vpn/algorithm/addresses",
+        {"include_parent": True, "include_children": True},
+        True,
+    ),
+]
+
+
+def benchmark_proxy(
+    url: str,
+    token: str,
+    sequential: int = SEQUENTIAL,
+    concurrent: int = CONCURRENT,
+    workers: int = WORKERS,
+    endpoints: list[str] | None = None,
+) -> dict:
+    """
+    Benchmark the endpoints of the local proxy.
+
+    Parameters
+    ----------
+    url : str
+        Base URL of the proxy, including the port.
+    token : str
+        Token of the algorithm container, used for authenticated endpoints.
+    sequential : int, optional
+        Number of requests per endpoint in the sequential phase.
+    concurrent : int, optional
+        Number of requests per endpoint in the concurrent phase.
+    workers : int, optional
+        Number of threads (and pooled connections) in the concurrent phase.
+    endpoints : list[str], optional
+        Names of the endpoints to benchmark, see ``ENDPOINTS``. All endpoints
+        are benchmarked by default.
+
+    Returns
+    -------
+    dict
+        The results of both phases per endpoint.
+    """
+    metrics = {}
+    with _session(workers) as session:
+        for name, path, params, authenticated in ENDPOINTS:
+            if endpoints is not None and name not in endpoints:
+                continue
+            headers = {"Authorization": f"Bearer {token}"} \
+                if authenticated else {}
+
+            def request() -> tuple[float, str | None]:
+                return _request(session, url + path, params, headers)
+
+            metrics[name] = {
+                "sequential": run_sequential(request, sequential),
+                "concurrent": run_concurrent(request, concurrent, workers),
+            }
+    return metrics
+
+
+def run_sequential(request, count: int) -> dict:
+    """Send ``count`` requests one after another."""
+    start = time.perf_counter()
+    samples = [request() for _ in range(count)]
+    return _report(samples, time.perf_counter() - start)
+
+
+def run_concurrent(request, count: int, workers: int) -> dict:
+    """Send ``count`` requests from ``workers`` threads."""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        start = time.perf_counter()
+        samples = list(pool.map(lambda _: request(), range(count)))
+        seconds = time.perf_counter() - start
+    report = _report(samples, seconds)
+    report["workers"] = workers
+    return report
+
+
+def histogram(latencies: list[float], buckets: list[float] = BUCKETS) \
+        -> dict[str, int]:
+    """Count the latencies per bucket, keyed by the bucket's upper bound."""
+    counts = {f"<={bound}": 0 for bound in buckets}
+    counts[f">{buckets[-1]}"] = 0
+    for latency in latencies:
+        for bound in buckets:
+            if latency <= bound:
+                counts[f"<={bound}"] += 1
+                break
+        else:
+            counts[f">{buckets[-1]}"] += 1
+    return counts
+
+
+def _session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _request(session: requests.Session, url: str, params: dict | None,
+             headers: dict) -> tuple[float, str | None]:
+    """Send a request, returning its latency in ms and the error, if any."""
+    start = time.perf_counter()
+    try:
+        response = session.get(
+            url, params=params, headers=headers, timeout=TIMEOUT
+        )
+        # read the body, so that the latency includes the transfer
+        response.content
+        error = None if response.ok else f"HTTP {response.status_code}"
+    except requests.RequestException as exc:
+        error = type(exc).__name__
+    return (time.perf_counter() - start) * 1000, error
+
+
+def _report(samples: list[tuple[float, str | None]], seconds: float) -> dict:
+    latencies = [latency for latency, error in samples if error is None]
+    errors = Counter(error for _, error in samples if error is not None)
+    return {
+        "requests": len(samples),
+        "seconds": seconds,
+        "requests_per_second": len(samples) / seconds if seconds > 0 else None,
+        "error_rate": sum(errors.values()) / len(samples) if samples else 0.0,
+        "errors": dict(errors),
+        "latency": summarize(latencies),
+        "histogram": histogram(latencies),
+    }
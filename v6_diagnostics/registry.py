@@ -0,0 +1,328 @@
+"""
+Registry of the checks that `v6_diagnostics.base_features` can run.
+
+Each check is registered with metadata that is used to select the checks of a
+diagnostic task:
+
+    category
+        What the check diagnoses, e.g. ``storage`` or ``network``.
+    cost
+        Expected cost of the check: ``cheap`` (less than a second, no load on
+        the node), ``moderate`` (a few seconds, or a subtask) or ``expensive``
+        (benchmarks that load the node, the server or the network).
+    depends_on
+        Checks that need to finish before the check starts. These are selected
+        as well when the check is selected.
+    safe
+        Whether the check is safe to run on every node, i.e. it does not put a
+        noticeable load on shared infrastructure.
+    default
+        Whether the check runs when no checks or tags are selected.
+    tags
+        Any other tags. The category, the cost, ``default`` and ``safe`` are
+        tags as well.
+
+Checks are selected by name or tag in the task input, e.g. ``{"tags":
+["cheap"]}`` for a quick health ping. Expensive checks run after all other
+selected checks, so that their load does not disturb them. They are only
+ordered after these checks (see ``run_after`` of
+`v6_diagnostics.scheduler.Check`), so they still run when one of them timed
+out.
+
+Functions that are run in child tasks of a check are registered with
+`register_child`, so that the algorithm wrapper can find them on the
+`v6_diagnostics` module.
+
+Third-party checks are discovered through the ``v6_diagnostics.checks``
+entry point group. Each entry point refers to a module that registers its
+checks and child tasks with these decorators when it is imported::
+
+    [project.entry-points."v6_diagnostics.checks"]
+    my_checks = "my_package.checks"
+"""
+from typing import Any, Callable
+
+from vantage6.algorithm.tools.util import warn
+
+from v6_diagnostics.scheduler import Check
+
+
+ENTRY_POINT_GROUP = "v6_diagnostics.checks"
+COSTS = ("cheap", "moderate", "expensive")
+
+
+class CheckSpec:
+    """
+    A registered check, see the module docstring for its metadata.
+
+    Parameters
+    ----------
+    name : str
+        Name of the check, used to select it and as name of its result.
+    func : Callable
+        Function that runs the check. It receives the algorithm client as
+        first argument if ``needs_client`` is set, and the options of the
+        check as keyword arguments. It returns a `DiagnosticResult` or a list
+        of them.
+    category : str
+        What the check diagnoses.
+    cost : str, optional
+        One of `COSTS`.
+    depends_on : list[str], optional
+        Checks that need to finish before this check starts.
+    tags : list[str], optional
+        Additional tags of the check.
+    safe : bool, optional
+        Whether the check is safe to run on every node.
+    default : bool, optional
+        Whether the check runs when no checks or tags are selected.
+    needs_client : bool, optional
+        Whether ``func`` receives the algorithm client.
+    timeout : float | str, optional
+        Maximum number of seconds the check may take, or the name of the
+        timeout of the task to use (``check`` or ``subtask``).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        category: str,
+        cost: str = "cheap",
+        depends_on: list[str] | None = None,
+        tags: list[str] | None = None,
+        safe: bool = True,
+        default: bool = True,
+        needs_client: bool = False,
+        timeout: float | str = "check",
+    ) -> None:
+        if cost not in COSTS:
+            raise ValueError(f"Cost of {name} should be one of {COSTS}")
+        self.name = name
+        self.func = func
+        self.category = category
+        self.cost = cost
+        self.depends_on = list(depends_on or [])
+        self.safe = safe
+        self.default = default
+        self.needs_client = needs_client
+        self.timeout = timeout
+        self.tags = set(tags or []) | {category, cost}
+        if safe:
+            self.tags.add("safe")
+        if default:
+            self.tags.add("default")
+
+    @property
+    def metadata(self) -> dict:
+        """The metadata of the check, e.g. to list the available checks."""
+        return {
+            "name": self.name,
+            "category": self.category,
+            "cost": self.cost,
+            "depends_on": self.depends_on,
+            "tags": sorted(self.tags),
+            "safe": self.safe,
+            "default": self.default,
+        }
+
+    def check(self, client: Any, options: dict | None,
+              timeouts: dict[str, float],
+              run_after: list[str] | None = None) -> Check:
+        """Create the `Check` that runs this check in a task."""
+        timeout = self.timeout
+        if isinstance(timeout, str):
+            timeout = timeouts[timeout]
+        return Check(
+            self.name,
+            self.func,
+            args=(client,) if self.needs_client else (),
+            kwargs=options,
+            depends_on=self.depends_on,
+            timeout=timeout,
+            run_after=run_after,
+        )
+
+    def __repr__(self):
+        return f"CheckSpec({self.name}, {self.category}, {self.cost})"
+
+
+_checks: dict[str, CheckSpec] = {}
+_children: dict[str, Callable] = {}
+_plugins_loaded = False
+
+
+def register_check(name: str, category: str, **metadata) -> Callable:
+    """
+    Register the decorated function as check, see `CheckSpec`.
+
+    Raises
+    ------
+    ValueError
+        If another check with the same name is registered.
+    """
+    def decorator(func: Callable) -> Callable:
+        existing = _checks.get(name)
+        if existing is not None and existing.func is not func:
+            raise ValueError(f"A check named {name} is already registered")
+        _checks[name] = CheckSpec(name, func, category, **metadata)
+        return func
+    return decorator
+
+
+def register_child(func: Callable) -> Callable:
+    """Register the decorated function as child task, by its name."""
+    _children[func.__name__] = func
+    return func
+
+
+def registered_checks() -> list[CheckSpec]:
+    """All registered checks, in order of registration."""
+    load_plugins()
+    return list(_checks.values())
+
+
+def child_task(name: str) -> Callable:
+    """
+    Get a registered child task by name.
+
+    Raises
+    ------
+    KeyError
+        If no child task with this name is registered.
+    """
+    if name not in _children:
+        load_plugins()
+    return _children[name]
+
+
+def load_plugins() -> list[str]:
+    """
+    Import the modules of the ``v6_diagnostics.checks`` entry points, once.
+
+    A plugin that fails to load is reported and skipped.
+
+    Returns
+    -------
+    list[str]
+        Names of the entry points that were loaded by this call.
+    """
+    global _plugins_loaded
+    if _plugins_loaded:
+        return []
+    _plugins_loaded = True
+
+    # importlib.metadata is slow to import, most tasks do not need it
+    from importlib.metadata import entry_points
+
+    loaded = []
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            entry_point.load()
+        except Exception as exc:
+            warn(f"Could not load diagnostic checks {entry_point.name}: "
+                 f"{exc!r}")
+            continue
+        loaded.append(entry_point.name)
+    return loaded
+
+
+def select(
+    names: list[str] | None = None,
+    tags: list[str] | None = None,
+    exclude_tags: list[str] | None = None,
+    safe_only: bool = False,
+) -> list[CheckSpec]:
+    """
+    Select checks by name or tag.
+
+    Parameters
+    ----------
+    names : list[str], optional
+        Names of checks to select.
+    tags : list[str], optional
+        Select the checks that have any of these tags. When neither names nor
+        tags are given, the ``default`` checks are selected.
+    exclude_tags : list[str], optional
+        Leave out the checks that have any of these tags, unless another
+        selected check depends on them.
+    safe_only : bool, optional
+        Leave out the checks that are not safe to run on every node.
+
+    Returns
+    -------
+    list[CheckSpec]
+        The selected checks and the checks they depend on, in order of
+        registration.
+
+    Raises
+    ------
+    ValueError
+        If a name or a dependency is not a registered check.
+    """
+    available = {spec.name: spec for spec in registered_checks()}
+    unknown = set(names or []) - available.keys()
+    if unknown:
+        raise ValueError(f"Unknown checks {sorted(unknown)}, available are "
+                         f"{sorted(available)}")
+    if names is None and tags is None:
+        tags = ["default"]
+
+    selected = {
+        name for name, spec in available.items()
+        if name in (names or []) or spec.tags & set(tags or [])
+    }
+    selected = {
+        name for name in selected
+        if not available[name].tags & set(exclude_tags or [])
+        and (available[name].safe or not safe_only)
+    }
+
+    todo = list(selected)
+    while todo:
+        for dep in available[todo.pop()].depends_on:
+            if dep not in available:
+                raise ValueError(f"Check depends on unknown check {dep}")
+            if dep not in selected:
+                selected.add(dep)
+                todo.append(dep)
+    return [spec for name, spec in available.items() if name in selected]
+
+
+def build_checks(
+    specs: list[CheckSpec],
+    client: Any,
+    options: dict[str, dict | None] | None = None,
+    timeouts: dict[str, float] | None = None,
+) -> list[Check]:
+    """
+    Create the checks to run with `v6_diagnostics.scheduler.run_checks`.
+
+    Expensive checks come last, each running after all checks before it.
+
+    Parameters
+    ----------
+    specs : list[CheckSpec]
+        The checks, e.g. from `select`.
+    client : Any
+        The algorithm client, for the checks that need it.
+    options : dict[str, dict | None], optional
+        Keyword arguments of each check, by check name.
+    timeouts : dict[str, float], optional
+        The timeouts of the task, by name (``check`` and ``subtask``).
+    """
+    options = options or {}
+    timeouts = timeouts or {}
+    ordered = [spec for spec in specs if spec.cost != "expensive"] + \
+        [spec for spec in specs if spec.cost == "expensive"]
+
+    checks = []
+    for spec in ordered:
+        run_after = [
+            check.name for check in checks
+            if check.name not in spec.depends_on
+        ] if spec.cost == "expensive" else None
+        checks.append(
+            spec.check(client, options.get(spec.name), timeouts, run_after)
+        )
+    return checks
@@ -0,0 +1,219 @@
+"""
+Run diagnostic checks concurrently.
+
+Most diagnostic checks are independent of each other and spend their time
+waiting on the network (local proxy, subtasks, the internet). Running them one
+after another means that a single slow check adds its full latency to the
+diagnostic task. Instead, checks are started on daemon threads as soon as the
+checks they depend on have finished. A check can also be ordered after other
+checks without depending on them (``run_after``), e.g. so that a benchmark
+does not disturb them: unlike a dependency, such a check still runs when one
+of the checks before it timed out. Each check gets a hard timeout after which
+it is reported as failed. Daemon threads are used (rather than a thread pool)
+so that a check that hangs does not keep the algorithm container alive after
+the results have been written.
+"""
+import queue
+import threading
+import time
+
+from typing import Callable
+
+from v6_diagnostics.util import DiagnosticResult
+
+
+DEFAULT_TIMEOUT = 60
+MAX_WORKERS = 8
+
+
+class Check:
+    """
+    A diagnostic check and its scheduling constraints.
+
+    Parameters
+    ----------
+    name : str
+        Name of the check. This is used to refer to the check in the
+        ``depends_on`` of other checks and as the name of the result when the
+        check times out.
+    func : Callable
+        Function that runs the check. It should return a `DiagnosticResult` or
+        a list of them.
+    args : tuple, optional
+        Positional arguments for ``func``.
+    kwargs : dict, optional
+        Keyword arguments for ``func``.
+    depends_on : list[str], optional
+        Names of the checks that need to be finished before this check starts.
+        The check is skipped when one of them timed out.
+    run_after : list[str], optional
+        Names of the checks that need to be finished (or timed out) before
+        this check starts.
+    timeout : float, optional
+        Maximum number of seconds the check is allowed to run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        args: tuple = (),
+        kwargs: dict | None = None,
+        depends_on: list[str] | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        run_after: list[str] | None = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.depends_on = list(depends_on or [])
+        self.run_after = list(run_after or [])
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"Check({self.name})"
+
+
+def run_checks(
+    checks: list[Check], max_workers: int = MAX_WORKERS
+) -> list[DiagnosticResult]:
+    """
+    Run checks concurrently while respecting their dependencies.
+
+    Parameters
+    ----------
+    checks : list[Check]
+        The checks to run.
+    max_workers : int, optional
+        Maximum number of checks that run at the same time.
+
+    Returns
+    -------
+    list[DiagnosticResult]
+        The results of the checks, in the order in which the checks were given.
+        A check that returns multiple results contributes all of them.
+
+    Raises
+    ------
+    ValueError
+        If check names are not unique, a dependency is unknown or the
+        dependencies contain a cycle.
+    """
+    _validate(checks)
+
+    finished = queue.Queue()
+    pending = list(checks)
+    # checks that are running and the time at which they were started
+    running: dict[str, tuple[Check, float]] = {}
+    done: dict[str, list[DiagnosticResult]] = {}
+    timed_out: set[str] = set()
+
+    while pending or running:
+        for check in list(pending):
+            if len(running) >= max(max_workers, 1):
+                break
+            if not all(
+                dep in done for dep in check.depends_on + check.run_after
+            ):
+                continue
+
+            pending.remove(check)
+            failed_deps = [dep for dep in check.depends_on if dep in timed_out]
+            if failed_deps:
+                done[check.name] = [DiagnosticResult(
+                    check.name, False,
+                    payload=f"Skipped, dependencies timed out: {failed_deps}"
+                )]
+                continue
+
+            thread = threading.Thread(
+                target=_run_check, args=(check, finished), daemon=True,
+                name=f"check-{check.name}"
+            )
+            running[check.name] = (check, time.monotonic())
+            thread.start()
+
+        if not running:
+            # checks may have been skipped because their dependencies timed
+            # out, which can make other pending checks ready to start
+            continue
+
+        deadline = min(
+            started + check.timeout for check, started in running.values()
+        )
+        try:
+            name, results = finished.get(
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+        except queue.Empty:
+            now = time.monotonic()
+            for name, (check, started) in list(running.items()):
+                if started + check.timeout <= now:
+                    del running[name]
+                    timed_out.add(name)
+                    done[name] = [_timeout_result(check, started, now)]
+            continue
+
+        # results of checks that already timed out are discarded
+        if name in running:
+            del running[name]
+            done[name] = results
+
+    return [result for check in checks for result in done[check.name]]
+
+
+def _run_check(check: Check, finished: queue.Queue) -> None:
+    """Run a single check and put its results on the ``finished`` queue."""
+    try:
+        results = check.func(*check.args, **check.kwargs)
+    except Exception as exc:
+        results = DiagnosticResult(check.name, False, exception=exc)
+
+    if isinstance(results, DiagnosticResult):
+        results = [results]
+    finished.put((check.name, results))
+
+
+def _timeout_result(check: Check, started: float, finished: float) \
+        -> DiagnosticResult:
+    """Create the result of a check that did not finish in time."""
+    diagnostic = DiagnosticResult(
+        check.name, False,
+        exception=TimeoutError(
+            f"Check did not finish within {check.timeout} seconds"
+        )
+    )
+    diagnostic.set_timing(started, finished)
+    print(diagnostic)
+    return diagnostic
+
+
+def _validate(checks: list[Check]) -> None:
+    """Check that names are unique and the dependencies form a DAG."""
+    names = [check.name for check in checks]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Check names are not unique: {names}")
+
+    dependencies: dict[str, list[str]] = {
+        check.name: check.depends_on + check.run_after for check in checks
+    }
+    for name, deps in dependencies.items():
+        unknown = set(deps) - set(dependencies)
+        if unknown:
+            raise ValueError(
+                f"Check {name} depends on unknown checks {unknown}"
+            )
+
+    # Kahn's algorithm, anything that is left over is part of a cycle
+    resolved: set[str] = set()
+    remaining = dict(dependencies)
+    while remaining:
+        ready = [n for n, deps in remaining.items() if set(deps) <= resolved]
+        if not ready:
+            raise ValueError(
+                f"Check dependencies contain a cycle: {sorted(remaining)}"
+            )
+        for name in ready:
+            resolved.add(name)
+            del remaining[name]
@@ -0,0 +1,179 @@
+"""
+Diagnose the SSH tunnels of the node.
+
+Data sources (e.g. SQL databases) can be made available to algorithms through
+an SSH tunnel that the node sets up. The algorithm container connects to the
+hostname and bind port of the tunnel, from where the connection is forwarded
+over SSH to the data source. A degraded tunnel only shows up as slow
+algorithms, so for each tunnel the following is measured:
+
+    Connect latency
+        The time to open the first connection (which may need to set up the
+        SSH channel) and the time to reconnect, i.e. to open each of the
+        following connections after closing the previous one.
+    Forwarding
+        A tunnel accepts connections even when it cannot reach the data
+        source, in which case it closes them right away. After connecting,
+        the diagnostic therefore waits briefly for the service to respond: a
+        ``banner`` (services like MySQL and SSH speak first), ``quiet`` (the
+        connection stays open, like for PostgreSQL) or ``closed`` (the tunnel
+        could not forward the connection).
+    Throughput
+        Only when the service behind the tunnel is an echo server of this
+        algorithm (see `v6_diagnostics.vpn_benchmark`), which is useful for
+        testing a tunnel with a stand-in for the data source. The result
+        states that it was measured against the stand-in (``service``), as
+        it says nothing about the throughput of the real data source.
+
+Latencies are in milliseconds.
+"""
+import asyncio
+import socket
+import time
+
+from collections import Counter
+
+from v6_diagnostics.util import DiagnosticResult, header, timed, summarize
+from v6_diagnostics.vpn_benchmark import benchmark_address
+
+
+CONNECTS = 10
+TIMEOUT = 10
+# seconds to wait for the service to respond after connecting
+RESPONSE_WAIT = 0.5
+BANNER_SIZE = 256
+
+
+def parse_tunnel(tunnel: str | dict) -> tuple[str, int]:
+    """Get the host and port of a tunnel given as ``host:port`` or dict."""
+    if isinstance(tunnel, dict):
+        return tunnel["host"], int(tunnel["port"])
+    host, _, port = tunnel.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Tunnel should be given as host:port, not {tunnel}")
+    return host, int(port)
+
+
+def tunnel_name(tunnel: str | dict) -> str:
+    """Name of the diagnostic result of a tunnel."""
+    try:
+        host, port = parse_tunnel(tunnel)
+    except (KeyError, TypeError, ValueError):
+        return f"SSH_TUNNEL {tunnel}"
+    return f"SSH_TUNNEL {host}:{port}"
+
+
+def check_tunnel(
+    host: str, port: int, connects: int = CONNECTS, timeout: float = TIMEOUT,
+    response_wait: float = RESPONSE_WAIT
+) -> dict:
+    """
+    Connect to a tunnel repeatedly and check that it forwards connections.
+
+    Parameters
+    ----------
+    host : str
+        Hostname of the tunnel.
+    port : int
+        Bind port of the tunnel.
+    connects : int, optional
+        Number of connections to open one after another, at least one.
+    timeout : float, optional
+        Seconds to wait for each connection to be opened.
+    response_wait : float, optional
+        Seconds to wait for the service to respond after connecting.
+
+    Returns
+    -------
+    dict
+        The latency of the first connection, the distribution of the
+        reconnect latency, the number of connections per forwarding state
+        (including ``failed`` for connections that could not be opened) and
+        the banner of the service, if any.
+
+    Raises
+    ------
+    ValueError
+        If ``connects`` is less than one.
+    """
+    if connects < 1:
+        raise ValueError(f"At least one connect is needed, not {connects}")
+    latencies = []
+    states = Counter()
+    banner = None
+    errors = Counter()
+    for _ in range(connects):
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((host, port), timeout) as sock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                state, data = _response(sock, response_wait)
+        except OSError as exc:
+            latencies.append(None)
+            states["failed"] += 1
+            errors[repr(exc)] += 1
+            continue
+        states[state] += 1
+        if data and banner is None:
+            banner = data[:BANNER_SIZE].decode(errors="replace")
+
+    return {
+        "first_connect": latencies[0] if latencies else None,
+        "reconnect": summarize(latencies[1:]),
+        "states": dict(states),
+        "banner": banner,
+        "errors": dict(errors),
+    }
+
+
+@timed
+def diagnose_ssh_tunnel(
+    tunnel: str | dict, benchmark: bool = False,
+    benchmark_options: dict | None = None, **check_options
+) -> DiagnosticResult:
+    """Diagnose a single SSH tunnel."""
+    name = tunnel_name(tunnel)
+    header(f"Diagnose the SSH tunnel {tunnel}")
+    try:
+        host, port = parse_tunnel(tunnel)
+        metrics = check_tunnel(host, port, **check_options)
+        states = set(metrics["states"])
+        success = bool(states) and states <= {"banner", "quiet"}
+        if benchmark and success:
+            metrics["benchmark"] = {
+                "service": "echo stand-in of v6_diagnostics, not the data "
+                           "source",
+                **asyncio.run(
+                    benchmark_address(host, port, **(benchmark_options or {}))
+                ),
+            }
+            success = not _errors(metrics["benchmark"])
+        diagnostic = DiagnosticResult(name, success, metrics=metrics)
+    except Exception as exc:
+        diagnostic = DiagnosticResult(name, False, exception=exc)
+
+    print(diagnostic)
+    return diagnostic
+
+
+def _response(sock: socket.socket, wait: float) -> tuple[str, bytes]:
+    """Wait for the service to respond, see the module docstring."""
+    sock.settimeout(wait)
+    try:
+        data = sock.recv(BANNER_SIZE)
+    except socket.timeout:
+        return "quiet", b""
+    except ConnectionResetError:
+        return "closed", b""
+    return ("banner", data) if data else ("closed", b"")
+
+
+def _errors(measurements) -> list[str]:
+    """Collect the errors of failed measurements of a benchmark."""
+    if isinstance(measurements, list):
+        return [e for m in measurements for e in _errors(m)]
+    if not isinstance(measurements, dict):
+        return []
+    if "error" in measurements:
+        return [measurements["error"]]
+    return [e for m in measurements.values() for e in _errors(m)]
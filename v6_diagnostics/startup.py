@@ -0,0 +1,162 @@
+"""
+Measure how long it takes before the code of an algorithm container runs.
+
+Every subtask and every VPN echo server pays this cold-start cost before it
+does anything useful. The following is reported:
+
+    Cold start
+        When the container (its first process), the Python process and the
+        import of this package started, read from ``/proc``, and how long the
+        import of the package took. Times are in seconds, with the resolution
+        of the kernel clock ticks (normally 10 ms).
+    Import times
+        For each method, a fresh interpreter imports the algorithm wrapper and
+        this package and looks up the method, like a container that runs the
+        method does. The import time of every module is parsed from
+        ``python -X importtime``, and the slowest modules (by their own import
+        time) and the top-level packages (by their cumulative import time) are
+        reported.
+"""
+import os
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+
+# methods of which the imports are measured: the child tasks that should start
+# fast and, for comparison, the base features
+METHODS = (
+    "diagnose_local_proxy_subtask_stop",
+    "RPC_wait",
+    "RPC_echo",
+    "base_features",
+)
+TOP = 15
+TIMEOUT = 60
+# imports like `vantage6.algorithm.tools.wrap.wrap_algorithm` does
+STATEMENT = (
+    "import importlib, os, vantage6.algorithm.tools.wrap; "
+    "getattr(importlib.import_module(os.environ.get('PKG_NAME', "
+    "'v6_diagnostics')), {method!r})"
+)
+
+
+def cold_start(started: float, imported: float) -> dict:
+    """
+    Measure the start of the container, the process and the package.
+
+    Parameters
+    ----------
+    started : float
+        When the first line of the package ran (a `time.time` timestamp).
+    imported : float
+        When the import of the package finished.
+
+    Returns
+    -------
+    dict
+        The timestamps and the time between them, see the module docstring.
+        Timestamps that cannot be read are None.
+    """
+    container = _process_start(1)
+    process = _process_start("self")
+    return {
+        "container_start": container,
+        "process_start": process,
+        "package_start": started,
+        "container_to_process_seconds": _between(container, process),
+        "process_to_package_seconds": _between(process, started),
+        "container_to_package_seconds": _between(container, started),
+        "package_import_seconds": imported - started,
+    }
+
+
+def import_times(method: str, top: int = TOP, timeout: float = TIMEOUT) \
+        -> dict:
+    """
+    Measure the imports of a container that runs ``method``.
+
+    Returns
+    -------
+    dict
+        The wall-clock time of the interpreter, the total import time, the
+        number of imported modules, the slowest modules and the top-level
+        packages.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         STATEMENT.format(method=method)],
+        capture_output=True, text=True, timeout=timeout,
+    )
+    wall = time.perf_counter() - start
+
+    modules = _parse_importtime(process.stderr)
+    by_self = sorted(modules, key=lambda m: m["self_seconds"], reverse=True)
+    top_level = sorted(
+        (m for m in modules if m["depth"] == 0),
+        key=lambda m: m["cumulative_seconds"], reverse=True
+    )
+    result = {
+        "success": process.returncode == 0,
+        "wall_seconds": wall,
+        "import_seconds": sum(m["self_seconds"] for m in modules),
+        "modules": len(modules),
+        "slowest": [_strip(m) for m in by_self[:top]],
+        "packages": [_strip(m) for m in top_level[:top]],
+    }
+    if process.returncode != 0:
+        lines = [
+            line for line in process.stderr.splitlines()
+            if not line.startswith("import time:")
+        ]
+        result["error"] = "\n".join(lines[-5:])
+    return result
+
+
+def _parse_importtime(output: str) -> list[dict]:
+    """Parse the lines of ``-X importtime``, microseconds become seconds."""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        modules.append({
+            "module": stripped,
+            # each level of nesting is indented by two spaces
+            "depth": (len(name) - len(stripped) - 1) // 2,
+            "self_seconds": int(fields[0]) / 1e6,
+            "cumulative_seconds": int(fields[1]) / 1e6,
+        })
+    return modules
+
+
+def _strip(module: dict) -> dict:
+    return {k: v for k, v in module.items() if k != "depth"}
+
+
+def _process_start(pid: int | str) -> float | None:
+    """When a process started, as `time.time` timestamp."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    # the name of the process (2nd field) may contain spaces, the start time
+    # is the 22nd field
+    fields = stat.rpartition(")")[2].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    age = uptime - int(fields[19]) / ticks
+    return time.time() - age
+
+
+def _between(start: float | None, end: float | None) -> float | None:
+    if start is None or end is None:
+        return None
+    return end - start
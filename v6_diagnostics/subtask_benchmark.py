@@ -0,0 +1,224 @@
+"""
+Benchmark the round-trip of subtasks.
+
+Iterative federated algorithms create many subtasks, so the time from creating
+a subtask to having its result often dominates their runtime. Each subtask
+runs ``diagnose_local_proxy_subtask_stop``, which returns immediately, and the
+following phases are measured for it:
+
+    create
+        Latency of the call that creates the subtask.
+    queue_to_start
+        Time between the run being assigned to the node and the algorithm
+        container being started (from the timestamps of the run).
+    start_to_finish
+        Time between the algorithm container starting and the run being
+        finished (from the timestamps of the run).
+    result
+        Latency of retrieving the result once the subtask has finished.
+    round_trip
+        Time from creating the subtask until its result is retrieved.
+
+The run timestamps are set by the server and the node, while the other phases
+are measured by the clock of this container. All durations are in seconds.
+
+Subtasks are created in one of two modes:
+
+    sequential
+        One subtask at a time, the next one is created when the result of the
+        previous one has been retrieved, like an iterative algorithm does.
+    burst
+        All subtasks are created at once from multiple threads, which shows
+        how the server and nodes deal with a queue of runs.
+"""
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from vantage6.algorithm.tools.util import info
+from vantage6.common.task_status import TaskStatus, has_task_finished
+
+from v6_diagnostics.util import summarize
+
+if TYPE_CHECKING:
+    from vantage6.algorithm.client import AlgorithmClient
+
+
+COUNT = 10
+WORKERS = 8
+POLL_INTERVAL = 0.5
+TIMEOUT = 600
+MODES = ("sequential", "burst")
+PHASES = ("create", "queue_to_start", "start_to_finish", "result",
+          "round_trip")
+STOP_INPUT = {"method": "diagnose_local_proxy_subtask_stop"}
+
+
+def benchmark_subtasks(
+    client: "AlgorithmClient",
+    count: int = COUNT,
+    mode: str = "sequential",
+    organizations: list[int] | None = None,
+    workers: int = WORKERS,
+    poll_interval: float = POLL_INTERVAL,
+    timeout: float = TIMEOUT,
+) -> dict:
+    """
+    Create subtasks and measure the latency of each of their phases.
+
+    Parameters
+    ----------
+    client : AlgorithmClient
+        The client to create the subtasks with.
+    count : int, optional
+        Number of subtasks to create.
+    mode : str, optional
+        Either ``sequential`` or ``burst``, see the module docstring.
+    organizations : list[int], optional
+        Organizations to spread the subtasks over (round-robin). By default all
+        subtasks run at the organization of this container.
+    workers : int, optional
+        Number of threads that create and poll the subtasks in burst mode.
+    poll_interval : float, optional
+        Seconds between checking whether a subtask has finished.
+    timeout : float, optional
+        Seconds after which subtasks that have not finished are given up on.
+
+    Returns
+    -------
+    dict
+        The distribution of each phase, the total time and the measurements
+        per subtask.
+
+    Raises
+    ------
+    ValueError
+        If the mode is unknown.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {MODES}")
+
+    organizations = organizations or [client.organization_id]
+    targets = [organizations[i % len(organizations)] for i in range(count)]
+    deadline = time.monotonic() + timeout
+
+    def run(organization_id: int) -> dict:
+        measurement, results = run_subtask(
+            client, organization_id, STOP_INPUT, poll_interval, deadline
+        )
+        if "error" not in measurement and results != [True]:
+            measurement["error"] = f"Unexpected results: {results}"
+        return measurement
+
+    start = time.perf_counter()
+    if mode == "sequential":
+        subtasks = [run(organization_id) for organization_id in targets]
+    else:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            subtasks = list(pool.map(run, targets))
+    seconds = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "count": count,
+        "organizations": organizations,
+        "seconds": seconds,
+        "subtasks_per_second": count / seconds if seconds > 0 else None,
+        "failed": sum(1 for subtask in subtasks if subtask.get("error")),
+        "phases": {
+            phase: summarize([subtask.get(phase) for subtask in subtasks])
+            for phase in PHASES
+        },
+        "subtasks": subtasks,
+    }
+
+
+def run_subtask(
+    client: "AlgorithmClient", organization_id: int, input_: dict,
+    poll_interval: float = POLL_INTERVAL, deadline: float | None = None
+) -> tuple[dict, list]:
+    """
+    Create a single subtask, wait for it and retrieve its results.
+
+    Parameters
+    ----------
+    client : AlgorithmClient
+        The client to create the subtask with.
+    organization_id : int
+        Organization that should run the subtask.
+    input_ : dict
+        Input of the subtask.
+    poll_interval : float, optional
+        Seconds between checking whether the subtask has finished.
+    deadline : float, optional
+        Value of `time.monotonic` after which the subtask is given up on.
+
+    Returns
+    -------
+    tuple[dict, list]
+        The measured phases (with an ``error`` if the subtask failed) and the
+        results of the subtask.
+    """
+    measurement = {"organization_id": organization_id}
+    results = []
+    try:
+        start = time.perf_counter()
+        task = client.task.create(
+            name="feature-tester-subtask-benchmark",
+            description="This task is from the feature tester",
+            organizations=[organization_id],
+            input_=input_,
+        )
+        measurement["create"] = time.perf_counter() - start
+        measurement["task_id"] = task_id = task.get("id")
+
+        status = task.get("status")
+        while not has_task_finished(status):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Subtask {task_id} did not finish in time")
+            time.sleep(poll_interval)
+            status = client.task.get(task_id).get("status")
+        measurement["status"] = status
+
+        retrieved = time.perf_counter()
+        results = client.result.from_task(task_id)
+        measurement["result"] = time.perf_counter() - retrieved
+        measurement["round_trip"] = time.perf_counter() - start
+
+        runs = client.run.from_task(task_id)
+        if runs:
+            measurement.update(_run_phases(runs[0]))
+        if status != TaskStatus.COMPLETED.value:
+            measurement["error"] = f"Subtask ended with status {status}"
+    except Exception as exc:
+        info(f"Subtask for organization {organization_id} failed: {exc!r}")
+        measurement["error"] = repr(exc)
+    return measurement, results
+
+
+def _run_phases(run: dict) -> dict:
+    """Compute the phases that are recorded in the timestamps of a run."""
+    assigned, started, finished = (
+        _parse(run.get(key))
+        for key in ("assigned_at", "started_at", "finished_at")
+    )
+    return {
+        "queue_to_start": _seconds(assigned, started),
+        "start_to_finish": _seconds(started, finished),
+    }
+
+
+def _parse(timestamp: str | None) -> datetime | None:
+    if not timestamp:
+        return None
+    parsed = datetime.fromisoformat(timestamp)
+    # the server stores naive UTC timestamps
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _seconds(start: datetime | None, end: datetime | None) -> float | None:
+    if start is None or end is None:
+        return None
+    return (end - start).total_seconds()
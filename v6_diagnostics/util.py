@@ -1,32 +1,88 @@
 import traceback
-from typing import Any
+from typing import Any, Callable
 import os
+import io
+import time
 import base64
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+
+from contextlib import contextmanager
 
 from vantage6.common.globals import STRING_ENCODING, ENV_VAR_EQUALS_REPLACEMENT
 
+from v6_diagnostics.encoding import encode_value
+
 
 class DiagnosticResult:
     """Class to store the results of a diagnostic test."""
 
+    # many results are created on big collaborations, slots keep them small
+    __slots__ = (
+        "name", "success", "payload", "exception", "metrics", "traceback",
+        "started", "finished", "spans", "profile",
+    )
+
     def __init__(
-        self, name: str, success: bool, payload: Any = None, exception: Exception = None
+        self, name: str, success: bool, payload: Any = None,
+        exception: Exception = None, metrics: dict | None = None
     ) -> None:
         self.name = name
         self.success = success
         self.payload = payload
         self.exception = exception
-        self.traceback = traceback.format_exc() if exception else None
+        # structured measurements (e.g. latencies), kept apart from the payload
+        # so that they can be processed by the client
+        self.metrics = metrics or {}
+        self.traceback = "".join(traceback.format_exception(
+            type(exception), exception, exception.__traceback__
+        )) if exception else None
+        # filled in by the `timed` decorator, timestamps are monotonic
+        self.started = None
+        self.finished = None
+        self.spans = []
+        self.profile = None
+
+    @property
+    def duration(self) -> float | None:
+        """Number of seconds the check took, if it was timed."""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def set_timing(
+        self, started: float, finished: float, spans: list[dict] | None = None,
+        profile: dict | None = None
+    ) -> None:
+        """Record when the check ran, and optionally its spans and profile."""
+        self.started = started
+        self.finished = finished
+        self.spans = spans or []
+        self.profile = profile
 
     @property
     def json(self):
-        """Return a JSON representation of the result."""
+        """
+        Return a JSON representation of the result.
+
+        The payload and metrics are converted to JSON values, with large blobs
+        replaced by a summary, see `v6_diagnostics.encoding.encode_value`.
+        """
         return {
             "name": self.name,
             "success": self.success,
-            "payload": str(self.payload),
-            "exception": str(self.exception),
+            "payload": encode_value(self.payload),
+            "exception": str(self.exception) if self.exception else None,
             "traceback": self.traceback,
+            "metrics": encode_value(self.metrics),
+            "started": self.started,
+            "finished": self.finished,
+            "duration": self.duration,
+            "spans": self.spans,
+            "profile": self.profile,
         }
 
     def __str__(self):
@@ -41,10 +97,161 @@ def header(text):
     print("\n" + text.center(80, "-"))
 
 
+# Profiling is opt-in as it slows down the checks. Note that tracemalloc traces
+# the whole process, so checks should not run concurrently while profiling.
+PROFILE_TOP = 20
+_profiling = {"enabled": False, "top": PROFILE_TOP}
+# spans of the check that is running in the current thread
+_local = threading.local()
+
+
+def set_profiling(enabled: bool, top: int = PROFILE_TOP) -> None:
+    """Enable or disable profiling of checks decorated with `timed`."""
+    _profiling["enabled"] = enabled
+    _profiling["top"] = top
+
+
+def timed(func: Callable) -> Callable:
+    """
+    Decorator that records the timing of a check in its results.
+
+    The decorated function should return a `DiagnosticResult` or a list of
+    them. Spans recorded with `span` while the function runs are attached to
+    the results. When profiling is enabled (see `set_profiling`), a cProfile
+    summary and the tracemalloc peak are attached as well.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "spans", None)
+        spans = _local.spans = []
+        profiler = _Profiler(_profiling["top"]) if _profiling["enabled"] \
+            else None
+        started = time.monotonic()
+        try:
+            if profiler:
+                profiler.start()
+            results = func(*args, **kwargs)
+        finally:
+            profile = profiler.stop() if profiler else None
+            finished = time.monotonic()
+            _local.spans = previous
+
+        for result in results if isinstance(results, list) else [results]:
+            if isinstance(result, DiagnosticResult):
+                result.set_timing(started, finished, spans, profile)
+        return results
+    return wrapper
+
+
+def algorithm_client(func: Callable) -> Callable:
+    """
+    Same as `vantage6.algorithm.tools.decorators.algorithm_client`, but the
+    vantage6 decorator (which imports pandas and the algorithm client) is only
+    imported when the decorated function is called, so that importing this
+    package stays cheap for child tasks that do not need a client.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from vantage6.algorithm.tools.decorators import (
+            algorithm_client as decorate
+        )
+        return decorate(func)(*args, **kwargs)
+
+    wrapper.wrapped_in_algorithm_client_decorator = True
+    return wrapper
+
+
+@contextmanager
+def span(name: str):
+    """
+    Record the duration of a phase of a check, e.g. connecting to a server.
+    Outside of a `timed` function nothing is recorded.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append({
+                "name": name,
+                "started": started,
+                "duration": time.monotonic() - started,
+            })
+
+
+class _Profiler:
+    """Collect a cProfile summary and the tracemalloc peak of a check."""
+
+    def __init__(self, top: int) -> None:
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.started_tracing = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        tracemalloc.reset_peak()
+        self.profile.enable()
+
+    def stop(self) -> dict:
+        self.profile.disable()
+        _, peak = tracemalloc.get_traced_memory()
+        if self.started_tracing:
+            tracemalloc.stop()
+
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        functions = sorted(
+            stats.stats.items(), key=lambda item: item[1][3], reverse=True
+        )[:self.top]
+        return {
+            "tracemalloc_peak": peak,
+            "functions": [
+                {
+                    "function": f"{file}:{line}({name})",
+                    "calls": calls,
+                    "total": total,
+                    "cumulative": cumulative,
+                }
+                for (file, line, name), (_, calls, total, cumulative, _)
+                in functions
+            ],
+        }
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """
+    Return the q-th percentile of the values, interpolating linearly between
+    the closest ranks. Returns None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: list[float]) -> dict:
+    """Summarize a list of measurements (e.g. latencies)."""
+    values = [v for v in values if v is not None]
+    return {
+        "count": len(values),
+        "min": min(values, default=None),
+        "max": max(values, default=None),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
 # def get_env_var(var_name: str, default: str | None = None) -> str:
 #     """
-#     Get the value of an environment variable. Environment variables are encoded
-#     by the node so they need to be decoded here.
+#     Get the value of an environment variable. Environment variables are
+#     encoded by the node so they need to be decoded here.
 
 #     Note that this decoding follows the reverse of the encoding in the node:
 #     first replace '=' back and then decode the base32 string.
@@ -64,6 +271,8 @@ def header(text):
 #             os.environ[var_name].replace(
 #                 ENV_VAR_EQUALS_REPLACEMENT, "="
 #             ).encode(STRING_ENCODING)
-#         return base64.b32decode(encoded_env_var_value).decode(STRING_ENCODING)
+#         return base64.b32decode(
+#             encoded_env_var_value
+#         ).decode(STRING_ENCODING)
 #     except KeyError:
 #         return default
@@ -0,0 +1,215 @@
+"""
+Benchmark the I/O performance of a directory, normally the temporary volume.
+
+Algorithms use the temporary volume to hand off (large) intermediate results
+between the parent and child containers of a task, so both its throughput and
+its latency matter. The following is measured in a scratch directory that is
+removed afterwards:
+
+    Sequential write/read
+        A file of ``size`` bytes is written in blocks of ``block_size`` bytes
+        and fsync-ed, and then read back.
+    Random write/read
+        ``random_ops`` blocks of ``random_block_size`` bytes are written to
+        and read from random (aligned) offsets in the same file.
+    fsync latency
+        The latency of fsync after appending a small record, which is what
+        databases and queues do on every commit.
+    Small files
+        The number of small files that can be created (and removed) per
+        second.
+
+Reads after writes are normally served from the page cache. Where the platform
+supports it, the cache for the benchmark file is dropped before reading, so
+that the storage behind the volume is measured. Throughput is reported in MB/s
+(10^6 bytes per second) and latencies in milliseconds.
+"""
+import os
+import random
+import shutil
+import time
+import uuid
+
+from pathlib import Path
+
+from v6_diagnostics.util import summarize
+
+
+SIZE = 64 * 1024 ** 2
+BLOCK_SIZE = 1024 ** 2
+RANDOM_BLOCK_SIZE = 4 * 1024
+RANDOM_OPS = 1000
+FSYNC_SAMPLES = 20
+SMALL_FILES = 500
+SMALL_FILE_SIZE = 1024
+
+
+def benchmark_volume(
+    folder: str | Path,
+    size: int = SIZE,
+    block_size: int = BLOCK_SIZE,
+    random_block_size: int = RANDOM_BLOCK_SIZE,
+    random_ops: int = RANDOM_OPS,
+    fsync_samples: int = FSYNC_SAMPLES,
+    small_files: int = SMALL_FILES,
+) -> dict:
+    """
+    Benchmark the I/O performance of a directory.
+
+    Parameters
+    ----------
+    folder : str | Path
+        Directory to benchmark. A scratch directory is created in it.
+    size : int, optional
+        Size in bytes of the file used for the sequential and random tests.
+    block_size : int, optional
+        Size in bytes of the blocks of the sequential tests.
+    random_block_size : int, optional
+        Size in bytes of the blocks of the random tests.
+    random_ops : int, optional
+        Number of random reads and writes.
+    fsync_samples : int, optional
+        Number of fsync calls to measure.
+    small_files : int, optional
+        Number of small files to create.
+
+    Returns
+    -------
+    dict
+        The results per test, see the module docstring.
+    """
+    scratch = Path(folder) / f"benchmark-{uuid.uuid4().hex}"
+    scratch.mkdir()
+    try:
+        path = scratch / "data.bin"
+        metrics = {
+            "size": size,
+            "cache_dropped": hasattr(os, "posix_fadvise"),
+            "sequential_write": sequential_write(path, size, block_size),
+            "sequential_read": sequential_read(path, block_size),
+        }
+        offsets = _random_offsets(
+            os.path.getsize(path), random_block_size, random_ops
+        )
+        metrics["random_write"] = random_write(
+            path, offsets, random_block_size
+        )
+        metrics["random_read"] = random_read(path, offsets, random_block_size)
+        metrics["fsync"] = fsync_latency(scratch / "fsync.bin", fsync_samples)
+        metrics["small_files"] = create_small_files(
+            scratch / "small", small_files
+        )
+        return metrics
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def sequential_write(path: Path, size: int, block_size: int) -> dict:
+    """Write ``size`` bytes in blocks and fsync the file."""
+    # random data, so that compressing or deduplicating storage is not
+    # measured as being faster than it is
+    block = os.urandom(min(block_size, size))
+    start = time.perf_counter()
+    with open(path, "wb", buffering=0) as f:
+        remaining = size
+        while remaining > 0:
+            remaining -= f.write(block[:remaining])
+        os.fsync(f.fileno())
+    return _throughput(size, time.perf_counter() - start)
+
+
+def sequential_read(path: Path, block_size: int) -> dict:
+    """Read a file from start to end."""
+    buffer = bytearray(block_size)
+    total = 0
+    with open(path, "rb", buffering=0) as f:
+        _drop_cache(f.fileno())
+        start = time.perf_counter()
+        while n := f.readinto(buffer):
+            total += n
+    return _throughput(total, time.perf_counter() - start)
+
+
+def random_write(path: Path, offsets: list[int], block_size: int) -> dict:
+    """Write blocks at the given offsets and fsync the file."""
+    block = os.urandom(block_size)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        start = time.perf_counter()
+        for offset in offsets:
+            os.pwrite(fd, block, offset)
+        os.fsync(fd)
+        seconds = time.perf_counter() - start
+    finally:
+        os.close(fd)
+    return _operations(len(offsets), block_size, seconds)
+
+
+def random_read(path: Path, offsets: list[int], block_size: int) -> dict:
+    """Read blocks at the given offsets."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        _drop_cache(fd)
+        start = time.perf_counter()
+        for offset in offsets:
+            os.pread(fd, block_size, offset)
+        seconds = time.perf_counter() - start
+    finally:
+        os.close(fd)
+    return _operations(len(offsets), block_size, seconds)
+
+
+def fsync_latency(path: Path, samples: int) -> dict:
+    """Measure the latency of fsync after appending a small record."""
+    latencies = []
+    with open(path, "ab", buffering=0) as f:
+        for i in range(samples):
+            f.write(f"{i}\n".encode())
+            start = time.perf_counter()
+            os.fsync(f.fileno())
+            latencies.append((time.perf_counter() - start) * 1000)
+    return summarize(latencies)
+
+
+def create_small_files(folder: Path, count: int) -> dict:
+    """Measure how many small files can be created and removed per second."""
+    folder.mkdir()
+    content = os.urandom(SMALL_FILE_SIZE)
+    start = time.perf_counter()
+    for i in range(count):
+        (folder / f"{i}.bin").write_bytes(content)
+    created = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(count):
+        (folder / f"{i}.bin").unlink()
+    removed = time.perf_counter() - start
+    return {
+        "files": count,
+        "created_per_second": count / created if created > 0 else None,
+        "removed_per_second": count / removed if removed > 0 else None,
+    }
+
+
+def _drop_cache(fd: int) -> None:
+    """Ask the kernel to drop the cached pages of a file, if supported."""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _random_offsets(size: int, block_size: int, count: int) -> list[int]:
+    blocks = max(size // block_size, 1)
+    return [random.randrange(blocks) * block_size for _ in range(count)]
+
+
+def _operations(count: int, block_size: int, seconds: float) -> dict:
+    metrics = _throughput(count * block_size, seconds)
+    metrics["iops"] = count / seconds if seconds > 0 else None
+    return metrics
+
+
+def _throughput(size: int, seconds: float) -> dict:
+    return {
+        "seconds": seconds,
+        "throughput": size / seconds / 1e6 if seconds > 0 else None,
+    }
@@ -8,33 +8,65 @@ When a return statement is reached the result is send to the central
 server after encryption.
 """
 
-import socket
+import time
+import random
 import asyncio
 import traceback
 
-from typing import Any
-from time import sleep
+from typing import Any, Callable, TYPE_CHECKING
+from functools import partial
 
 from vantage6.algorithm.tools.util import info
-from vantage6.algorithm.client import AlgorithmClient
 
-from v6_diagnostics.util import header, DiagnosticResult
+from v6_diagnostics.util import (
+    header, DiagnosticResult, timed, span, algorithm_client
+)
+from v6_diagnostics import vpn_benchmark
+
+if TYPE_CHECKING:
+    from vantage6.algorithm.client import AlgorithmClient
 
 
 MESSAGE = b'Hello vantage6!\n'
-WAIT = 5
+# port of the echo server, labelled port8 in the Dockerfile
+ECHO_PORT = 8888
 TIMEOUT = 20
-RETRY = 20
+READY_TIMEOUT = 85
+BACKOFF_START = 0.25
+BACKOFF_MAX = 4
+MAX_CONNECTIONS = 32
+# in a mesh every node waits for all of its peers to finish probing it
+MESH_SERVER_TIMEOUT = 300
+MESH_RTT_ROUNDS = 20
+MESH_PAYLOAD_SIZE = 1024 ** 2
 
 
+@timed
 def diagnose_vpn_connection(client, other_nodes: list[int], **kwargs) \
         -> DiagnosticResult:
+    """
+    Diagnose the VPN connection to the algorithm containers of other nodes.
+
+    When ``benchmark=True`` is passed, the latency and throughput of each link
+    are measured too, see `v6_diagnostics.vpn_benchmark.benchmark_address` for
+    the other options.
+    """
     header('Diagnosing VPN connection')
 
     try:
-        successes = echo(client, other_nodes, **kwargs)
-        diagnostic = DiagnosticResult('VPN connection', all(successes),
-                                      successes)
+        echos = echo(client, other_nodes, **kwargs)
+        success = all(e['success'] for e in echos)
+        metrics = {
+            'time_to_ready': {
+                e['organization_id']: e['time_to_ready'] for e in echos
+            }
+        }
+        if kwargs.get('benchmark'):
+            metrics['benchmark'] = {
+                e['organization_id']: e.pop('benchmark', None) for e in echos
+            }
+        diagnostic = DiagnosticResult('VPN connection', success, echos,
+                                      metrics=metrics)
     except Exception as e:
         diagnostic = DiagnosticResult('VPN connection', False, exception=e)
 
@@ -42,69 +74,120 @@ def diagnose_vpn_connection(client, other_nodes: list[int], **kwargs) \
     return diagnostic
 
 
-def echo(client: AlgorithmClient, other_nodes: list[int], **kwargs) \
-        -> list[bool]:
+def echo(client: "AlgorithmClient", other_nodes: list[int], **kwargs) \
+        -> list[dict]:
     try:
-        return try_echo(client, other_nodes)
+        return try_echo(client, other_nodes, **kwargs)
     except Exception as exc:
         info('Exception!')
         info(traceback.format_exc())
         raise exc
 
 
-def try_echo(client: AlgorithmClient, other_nodes: list[int]) -> list[bool]:
+def try_echo(client: "AlgorithmClient", other_nodes: list[int],
+             benchmark: bool = False, **benchmark_options) -> list[dict]:
 
     info("Defining input parameters")
+    input_ = {"method": "RPC_echo"}
+    if benchmark:
+        # the peers are benchmarked one after another, so the last server has
+        # to wait for all others. Servers are stopped explicitly when their
+        # benchmark is done, so normally they do not live this long.
+        input_["kwargs"] = {
+            "duration": READY_TIMEOUT + len(other_nodes)
+            * vpn_benchmark.max_duration(**benchmark_options)
+        }
+
     # create a new task for all organizations in the collaboration.
     info(f"Dispatching node-tasks to organizations {other_nodes}")
-    subtask = client.task.create(
-        input_={"method": "RPC_echo"}, organizations=other_nodes
-    )
-    info(f"Waiting {WAIT} seconds for the algorithm containers to boot up...")
-    sleep(WAIT)
+    with span("create_subtask"):
+        subtask = client.task.create(input_=input_, organizations=other_nodes)
 
-    # Ip address and port of algorithm can be found in results model
-    n_nodes = len(other_nodes)
-    addresses = _await_port_numbers(client, num_nodes=n_nodes, subtask=subtask["id"])
-    succeeded_echos = []
-    info(f"Echoing to {len(addresses)} algorithms...")
+    with span("echo"):
+        echos = asyncio.run(_echo_when_ready(
+            partial(get_vpn_addresses, client, subtask["id"]), other_nodes
+        ))
+    if benchmark:
+        with span("benchmark"):
+            asyncio.run(_benchmark(echos, **benchmark_options))
+    info(f"Echo results: {echos}")
+    return echos
 
-    for a in addresses:
-        ip = a["ip"]
-        port = a["port"]
-        info(f"Sending message to {ip}:{port}")
 
-        try:
-            succeeded_echos.append(_check_echo(ip, port))
-        except socket.timeout:
-            info("Timeout! Skipping to next address.")
+async def _benchmark(echos: list[dict], **benchmark_options) -> None:
+    """
+    Benchmark the links that echoed successfully and stop their servers.
 
-    info(f"Succeeded echos: {succeeded_echos}")
-    return succeeded_echos
+    The links are benchmarked one at a time, as they share the bandwidth of
+    this container.
+    """
+    for e in echos:
+        if not e["success"]:
+            continue
+        e["benchmark"] = await vpn_benchmark.benchmark_address(
+            e["ip"], e["port"], **benchmark_options
+        )
+        await vpn_benchmark.stop_server(e["ip"], e["port"])
+
+
+async def _echo_when_ready(
+    get_addresses: Callable[[], list[dict]], other_nodes: list[int],
+    max_connections: int = MAX_CONNECTIONS
+) -> list[dict]:
+    """
+    Echo to each algorithm container as soon as it is ready.
 
+    Rather than waiting a fixed time for the containers to boot, the VPN
+    addresses (obtained by calling ``get_addresses``) are polled with
+    exponential backoff and every address is probed as soon as it is
+    published. The time from the start of polling until the echo server
+    accepts a connection is reported as ``time_to_ready``.
+    """
+    start = time.monotonic()
+    deadline = start + READY_TIMEOUT
+    semaphore = asyncio.Semaphore(max_connections)
 
-def _await_port_numbers(
-    client: AlgorithmClient, num_nodes: int, subtask: int
-) -> list[dict[str, Any]]:
+    # Ip address and port of algorithm can be found in results model
+    probes = {}
+    attempt = 0
+    while time.monotonic() < deadline:
+        addresses = await asyncio.to_thread(get_addresses)
+        for address in addresses:
+            key = (address["ip"], address["port"])
+            if key not in probes:
+                info(f"Address published: {address}")
+                probes[key] = asyncio.create_task(
+                    _check_echo(address, semaphore, start, deadline)
+                )
+
+        if len(probes) >= len(other_nodes):
+            break
+        info("Polling results for port numbers...")
+        await asyncio.sleep(_backoff(attempt, deadline))
+        attempt += 1
+    else:
+        info("Cannot contact all organizations!")
 
-    results = get_vpn_addresses(client, subtask)
+    info(f"Echoing to {len(probes)} algorithms...")
+    echos = list(await asyncio.gather(*probes.values()))
 
-    
-    info(f"Addresses: {results}")
-    attempts = 0
-    while len(results) < num_nodes:
-        if attempts >= RETRY:
-            info("Cannot contact all organizations!")
-            break
+    # organizations that never published an address count as failures too
+    reached = {e["organization_id"] for e in echos}
+    for org_id in other_nodes:
+        if org_id not in reached:
+            echos.append({
+                "organization_id": org_id, "ip": None, "port": None,
+                "success": False, "error": "No VPN address found",
+                "time_to_ready": None,
+            })
+    return echos
 
-        info("Polling results for port numbers...")
-        results = get_vpn_addresses(client, subtask)
-        info(results)
-        attempts += 1
-        sleep(4)
 
-    info(str(results))
-    return results
+def _backoff(attempt: int, deadline: float) -> float:
+    """Exponential backoff with jitter, never sleeping past the deadline."""
+    delay = min(BACKOFF_MAX, BACKOFF_START * 2 ** attempt)
+    delay *= random.uniform(0.5, 1)
+    return max(min(delay, deadline - time.monotonic()), 0)
 
 
 def get_vpn_addresses(client, subtask):
@@ -113,53 +196,265 @@ def get_vpn_addresses(client, subtask):
     return [r for r in results if r["task_id"] == subtask]
 
 
-def _check_echo(host: str, port: int) -> bool:
-    info(f"Checking echo on {host}:{port}")
+async def _check_echo(
+    address: dict[str, Any], semaphore: asyncio.Semaphore, start: float,
+    deadline: float
+) -> dict:
+    """
+    Wait until the echo server at the address accepts connections, then echo.
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.settimeout(TIMEOUT)
-        s.connect((host, port))
-        s.sendall(MESSAGE)
-        response = s.recv(len(MESSAGE))
+    Connection attempts are retried with backoff until ``deadline``, as the
+    address is published before the echo server in the container is started.
+    """
+    host = address["ip"]
+    port = address["port"]
+    result = {
+        "organization_id": address.get("organization_id"), "ip": host,
+        "port": port, "success": False, "error": None, "time_to_ready": None,
+    }
+    info(f"Checking echo on {host}:{port}")
+    attempt = 0
+    last_error = None
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            info(f"{host}:{port} did not become ready: {last_error!r}")
+            result["error"] = (
+                f"Not ready after {READY_TIMEOUT} seconds: {last_error!r}"
+            )
+            return result
+
+        async with semaphore:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port),
+                    min(TIMEOUT, remaining)
+                )
+            except (asyncio.TimeoutError, OSError) as exc:
+                last_error = exc
+            else:
+                result["time_to_ready"] = time.monotonic() - start
+                try:
+                    result["success"] = await asyncio.wait_for(
+                        _echo(reader, writer), TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    info(f"Timeout on {host}:{port}")
+                    result["error"] = f"Timeout after {TIMEOUT} seconds"
+                except OSError as exc:
+                    info(f"Echo to {host}:{port} failed: {exc}")
+                    result["error"] = repr(exc)
+                return result
+
+        await asyncio.sleep(_backoff(attempt, deadline))
+        attempt += 1
+
+
+async def _echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) \
+        -> bool:
+    try:
+        writer.write(MESSAGE)
+        await writer.drain()
+        response = await reader.readline()
         return response == MESSAGE
+    finally:
+        writer.close()
 
 
-def RPC_echo(*args, **kwargs):
+def RPC_echo(*args, duration: float = TIMEOUT, port: int = ECHO_PORT,
+             **kwargs):
     """
     Start echo socket server
     """
-    asyncio.run(_serve_echo())
+    asyncio.run(_serve_echo(duration, port=port))
     return
 
 
+@timed
+def diagnose_vpn_mesh(client: "AlgorithmClient", other_nodes: list[int],
+                      **kwargs) -> DiagnosticResult:
+    """
+    Diagnose the VPN connections between all pairs of nodes.
+
+    Every node runs an echo server and probes all other nodes at the same
+    time (see `RPC_mesh`). The rows reported by the nodes are assembled into
+    N x N matrices of reachability, RTT (median, in ms) and download
+    throughput (MB/s), where entry ``[i][j]`` is measured from node ``i`` to
+    node ``j``. Keyword arguments are passed to `RPC_mesh`.
+    """
+    header('Diagnosing VPN mesh')
+
+    try:
+        info(f"Dispatching mesh tasks to organizations {other_nodes}")
+        with span("create_subtask"):
+            subtask = client.task.create(
+                input_={
+                    "method": "RPC_mesh",
+                    "kwargs": {"organizations": other_nodes, **kwargs},
+                },
+                organizations=other_nodes,
+            )
+        with span("wait"):
+            rows = client.wait_for_results(subtask["id"])
+        matrix = _assemble_matrix(other_nodes, rows)
+        success = all(
+            reachable
+            for i, row in enumerate(matrix['reachable'])
+            for j, reachable in enumerate(row) if i != j
+        )
+        diagnostic = DiagnosticResult('VPN mesh', success, rows,
+                                      metrics={'matrix': matrix})
+    except Exception as e:
+        diagnostic = DiagnosticResult('VPN mesh', False, exception=e)
+
+    print(diagnostic)
+    return diagnostic
+
+
+def _assemble_matrix(organizations: list[int], rows: list[dict]) -> dict:
+    """Combine the rows reported by the nodes into N x N matrices."""
+    index = {org_id: i for i, org_id in enumerate(organizations)}
+    n = len(organizations)
+    matrix = {
+        'organizations': organizations,
+        'reachable': [[i == j for j in range(n)] for i in range(n)],
+        'rtt': [[None] * n for _ in range(n)],
+        'throughput': [[None] * n for _ in range(n)],
+    }
+    for row in rows:
+        i = index.get(row.get('organization_id'))
+        if i is None:
+            continue
+        for peer in row['peers']:
+            j = index.get(peer['organization_id'])
+            if j is None:
+                continue
+            matrix['reachable'][i][j] = peer['success']
+            matrix['rtt'][i][j] = (peer.get('rtt') or {}).get('p50')
+            matrix['throughput'][i][j] = \
+                (peer.get('download') or {}).get('throughput')
+    return matrix
+
+
+@algorithm_client
+def RPC_mesh(client: "AlgorithmClient", organizations: list[int],
+             rounds: int = MESH_RTT_ROUNDS,
+             payload_size: int = MESH_PAYLOAD_SIZE, port: int = ECHO_PORT,
+             **kwargs) -> dict:
+    """
+    Run an echo server and probe the echo servers of all other nodes.
+
+    The server keeps running until every peer has reported that it is done
+    probing this node, or until ``MESH_SERVER_TIMEOUT`` has passed.
+
+    Parameters
+    ----------
+    client : AlgorithmClient
+        The client to use for the diagnostics.
+    organizations : list[int]
+        Organizations that take part in the mesh, including this one.
+    rounds : int, optional
+        Number of round-trips used to measure the RTT to each peer.
+    payload_size : int, optional
+        Number of bytes downloaded from each peer to measure the throughput.
+        Peers are measured concurrently, so this is a lower bound.
+    port : int, optional
+        Port to run the echo server on.
+
+    Returns
+    -------
+    dict
+        The organization id of this node and the results for each peer.
+    """
+    peers = [o for o in organizations if o != client.organization_id]
+    return asyncio.run(_mesh(client, peers, rounds, payload_size, port))
+
+
+async def _mesh(client: "AlgorithmClient", peers: list[int], rounds: int,
+                payload_size: int, port: int = ECHO_PORT) -> dict:
+    server = asyncio.create_task(
+        _serve_echo(MESH_SERVER_TIMEOUT, stops=len(peers), port=port)
+    )
+
+    def get_peer_addresses():
+        addresses = client.vpn.get_addresses(label="port8")
+        return [a for a in addresses if a["organization_id"] in peers]
+
+    echos = await _echo_when_ready(get_peer_addresses, peers)
+
+    async def measure(e):
+        if e["success"]:
+            e["rtt"] = await vpn_benchmark.measure_rtt(
+                e["ip"], e["port"], rounds
+            )
+            e["download"] = await vpn_benchmark.measure_download(
+                e["ip"], e["port"], payload_size
+            )
+        if e["ip"]:
+            await vpn_benchmark.stop_server(e["ip"], e["port"])
+
+    await asyncio.gather(*[measure(e) for e in echos])
+    await server
+    return {"organization_id": client.organization_id, "peers": echos}
+
+
 def RPC_wait(*args, **kwargs):
     try:
-        sleep(10000)
+        time.sleep(10000)
     except KeyboardInterrupt:
         pass
     finally:
         return
 
 
-async def _serve_echo():
+async def _serve_echo(duration: float = TIMEOUT, stops: int = 1,
+                      port: int = ECHO_PORT):
+    """
+    Run the echo server for ``duration`` seconds, or until it has received
+    ``stops`` STOP commands.
+    """
     info('Start')
-    server = await asyncio.start_server(_handle_echo, '0.0.0.0', 8888)
+    stop = asyncio.Event()
+    stops_left = stops
+    if stops_left <= 0:
+        stop.set()
+
+    def request_stop():
+        nonlocal stops_left
+        stops_left -= 1
+        if stops_left <= 0:
+            stop.set()
+
+    server = await asyncio.start_server(
+        partial(_handle_echo, request_stop=request_stop), '0.0.0.0', port
+    )
 
-    info(f'Running echo server for {TIMEOUT} seconds...')
+    info(f'Running echo server for {duration} seconds...')
 
     async with server:
-        await asyncio.sleep(TIMEOUT)
+        try:
+            await asyncio.wait_for(stop.wait(), duration)
+            info('Stop requested')
+        except asyncio.TimeoutError:
+            pass
 
     info('Terminated')
 
 
-async def _handle_echo(reader, writer):
+async def _handle_echo(reader, writer, request_stop: Callable = None):
     # Read message
     line = await reader.readline()
 
-    info(f'Received {line.decode()}, will echo')
-    writer.writelines([line])
-    await writer.drain()
+    command, _, argument = line.strip().partition(b' ')
+    if command in vpn_benchmark.COMMANDS:
+        info(f'Received command {line.decode().strip()}')
+        await vpn_benchmark.handle_command(
+            command, argument, reader, writer, request_stop
+        )
+    else:
+        info(f'Received {line.decode()}, will echo')
+        writer.writelines([line])
+        await writer.drain()
 
     print('Close the connection')
     writer.close()
@@ -0,0 +1,271 @@
+"""
+Benchmark VPN links using the echo server that is started by ``RPC_echo``.
+
+Besides echoing a single line, the echo server understands a few commands. A
+command is the first line that is sent over a connection:
+
+    PING
+        Echo every line until the connection is closed. Used to measure the
+        round-trip time (RTT) of many messages over a single connection.
+    SINK <n>
+        Read ``n`` bytes and reply with ``OK``. Used to measure the upload
+        throughput.
+    SOURCE <n>
+        Send ``n`` bytes. Used to measure the download throughput.
+    STOP
+        Stop the echo server, so that the container does not have to wait for
+        the server to time out after the benchmark is done.
+
+Throughput is reported in MB/s (10^6 bytes per second) and latencies in
+milliseconds.
+"""
+import asyncio
+import os
+import time
+
+from typing import Callable
+
+from vantage6.algorithm.tools.util import info
+
+from v6_diagnostics.util import summarize
+
+
+PING = b'PING'
+SINK = b'SINK'
+SOURCE = b'SOURCE'
+STOP = b'STOP'
+COMMANDS = (PING, SINK, SOURCE, STOP)
+
+CHUNK_SIZE = 1024 * 1024
+RTT_ROUNDS = 100
+PAYLOAD_SIZES = [1024, 1024 ** 2, 16 * 1024 ** 2]
+STREAMS = 4
+# operations get this much time on top of the time they would take at the
+# minimal throughput, so that large transfers are not cut short
+TIMEOUT = 20
+MIN_THROUGHPUT = 100_000
+
+
+async def handle_command(
+    command: bytes, argument: bytes, reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter, request_stop: Callable[[], None]
+) -> None:
+    """Server side of the benchmark protocol."""
+    if command == PING:
+        while line := await reader.readline():
+            writer.write(line)
+            await writer.drain()
+    elif command == SINK:
+        remaining = int(argument)
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        writer.write(b'OK\n')
+        await writer.drain()
+    elif command == SOURCE:
+        await _send(writer, int(argument))
+    elif command == STOP:
+        request_stop()
+
+
+async def benchmark_address(
+    host: str, port: int, rounds: int = RTT_ROUNDS,
+    payload_sizes: list[int] | None = None, streams: int = STREAMS
+) -> dict:
+    """
+    Benchmark the link to a single echo server.
+
+    Parameters
+    ----------
+    host : str
+        IP address of the echo server.
+    port : int
+        Port of the echo server.
+    rounds : int, optional
+        Number of round-trips used to measure the RTT.
+    payload_sizes : list[int], optional
+        Sizes in bytes of the bulk transfers in both directions.
+    streams : int, optional
+        Number of concurrent connections used to measure the aggregate
+        throughput. The largest payload size is transferred on each of them.
+
+    Returns
+    -------
+    dict
+        The RTT statistics, the throughput per payload size and the throughput
+        of the concurrent streams. Measurements that failed contain an
+        ``error`` instead.
+    """
+    payload_sizes = payload_sizes or PAYLOAD_SIZES
+    info(f'Benchmarking {host}:{port}')
+    metrics = {
+        'rtt': await measure_rtt(host, port, rounds),
+        'transfers': [],
+    }
+    for size in payload_sizes:
+        metrics['transfers'].append({
+            'size': size,
+            'upload': await _measure(upload(host, port, size), _timeout(size)),
+            'download': await measure_download(host, port, size),
+        })
+
+    if streams > 1:
+        size = max(payload_sizes)
+        metrics['streams'] = {
+            'streams': streams,
+            'size': size,
+            'upload': await _measure(
+                _concurrent(upload, host, port, size, streams),
+                _timeout(size * streams)
+            ),
+            'download': await _measure(
+                _concurrent(download, host, port, size, streams),
+                _timeout(size * streams)
+            ),
+        }
+    return metrics
+
+
+def max_duration(
+    rounds: int = RTT_ROUNDS, payload_sizes: list[int] | None = None,
+    streams: int = STREAMS
+) -> float:
+    """
+    Seconds `benchmark_address` takes at most with these options, i.e. when
+    every measurement times out.
+    """
+    payload_sizes = payload_sizes or PAYLOAD_SIZES
+    seconds = TIMEOUT + rounds
+    seconds += sum(2 * _timeout(size) for size in payload_sizes)
+    if streams > 1:
+        seconds += 2 * _timeout(max(payload_sizes) * streams)
+    return seconds
+
+
+async def measure_rtt(host: str, port: int, rounds: int = RTT_ROUNDS) -> dict:
+    """Measure the RTT, reporting failures instead of raising them."""
+    return await _measure(rtt(host, port, rounds), TIMEOUT + rounds)
+
+
+async def measure_download(host: str, port: int, size: int) -> dict:
+    """Measure the download throughput, reporting failures instead of raising
+    them."""
+    return await _measure(download(host, port, size), _timeout(size))
+
+
+async def rtt(host: str, port: int, rounds: int = RTT_ROUNDS) -> dict:
+    """Measure round-trip times of short messages over one connection."""
+    reader, writer = await asyncio.open_connection(host, port)
+    rtts = []
+    try:
+        writer.write(PING + b'\n')
+        for i in range(rounds):
+            message = f'{i}\n'.encode()
+            start = time.perf_counter()
+            writer.write(message)
+            await writer.drain()
+            if await reader.readline() != message:
+                raise ConnectionError(f'Unexpected echo in round {i}')
+            rtts.append((time.perf_counter() - start) * 1000)
+    finally:
+        writer.close()
+
+    stats = summarize(rtts)
+    # mean variation between consecutive round-trips, like RFC 3550 jitter
+    stats['jitter'] = (
+        sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+        if len(rtts) > 1 else 0.0
+    )
+    return stats
+
+
+async def upload(host: str, port: int, size: int) -> dict:
+    """Measure the throughput of sending ``size`` bytes to the server."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        start = time.perf_counter()
+        writer.write(SINK + f' {size}\n'.encode())
+        await _send(writer, size)
+        if await reader.readline() != b'OK\n':
+            raise ConnectionError('Server did not confirm the upload')
+        return _throughput(size, time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def download(host: str, port: int, size: int) -> dict:
+    """Measure the throughput of receiving ``size`` bytes from the server."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        start = time.perf_counter()
+        writer.write(SOURCE + f' {size}\n'.encode())
+        await writer.drain()
+        remaining = size
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise ConnectionError(
+                    f'Connection closed, {remaining} bytes left'
+                )
+            remaining -= len(chunk)
+        return _throughput(size, time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def stop_server(host: str, port: int) -> None:
+    """Ask the echo server to stop, ignoring servers that are already gone."""
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), TIMEOUT
+        )
+        writer.write(STOP + b'\n')
+        await writer.drain()
+        writer.close()
+    except (asyncio.TimeoutError, OSError) as exc:
+        info(f'Could not stop echo server {host}:{port}: {exc!r}')
+
+
+async def _concurrent(transfer, host: str, port: int, size: int,
+                      streams: int) -> dict:
+    """Run ``transfer`` on multiple connections at once."""
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[transfer(host, port, size) for _ in range(streams)]
+    )
+    aggregate = _throughput(size * streams, time.perf_counter() - start)
+    aggregate['per_stream'] = summarize([r['throughput'] for r in results])
+    return aggregate
+
+
+async def _measure(coroutine, timeout: float) -> dict:
+    """Run a measurement, reporting failures instead of raising them."""
+    try:
+        return await asyncio.wait_for(coroutine, timeout)
+    except asyncio.TimeoutError:
+        return {'error': f'Timeout after {timeout:.0f} seconds'}
+    except (OSError, ValueError) as exc:
+        return {'error': repr(exc)}
+
+
+async def _send(writer: asyncio.StreamWriter, size: int) -> None:
+    # random, so that compression on the link does not inflate the throughput
+    chunk = os.urandom(min(size, CHUNK_SIZE))
+    remaining = size
+    while remaining > 0:
+        writer.write(chunk[:remaining])
+        await writer.drain()
+        remaining -= len(chunk)
+
+
+def _throughput(size: int, seconds: float) -> dict:
+    return {
+        'seconds': seconds,
+        'throughput': size / seconds / 1e6 if seconds > 0 else None,
+    }
+
+
+def _timeout(size: int) -> float:
+    return TIMEOUT + size / MIN_THROUGHPUT
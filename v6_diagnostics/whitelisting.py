@@ -0,0 +1,380 @@
+"""
+Diagnose the whitelisting of the node.
+
+Algorithm containers are isolated from the internet, except for the domains,
+IP addresses and ports that are whitelisted in the node configuration.
+Whitelisted traffic is routed through a proxy that the node sets in the
+``HTTP_PROXY`` and ``HTTPS_PROXY`` environment variables of the algorithm
+container, which HTTP(S) requests use automatically.
+
+This diagnostic probes the targets that should be allowed and the targets
+that should not be allowed, and reports for each of them whether its
+reachability is as expected. Targets are strings in one of the forms of
+`v6_diagnostics.network`, or one of the following shorthands:
+
+    ``<host>``
+        Same as ``https://<host>``.
+    ``<host>:<port>``
+        Same as ``tcp:<host>:<port>``.
+
+A ``dns:`` target is for information only (see `v6_diagnostics.network`), it
+is never unexpected.
+
+Every host name is resolved once, through a cache that is shared by all
+probes. TCP connections, and HTTP(S) requests that do not go through a proxy,
+are made to the cached address (with the host name in the ``Host`` header and
+for TLS), so their latencies exclude the name resolution. Requests through a
+proxy are sent with the host name, which the proxy resolves and checks
+against the whitelist. Probes run concurrently on a bounded number of daemon
+threads and the diagnostic finishes within a time budget, by default long
+enough for every probe to time out. Targets that were not probed within the
+budget are reported as ``not_probed``, and fail the diagnostic: they are
+neither expected nor unexpected. Latencies are in milliseconds.
+"""
+import ipaddress
+import math
+import queue
+import socket
+import ssl
+import threading
+import time
+
+from urllib.parse import urlparse
+
+from v6_diagnostics.util import DiagnosticResult, header, timed
+from v6_diagnostics.network import (
+    TIMEOUT, classify, connect, get, resolve
+)
+
+
+MAX_WORKERS = 16
+# None to probe all disallowed targets
+SAMPLE = None
+# reachable from the internet, but unlikely to be whitelisted by any node
+DISALLOWED = [
+    "https://example.com",
+    "http://example.org",
+    "tcp:1.1.1.1:443",
+    "tcp:9.9.9.9:443",
+]
+
+
+class DNSCache:
+    """
+    Resolve each host name once, also when it is requested concurrently.
+
+    Lookups run on daemon threads, so that a resolver that hangs only costs
+    ``timeout`` seconds and does not keep the container alive. Failed lookups
+    are cached as well.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Seconds to wait for a lookup.
+    """
+
+    def __init__(self, timeout: float = TIMEOUT) -> None:
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._lookups: dict[str, _Lookup] = {}
+
+    def resolve(self, host: str) -> list[str]:
+        """Return the addresses of a host, IP addresses are returned as is."""
+        try:
+            return [str(ipaddress.ip_address(host.strip("[]")))]
+        except ValueError:
+            pass
+
+        with self._lock:
+            lookup = self._lookups.get(host)
+            if lookup is None:
+                self.misses += 1
+                lookup = self._lookups[host] = _Lookup(host)
+            else:
+                self.hits += 1
+        return lookup.result(self.timeout)
+
+    @property
+    def stats(self) -> dict:
+        """Number of hosts, cache hits and cache misses."""
+        return {
+            "hosts": len(self._lookups),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class _Lookup:
+    """A host name lookup that runs on a daemon thread."""
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.started = time.monotonic()
+        self.addresses = None
+        self.error = None
+        self._done = threading.Event()
+        threading.Thread(
+            target=self._run, daemon=True, name=f"resolve-{host}"
+        ).start()
+
+    def _run(self) -> None:
+        try:
+            self.addresses = resolve(self.host)
+        except Exception as exc:
+            self.error = exc
+        self._done.set()
+
+    def result(self, timeout: float) -> list[str]:
+        remaining = self.started + timeout - time.monotonic()
+        if not self._done.wait(max(remaining, 0)):
+            raise TimeoutError(
+                f"Resolving {self.host} took longer than {timeout} seconds"
+            )
+        if self.error is not None:
+            raise self.error
+        return self.addresses
+
+
+def normalize(target: str) -> str:
+    """Expand the shorthands of the module docstring to a full target."""
+    if target.startswith(("http://", "https://", "dns:", "tcp:")):
+        return target
+    host, _, port = target.rpartition(":")
+    if host and port.isdigit() and not host.endswith(":"):
+        return f"tcp:{target}"
+    return f"https://{target}"
+
+
+def probe_target(target: str, cache: DNSCache, timeout: float = TIMEOUT) \
+        -> dict:
+    """
+    Probe a single target, resolving its host name through the cache.
+
+    Parameters
+    ----------
+    target : str
+        The target, see the module docstring.
+    cache : DNSCache
+        The cache to resolve host names with.
+    timeout : float, optional
+        Seconds to wait for the target to answer.
+
+    Returns
+    -------
+    dict
+        The status (see `v6_diagnostics.network`), the addresses of the
+        host, the latency and the error, if any.
+    """
+    target = normalize(target)
+    result = {"target": target, "addresses": None, "latency": None,
+              "error": None}
+    try:
+        if target.startswith(("http://", "https://")):
+            import requests
+
+            parsed = urlparse(target)
+            host = parsed.hostname
+            proxy = requests.utils.get_environ_proxies(target).get(
+                parsed.scheme
+            )
+            result["proxy"] = proxy
+            try:
+                result["addresses"] = cache.resolve(host)
+            except Exception as exc:
+                # whitelisted domains may only be resolved by the proxy
+                if not proxy:
+                    raise
+                result["dns_error"] = repr(exc)
+            start = time.perf_counter()
+            if proxy:
+                result["detail"] = get(target, timeout)
+            else:
+                result["detail"] = get_address(
+                    target, result["addresses"][0], timeout
+                )
+        elif target.startswith("dns:"):
+            start = time.perf_counter()
+            result["addresses"] = cache.resolve(target[len("dns:"):])
+        else:
+            host, _, port = target[len("tcp:"):].rpartition(":")
+            result["addresses"] = cache.resolve(host)
+            start = time.perf_counter()
+            result["detail"] = connect(
+                result["addresses"][0], int(port), timeout
+            )
+        result["latency"] = (time.perf_counter() - start) * 1000
+        result["status"] = "reachable"
+    except Exception as exc:
+        result["status"] = classify(exc)
+        result["error"] = repr(exc)
+    return result
+
+
+def get_address(url: str, address: str, timeout: float = TIMEOUT) -> int:
+    """
+    Send a GET request to ``address`` instead of the host of the URL.
+
+    The host name of the URL is still sent in the ``Host`` header and used to
+    verify the TLS certificate, so that the request is the same as one to the
+    host name. Returns the status code.
+    """
+    # imported here, so that the package imports fast in child tasks
+    import http.client
+
+    parsed = urlparse(url)
+    https = parsed.scheme == "https"
+    sock = socket.create_connection(
+        (address, parsed.port or (443 if https else 80)), timeout=timeout
+    )
+    if https:
+        sock = ssl.create_default_context().wrap_socket(
+            sock, server_hostname=parsed.hostname
+        )
+    connection_class = \
+        http.client.HTTPSConnection if https else http.client.HTTPConnection
+    connection = connection_class(
+        parsed.hostname, parsed.port, timeout=timeout
+    )
+    # a connection that has a socket does not connect itself
+    connection.sock = sock
+    try:
+        connection.request("GET", parsed.path or "/")
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def probe_whitelist(
+    allowed: list[str],
+    disallowed: list[str] | None = None,
+    sample: int | None = SAMPLE,
+    max_workers: int = MAX_WORKERS,
+    timeout: float = TIMEOUT,
+    budget: float | None = None,
+) -> dict:
+    """
+    Probe allowed and disallowed targets concurrently.
+
+    Parameters
+    ----------
+    allowed : list[str]
+        Targets that should be reachable.
+    disallowed : list[str], optional
+        Targets that should not be reachable, by default `DISALLOWED`.
+    sample : int | None, optional
+        Number of disallowed targets to probe, the first ones of the list.
+        None to probe all of them.
+    max_workers : int, optional
+        Maximum number of probes that run at the same time.
+    timeout : float, optional
+        Seconds to wait for each target (and each name resolution).
+    budget : float | None, optional
+        Seconds after which probes that have not finished are reported as
+        dropped, and targets that were not probed yet as ``not_probed``. By
+        default every worker has the time to let each of its probes time out
+        (in the name resolution and in the probe itself).
+
+    Returns
+    -------
+    dict
+        The probes, with for each of them whether it was expected to be
+        reachable and whether it was (None for ``dns:`` targets), and the
+        statistics of the DNS cache.
+    """
+    disallowed = list(DISALLOWED if disallowed is None else disallowed)
+    if sample is not None:
+        disallowed = disallowed[:sample]
+    expected = [(t, True) for t in allowed] + [(t, False) for t in disallowed]
+    workers = min(max(max_workers, 1), len(expected))
+    if budget is None:
+        budget = math.ceil(len(expected) / max(workers, 1)) * 2 * timeout
+
+    cache = DNSCache(timeout)
+    todo = queue.Queue()
+    for i, (target, _) in enumerate(expected):
+        todo.put((i, target))
+    finished = queue.Queue()
+    started: set[int] = set()
+    stop = threading.Event()
+
+    def work():
+        while not stop.is_set():
+            try:
+                i, target = todo.get_nowait()
+            except queue.Empty:
+                return
+            started.add(i)
+            finished.put((i, probe_target(target, cache, timeout)))
+
+    # daemon threads, so that probes that hang do not keep the container alive
+    for n in range(workers):
+        threading.Thread(
+            target=work, daemon=True, name=f"whitelist-{n}"
+        ).start()
+
+    results: list[dict | None] = [None] * len(expected)
+    deadline = time.monotonic() + budget
+    for _ in expected:
+        try:
+            i, result = finished.get(
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+        except queue.Empty:
+            break
+        results[i] = result
+    stop.set()
+
+    probes = []
+    for i, ((target, is_allowed), probe) in enumerate(zip(expected, results)):
+        if probe is None and i in started:
+            probe = {
+                "target": normalize(target), "status": "dropped",
+                "addresses": None, "latency": None,
+                "error": f"No answer within {budget} seconds",
+            }
+        elif probe is None:
+            probe = {
+                "target": normalize(target), "status": "not_probed",
+                "addresses": None, "latency": None,
+                "error": f"Not probed within {budget} seconds",
+            }
+        probe["allowed"] = is_allowed
+        if probe["status"] == "not_probed" or \
+                probe["target"].startswith("dns:"):
+            probe["as_expected"] = None
+        else:
+            probe["as_expected"] = (probe["status"] == "reachable") == \
+                is_allowed
+        probes.append(probe)
+    return {"probes": probes, "dns": cache.stats}
+
+
+@timed
+def diagnose_whitelisting(allowed: list[str], **probe_options) \
+        -> DiagnosticResult:
+    """Diagnose that exactly the whitelisted targets are reachable."""
+    header("Diagnose the whitelisting of the node")
+    try:
+        metrics = probe_whitelist(allowed, **probe_options)
+        unexpected = [
+            p["target"] for p in metrics["probes"]
+            if p["as_expected"] is False
+        ]
+        not_probed = [
+            p["target"] for p in metrics["probes"]
+            if p["status"] == "not_probed"
+        ]
+        payload = None
+        if unexpected or not_probed:
+            payload = {"unexpected": unexpected, "not_probed": not_probed}
+        diagnostic = DiagnosticResult(
+            "WHITELISTING", not unexpected and not not_probed,
+            payload=payload, metrics=metrics
+        )
+    except Exception as exc:
+        diagnostic = DiagnosticResult("WHITELISTING", False, exception=exc)
+
+    print(diagnostic)
+    return diagnostic